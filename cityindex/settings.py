@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import plotly
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -46,10 +52,33 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Учёт SQL-запросов и времени ответа по представлениям (core/middleware.py):
+# заголовок Server-Timing и JSON-строка в логгер core.instrumentation
+QUERY_INSTRUMENTATION = os.getenv('CITYINDEX_QUERY_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+
+if QUERY_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'core.middleware.QueryInstrumentationMiddleware')
+
+# Профили запросов сотрудников (?profile=1): лимиты хранилища RequestProfile
+PROFILE_STORE_MAX_MB = int(os.getenv('CITYINDEX_PROFILE_STORE_MAX_MB', 50))
+PROFILE_STORE_MAX_COUNT = int(os.getenv('CITYINDEX_PROFILE_STORE_MAX_COUNT', 200))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'cityindex.urls'
 
 TEMPLATES = [
@@ -81,6 +110,35 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Страницы рейтинга кэшируются по версии данных (core/caching.py). Версия
+# читается из таблицы DataVersion, поэтому после загрузки данных в другом
+# процессе (fetch_data.py, rebuild_scores) новые ключи подхватывает любой
+# бэкенд, включая locmem. Общий бэкенд (file, redis, memcached) нужен лишь
+# для того, чтобы воркеры не считали одни и те же страницы по отдельности.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+
+CACHE_BACKEND = os.getenv('CITYINDEX_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.getenv(
+            'CITYINDEX_CACHE_LOCATION',
+            str(BASE_DIR / 'cache') if CACHE_BACKEND == 'file' else 'cityindex',
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 5000} if CACHE_BACKEND in ('locmem', 'file') else {},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -117,6 +175,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# plotly.js отдаётся локально из пакета plotly (см. compare.html)
+STATICFILES_DIRS = [
+    ('plotly', Path(plotly.__file__).resolve().parent / 'package_data'),
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -126,5 +189,4 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
-import os
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
\ No newline at end of file
@@ -1,5 +1,13 @@
 from django.contrib import admin
-from .models import Locality, EconomicData, InfrastructureData
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+from .models import (
+    Locality, EconomicData, InfrastructureData, CityScore, RegionStats,
+    IngestionRun, IngestionItem, RequestProfile,
+)
 
 
 @admin.register(Locality)
@@ -18,4 +26,84 @@ class EconomicDataAdmin(admin.ModelAdmin):
 class InfrastructureDataAdmin(admin.ModelAdmin):
     list_display = ('locality', 'schools', 'gas_stations', 'bus_stops')
     search_fields = ('locality__city',)
-    list_filter = ('locality__region',)
\ No newline at end of file
+    list_filter = ('locality__region',)
+
+@admin.register(CityScore)
+class CityScoreAdmin(admin.ModelAdmin):
+    list_display = ('locality', 'region', 'inv_index', 'rank', 'region_rank', 'data_version')
+    search_fields = ('locality__city', 'region')
+    list_filter = ('region',)
+    readonly_fields = ('locality', 'region', 'eco_score', 'demo_score', 'infra_score',
+                       'inv_index', 'rank', 'region_rank', 'data_version', 'updated_at')
+
+
+@admin.register(RegionStats)
+class RegionStatsAdmin(admin.ModelAdmin):
+    list_display = ('region', 'ndfl_median', 'schools_per_1k', 'gas_stations_per_1k',
+                    'bus_stops_per_1k', 'data_version')
+    search_fields = ('region',)
+    readonly_fields = ('region', 'ndfl_median', 'schools_per_1k', 'gas_stations_per_1k',
+                       'bus_stops_per_1k', 'data_version', 'updated_at')
+
+
+class IngestionItemInline(admin.TabularInline):
+    model = IngestionItem
+    fields = ('oktmo_code', 'city_name', 'status', 'updated_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = False
+
+
+@admin.register(IngestionRun)
+class IngestionRunAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'status', 'total', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'total', 'started_at', 'finished_at', 'report')
+    inlines = [IngestionItemInline]
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status', 'total_ms',
+                    'queries', 'db_ms', 'user', 'download_link')
+    list_filter = ('view_name', 'method')
+    search_fields = ('path',)
+    fields = ('created_at', 'user', 'method', 'path', 'view_name', 'status', 'total_ms',
+              'queries', 'db_ms', 'size', 'download_link', 'summary_display', 'query_log_display')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download),
+                 name='core_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, pk):
+        """Профиль в формате pstats: python -m pstats, snakeviz"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}.prof"'
+        return response
+
+    @admin.display(description="Профиль")
+    def download_link(self, obj):
+        return format_html('<a href="{}">.prof</a>', reverse('admin:core_requestprofile_download', args=[obj.pk]))
+
+    @admin.display(description="Самые затратные функции")
+    def summary_display(self, obj):
+        return format_html('<pre>{}</pre>', obj.summary)
+
+    @admin.display(description="Журнал SQL-запросов")
+    def query_log_display(self, obj):
+        return format_html_join(
+            '', '<pre>{} мс · {}</pre>', ((query['ms'], query['sql']) for query in obj.query_log),
+        )
@@ -0,0 +1,180 @@
+"""
+JSON API рейтинга только для чтения.
+
+Все ответы помечаются ETag по версии данных. Повторный запрос с
+совпадающим If-None-Match получает 304 после одного запроса версии по
+первичному ключу, без выборки городов и без сериализации.
+"""
+from functools import wraps
+
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from . import charts
+from .forms import CityFilterForm, ComparisonForm, max_compared_cities
+from .models import DataVersion, Locality, RegionStats
+from .pagination import InvalidCursor, KeysetPaginator, SortField
+
+
+API_MAX_LIMIT = 500
+
+RANKING_SORT_FIELDS = {
+    'rank': SortField("Место", 'score__rank', 'asc'),
+}
+
+
+def versioned(view=None, *, variant=None):
+    """
+    ETag по версии данных и условный GET (If-None-Match → 304).
+    variant(request) — часть ответа, зависящая от пользователя: она входит
+    в ETag, а ответ получает Vary: Cookie, чтобы общие кэши и условные
+    запросы не отдавали его другому пользователю.
+    """
+    if view is None:
+        return lambda view: versioned(view, variant=variant)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        tag = f'v{DataVersion.current()}'
+        if variant is not None:
+            tag += f'-{variant(request)}'
+        etag = f'"{tag}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.headers['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        if variant is not None:
+            patch_vary_headers(response, ['Cookie'])
+        return response
+    return wrapper
+
+
+def _comparison_limit(request):
+    return f'max{max_compared_cities(request.user)}'
+
+
+def _scored_cities():
+    return Locality.objects.filter(
+        is_active=True, score__isnull=False,
+    ).with_latest_economics().select_related('score', 'infrastructure')
+
+
+def _city_summary(city):
+    score = city.score
+    return {
+        'id': city.pk,
+        'city': city.city,
+        'region': city.region,
+        'population': city.population,
+        'oktmo_code': city.oktmo_code,
+        'ndfl_total': city.ndfl_total,
+        'unemployment_rate': city.unemployment_rate,
+        'eco_score': score.eco_score,
+        'demo_score': score.demo_score,
+        'infra_score': score.infra_score,
+        'inv_index': score.inv_index,
+        'rank': score.rank,
+        'region_rank': score.region_rank,
+    }
+
+
+def _city_breakdown(city, stats):
+    data = _city_summary(city)
+    infra = getattr(city, 'infrastructure', None)
+    data['infrastructure'] = {
+        'schools': infra.schools,
+        'gas_stations': infra.gas_stations,
+        'bus_stops': infra.bus_stops,
+    } if infra else None
+    data['region_baseline'] = {
+        'ndfl_per_capita': stats.ndfl_median,
+        'schools_per_1k': stats.schools_per_1k,
+        'gas_stations_per_1k': stats.gas_stations_per_1k,
+        'bus_stops_per_1k': stats.bus_stops_per_1k,
+    } if stats else None
+    return data
+
+
+def _limit(request, default=20):
+    try:
+        return max(1, min(int(request.GET.get('limit', default)), API_MAX_LIMIT))
+    except ValueError:
+        return default
+
+
+def _errors(form):
+    return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+
+
+@versioned
+def ranking(request):
+    """Общий рейтинг с фильтрами CityFilterForm и курсором after"""
+    form = CityFilterForm(request.GET or None)
+    if form.is_bound and not form.is_valid():
+        return _errors(form)
+    paginator = KeysetPaginator(
+        form.filter_queryset(_scored_cities()), RANKING_SORT_FIELDS, 'rank', 'asc',
+        page_size = _limit(request),
+    )
+    try:
+        page = paginator.page(after=request.GET.get('after'))
+    except InvalidCursor as e:
+        return JsonResponse({'errors': {'after': [str(e)]}}, status=400)
+    return JsonResponse({
+        'version': DataVersion.current(),
+        'results': [_city_summary(city) for city in page['object_list']],
+        'next': page['next_cursor'],
+    })
+
+
+@versioned
+def region_ranking(request, region):
+    """Таблица городов региона по месту в регионе"""
+    cities = _scored_cities().filter(region=region).order_by('score__region_rank')
+    results = [_city_summary(city) for city in cities]
+    if not results:
+        return JsonResponse({'errors': {'region': ["Регион не найден"]}}, status=404)
+    return JsonResponse({
+        'version': DataVersion.current(),
+        'region': region,
+        'results': results,
+    })
+
+
+@versioned
+def city_detail(request, pk):
+    """Разбивка индекса города с региональными базами сравнения"""
+    city = get_object_or_404(_scored_cities(), pk=pk)
+    stats = RegionStats.objects.filter(region=city.region).first()
+    return JsonResponse({
+        'version': DataVersion.current(),
+        **_city_breakdown(city, stats),
+    })
+
+
+@versioned(variant=_comparison_limit)
+def compare(request):
+    """Сравнение городов: ?cities=1&cities=2 с лимитами ComparisonForm"""
+    form = ComparisonForm(request.GET, user=request.user)
+    if not form.is_valid():
+        return _errors(form)
+    ids = [city.pk for city in form.cleaned_data['cities']]
+    cities = _scored_cities().filter(pk__in=ids).order_by('score__rank')
+    stats = RegionStats.objects.in_bulk([city.region for city in cities], field_name='region')
+    return JsonResponse({
+        'version': DataVersion.current(),
+        'results': [_city_breakdown(city, stats.get(city.region)) for city in cities],
+    })
+
+
+@versioned(variant=_comparison_limit)
+def compare_figure(request):
+    """Только JSON фигуры сравнения (data + layout) для отрисовки на клиенте"""
+    form = ComparisonForm(request.GET, user=request.user)
+    if not form.is_valid():
+        return _errors(form)
+    content = charts.compare_figure_json([city.pk for city in form.cleaned_data['cities']])
+    return HttpResponse(content, content_type='application/json')
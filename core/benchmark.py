@@ -0,0 +1,189 @@
+"""
+Бенчмарк представлений на текущем каталоге городов.
+
+Каждый сценарий — запрос через django.test.Client со всем стеком
+MIDDLEWARE (сессии, аутентификация, сообщения, учёт запросов, если он
+включён), с холодным или прогретым кэшем страниц. Для сценариев с
+авторизацией создаётся временный пользователь с сессией; после прогона
+он удаляется. По итерациям
+собираются перцентили времени ответа и число SQL-запросов, пиковая
+память измеряется отдельным прогоном под tracemalloc (учитываются только
+выделения Python). Отчёт — JSON, который можно сравнить с отчётом
+другого коммита (compare_reports).
+"""
+import platform
+import subprocess
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import django
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from .middleware import QueryStats
+from .models import CityScore, EconomicData, InfrastructureData, Locality
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Хост из ALLOWED_HOSTS: запросы проходят и проверку CommonMiddleware
+SERVER_NAME = '127.0.0.1'
+
+
+class Scenario:
+    """Один замер: URL (имя маршрута), запрос и состояние кэша"""
+
+    def __init__(self, name, url, method='get', data=None, cold=True, authenticated=False):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.data = data
+        self.cold = cold
+        self.authenticated = authenticated
+
+    def run(self, clients):
+        """Один запрос; тело потоковых ответов читается целиком"""
+        if self.cold:
+            cache.clear()
+        client = clients[self.authenticated]
+        response = getattr(client, self.method)(reverse(self.url), self.data)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+
+@contextmanager
+def clients():
+    """
+    Клиенты для сценариев: анонимный (False) и с сессией временного
+    пользователя (True). Пользователь и его сессия удаляются на выходе.
+    """
+    user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}')
+    authenticated = Client(SERVER_NAME=SERVER_NAME)
+    authenticated.force_login(user)
+    try:
+        yield {False: Client(SERVER_NAME=SERVER_NAME), True: authenticated}
+    finally:
+        authenticated.logout()
+        user.delete()
+
+
+def default_scenarios():
+    """Сценарии по данным текущего каталога"""
+    largest_region = Locality.objects.filter(is_active=True).values('region').annotate(
+        cities = Count('pk'),
+    ).order_by('-cities', 'region').values_list('region', flat=True).first()
+    top = list(CityScore.objects.order_by('rank').values_list('locality_id', flat=True)[:10])
+
+    return [
+        Scenario('home:cold', 'home'),
+        Scenario('home:warm', 'home', cold=False),
+        Scenario('main:cold', 'main'),
+        Scenario('main:warm', 'main', cold=False),
+        Scenario('main:region', 'main', data={'region': largest_region}),
+        Scenario('main:population', 'main', data={'population_min': 10000, 'population_max': 100000}),
+        Scenario('main:region+population+sort', 'main',
+                 data={'region': largest_region, 'population_min': 10000, 'sort': 'population', 'dir': 'asc'}),
+        Scenario('main:sort_city', 'main', data={'sort': 'city'}),
+        Scenario('compare:3', 'compare', data={'cities': top[:3]}),
+        Scenario('compare:10', 'compare', data={'cities': top[:10]}, authenticated=True),
+        Scenario('export_csv', 'export_csv', authenticated=True),
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(scenario, clients, iterations, warmup=1):
+    """Перцентили времени, число запросов и пиковая память сценария"""
+    for _ in range(warmup):
+        scenario.run(clients)
+
+    timings = []
+    queries = []
+    status = None
+    for _ in range(iterations):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with stats.capture():
+            response = scenario.run(clients)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(stats.queries)
+        status = response.status_code
+
+    tracemalloc.start()
+    try:
+        scenario.run(clients)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        'scenario': scenario.name,
+        'status': status,
+        'iterations': iterations,
+        'latency_ms': {
+            **{f'p{p}': round(float(np.percentile(timings, p)), 3) for p in PERCENTILES},
+            'mean': round(float(timings.mean()), 3),
+            'min': round(float(timings.min()), 3),
+            'max': round(float(timings.max()), 3),
+        },
+        'queries': int(np.median(queries)),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(iterations=10, only=None):
+    """Отчёт по всем сценариям (или по сценариям из only)"""
+    scenarios = [s for s in default_scenarios() if not only or s.name in only]
+    with clients() as scenario_clients:
+        results = [measure(scenario, scenario_clients, iterations) for scenario in scenarios]
+    return {
+        'commit': _git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'dataset': {
+            'cities': Locality.objects.count(),
+            'regions': Locality.objects.values('region').distinct().count(),
+            'economicdata': EconomicData.objects.count(),
+            'infrastructuredata': InfrastructureData.objects.count(),
+        },
+        'scenarios': results,
+    }
+
+
+def compare_reports(baseline, current, percentile='p50'):
+    """Строки сравнения двух отчётов: время, запросы и память относительно baseline"""
+    previous = {item['scenario']: item for item in baseline['scenarios']}
+    lines = []
+    for item in current['scenarios']:
+        before = previous.get(item['scenario'])
+        if before is None:
+            lines.append(f"{item['scenario']}: нет в базовом отчёте")
+            continue
+        old, new = before['latency_ms'][percentile], item['latency_ms'][percentile]
+        change = f"{(new / old - 1) * 100:+.0f}%" if old else "—"
+        lines.append(
+            f"{item['scenario']}: {percentile} {old:.1f} → {new:.1f} мс ({change}), "
+            f"запросов {before['queries']} → {item['queries']}, "
+            f"память {before['peak_memory_kb']:.0f} → {item['peak_memory_kb']:.0f} КБ"
+        )
+    return lines
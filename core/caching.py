@@ -0,0 +1,42 @@
+"""
+Кэш страниц рейтинга поверх фреймворка кэширования Django.
+
+Ключ состоит из пространства имён, глобальной версии данных и
+нормализованных параметров запроса. Версию увеличивают загрузка данных и
+изменения моделей (DataVersion.bump), поэтому записи не устаревают и
+не требуют подбора TTL: после смены версии старые ключи просто перестают
+запрашиваться и вытесняются самим бэкендом.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from .models import DataVersion
+
+
+def versioned_key(namespace, params=None):
+    """Ключ кэша для текущей версии данных; безопасен для memcached"""
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha1(payload.encode()).hexdigest()
+    return f'core:{namespace}:v{DataVersion.current()}:{digest}'
+
+
+def cached(namespace, params, compute):
+    """Значение из кэша по версии данных или результат compute()"""
+    key = versioned_key(namespace, params)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, None)
+    return value
+
+
+def filter_params(form):
+    """Нормализованные параметры CityFilterForm для ключа кэша"""
+    if not form.is_valid():
+        return {}
+    return {
+        key: form.cleaned_data.get(key) or None
+        for key in ('region', 'population_min', 'population_max')
+    }
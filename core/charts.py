@@ -0,0 +1,85 @@
+"""
+Данные и диаграмма сравнения городов.
+
+Строки сравнения и JSON фигуры Plotly кэшируются по отсортированному
+набору id и версии данных. Страница сравнения и /api/compare/figure/
+отдают один и тот же компактный JSON, который рисуется в браузере
+локальной копией plotly.js.
+"""
+import pandas as pd
+import plotly.graph_objects as go
+
+from .caching import cached
+from .models import Locality
+from .scoring import score_frame
+
+
+CATEGORIES = ['Экономика','Безработица','Инфраструктура']
+
+PLOTLY_CONFIG = {'displayModeBar': False}
+
+# Как в json_script: JSON можно вставить в <script> без повторного кодирования
+SCRIPT_SAFE_ESCAPES = {ord('<'): '\\u003C', ord('>'): '\\u003E', ord('&'): '\\u0026'}
+
+
+def _build_rows(city_ids):
+    cities = Locality.objects.filter(pk__in=city_ids).select_related('infrastructure')
+    scores = score_frame(cities).to_dict('index')
+    rows = []
+    for city in cities:
+        row = scores.get(city.pk)
+        if row is None:
+            continue
+        infra = getattr(city, 'infrastructure', None)
+        rows.append({
+            'id': city.pk,
+            'city': city.city,
+            'ndfl_per_capita': row['ndfl_total'] / city.population,
+            'unemployment_rate': None if pd.isna(row['unemployment_rate']) else row['unemployment_rate'],
+            'schools': infra.schools if infra else None,
+            'gas_stations': infra.gas_stations if infra else None,
+            'bus_stops': infra.bus_stops if infra else None,
+            'eco_score': row['eco_score'],
+            'demo_score': row['demo_score'],
+            'infra_score': row['infra_score'],
+            'inv_index': row['inv_index'],
+        })
+    return rows
+
+
+def compare_rows(city_ids):
+    """Компоненты индекса и показатели для сравнения"""
+    city_ids = sorted(city_ids)
+    return cached('compare', city_ids, lambda: _build_rows(city_ids))
+
+
+def _build_figure(rows):
+    fig=go.Figure()
+    for row in rows:
+        eco_score = row['eco_score']
+        demo_score = row['demo_score']
+        infra_score = row['infra_score']
+
+        fig.add_trace(go.Bar(
+            name = row['city'],
+            x = CATEGORIES,
+            y = [eco_score,demo_score, infra_score],
+            text = [f"{eco_score:.2f}",f"{demo_score:.2f}",f"{infra_score:.2f}"],
+            textposition = 'auto'
+        ))
+    fig.update_layout(
+        title = "Сравнение компонентов инвестиционного индекса",
+        barmode = 'group',
+        yaxis = dict(range=[0, 1.5], title="Балл"),
+        xaxis = dict(title="Компоненты индекса")
+    )
+    return fig.to_json(pretty=False).translate(SCRIPT_SAFE_ESCAPES)
+
+
+def compare_figure_json(city_ids):
+    """
+    JSON фигуры Plotly (data + layout) для набора городов. Символы < > &
+    экранированы, поэтому строку можно вывести в <script> как есть.
+    """
+    city_ids = sorted(city_ids)
+    return cached('compare_figure_script', city_ids, lambda: _build_figure(compare_rows(city_ids)))
@@ -0,0 +1,84 @@
+"""
+Колоночная выгрузка рейтинга (Parquet / Arrow IPC) для pandas и DuckDB.
+
+Колонки типизированы, регион хранится как словарная колонка. Готовый файл
+кладётся в кэш Django с ключом по версии данных и фильтрам, поэтому
+повторные загрузки не пересчитываются.
+"""
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .caching import cached, filter_params
+from .models import Locality
+
+
+FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+SCHEMA = pa.schema([
+    ('city', pa.string()),
+    ('region', pa.dictionary(pa.int32(), pa.string())),
+    ('population', pa.int32()),
+    ('oktmo_code', pa.string()),
+    ('ndfl_total', pa.int64()),
+    ('unemployment_rate', pa.float64()),
+    ('eco_score', pa.float64()),
+    ('demo_score', pa.float64()),
+    ('infra_score', pa.float64()),
+    ('inv_index', pa.float64()),
+    ('rank', pa.int32()),
+    ('region_rank', pa.int32()),
+])
+
+QUERY_FIELDS = [
+    'city', 'region', 'population', 'oktmo_code', 'ndfl_total', 'unemployment_rate',
+    'score__eco_score', 'score__demo_score', 'score__infra_score', 'score__inv_index',
+    'score__rank', 'score__region_rank',
+]
+
+CHUNK_SIZE = 2000
+
+
+def build_table(queryset):
+    """Arrow-таблица по городам queryset с сохранёнными индексами"""
+    rows = queryset.filter(score__isnull=False).with_latest_economics().order_by(
+        'score__rank'
+    ).values_list(*QUERY_FIELDS)
+    columns = [[] for _ in QUERY_FIELDS]
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        for column, value in zip(columns, row):
+            column.append(value)
+
+    arrays = []
+    for field, values in zip(SCHEMA, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def serialize(table, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'parquet':
+        pq.write_table(table, buffer, compression='zstd')
+    else:
+        with pa.ipc.new_file(buffer, table.schema) as writer:
+            writer.write_table(table)
+    return buffer.getvalue()
+
+
+def export_bytes(fmt, form):
+    """
+    Файл выгрузки с фильтрами CityFilterForm. Результат кэшируется
+    до изменения версии данных.
+    """
+    def build():
+        queryset = form.filter_queryset(Locality.objects.filter(is_active=True))
+        return serialize(build_table(queryset), fmt)
+
+    return cached(f'export:{fmt}', filter_params(form), build)
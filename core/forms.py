@@ -1,4 +1,5 @@
 from django import forms
+from .caching import cached
 from .models import Locality
 
 
@@ -7,6 +8,13 @@ AUTH_USER_MAX_CITIES = 10
 MIN_CITIES = 2
 
 
+def max_compared_cities(user):
+    """Сколько городов пользователь может сравнивать одновременно"""
+    if user and user.is_authenticated:
+        return AUTH_USER_MAX_CITIES
+    return GUEST_MAX_CITIES
+
+
 class CityFilterForm(forms.Form):
     region = forms.ChoiceField(
         choices = [],
@@ -27,7 +35,9 @@ class CityFilterForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        regions = Locality.objects.values_list('region', flat=True).distinct()
+        regions = cached('regions', None, lambda: list(
+            Locality.objects.order_by('region').values_list('region', flat=True).distinct()
+        ))
         self.fields['region'].choices = [('', 'Любой регион')] + [(r, r) for r in regions]
 
     def clean(self):
@@ -39,6 +49,18 @@ class CityFilterForm(forms.Form):
             raise forms.ValidationError("Минимальное население не может быть больше максимального")
         
         return cleaned_data
+
+    def filter_queryset(self, queryset):
+        """Применяет фильтры формы к queryset городов; невалидная форма не фильтрует"""
+        if not self.is_valid():
+            return queryset
+        if self.cleaned_data['region']:
+            queryset = queryset.filter(region=self.cleaned_data['region'])
+        if self.cleaned_data['population_min']:
+            queryset = queryset.filter(population__gte=self.cleaned_data['population_min'])
+        if self.cleaned_data['population_max']:
+            queryset = queryset.filter(population__lte=self.cleaned_data['population_max'])
+        return queryset
     
 
 class ComparisonForm(forms.Form):
@@ -56,10 +78,7 @@ class ComparisonForm(forms.Form):
     def clean_cities(self):
         cities = self.cleaned_data['cities']
         
-        if self.user and self.user.is_authenticated:
-            max_cities = AUTH_USER_MAX_CITIES
-        else:
-            max_cities = GUEST_MAX_CITIES
+        max_cities = max_compared_cities(self.user)
         
         if len(cities) < MIN_CITIES:
             raise forms.ValidationError("Выберите минимум 2 города для сравнения")
@@ -0,0 +1 @@
+"""Вспомогательные модули загрузки данных (core/management/fetch_data.py)"""
@@ -0,0 +1,88 @@
+"""
+Контрольные точки загрузки.
+
+Запись по каждому городу сохраняется в IngestionItem, как только получены
+все данные из внешних сервисов, поэтому прерванный запуск можно продолжить
+без повторных запросов. В основные таблицы записи переносятся пакетами
+ограниченного размера, каждый пакет — в своей короткой транзакции.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from core.ingest.loader import UpsertStats, upsert_cities
+from core.models import IngestionItem, IngestionRun
+
+
+LOAD_BATCH_SIZE = 500
+
+DONE_STATUSES = ('fetched', 'loaded')
+
+
+class RunCheckpoint:
+    def __init__(self, run):
+        self.run = run
+
+    @classmethod
+    def start(cls, total, resume=None):
+        """
+        Новый запуск или продолжение существующего: resume — id запуска
+        или 'latest' для последнего незавершённого.
+        """
+        if resume is None:
+            return cls(IngestionRun.objects.create(total=total))
+        runs = IngestionRun.objects.all()
+        if resume == 'latest':
+            run = runs.exclude(status='completed').first()
+        else:
+            run = runs.filter(pk=resume).first()
+        if run is None:
+            raise IngestionRun.DoesNotExist(f"Нет запуска для продолжения: {resume}")
+        IngestionRun.objects.filter(pk=run.pk).update(status='running', total=total, finished_at=None)
+        run.refresh_from_db()
+        return cls(run)
+
+    def completed_codes(self):
+        """ОКТМО городов, данные которых уже получены в этом запуске"""
+        return set(self.run.items.filter(status__in=DONE_STATUSES).values_list('oktmo_code', flat=True))
+
+    def record(self, oktmo_code, city_name, payload):
+        """Сохраняет результат по городу; payload=None — город не найден"""
+        IngestionItem.objects.update_or_create(
+            run = self.run,
+            oktmo_code = oktmo_code,
+            defaults = {
+                'city_name': city_name,
+                'status': 'fetched' if payload is not None else 'not_found',
+                'payload': payload,
+            },
+        )
+
+    def load(self, batch_size=LOAD_BATCH_SIZE):
+        """
+        Переносит полученные записи в основные таблицы пакетами через
+        upsert_cities; отметка loaded ставится в той же транзакции.
+        Возвращает число перенесённых записей и UpsertStats.
+        """
+        loaded = 0
+        stats = UpsertStats()
+        pending = self.run.items.filter(status='fetched').order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return loaded, stats
+            with transaction.atomic():
+                stats.merge(upsert_cities([item.payload for item in batch]))
+                IngestionItem.objects.filter(pk__in=[item.pk for item in batch]).update(
+                    status='loaded', updated_at=timezone.now(),
+                )
+            last_pk = batch[-1].pk
+            loaded += len(batch)
+
+    def finish(self, status='completed', report=None):
+        """Статус и отчёт запуска; total берётся из стадии extract отчёта"""
+        fields = {'status': status, 'finished_at': timezone.now(), 'report': report}
+        for stage in (report or {}).get('stages', []):
+            if stage['stage'] == 'extract':
+                fields['total'] = stage['items_in']
+        IngestionRun.objects.filter(pk=self.run.pk).update(**fields)
@@ -0,0 +1,158 @@
+"""
+Общий HTTP-клиент для внешних источников данных.
+
+Для каждого хоста — своя requests.Session с пулом соединений, поэтому
+TCP/TLS-соединения переиспользуются между запросами и потоками. Каждый
+запрос проходит через HostLimiter хоста (см. scheduler.LIMITERS). Ответы
+429 и 5xx повторяются с паузой из Retry-After, а без него — с
+экспоненциальной паузой; обе не длиннее MAX_BACKOFF. Общий срок на обработку города задаётся
+контекстом city_deadline() (для нескольких стадий — CityDeadlines) и
+ограничивает и таймауты, и паузы.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .scheduler import LIMITERS
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+MAX_BACKOFF = 120
+
+
+class DeadlineExceeded(requests.exceptions.RequestException):
+    """Срок на обработку города истёк"""
+
+
+_deadline = threading.local()
+
+
+@contextmanager
+def deadline_at(at):
+    """Все запросы внутри блока должны завершиться до момента at (time.monotonic)"""
+    previous = getattr(_deadline, 'at', None)
+    _deadline.at = at
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+def city_deadline(seconds):
+    """Все запросы внутри блока должны уложиться в seconds секунд"""
+    return deadline_at(time.monotonic() + seconds if seconds else None)
+
+
+class CityDeadlines:
+    """
+    Общий срок на город для всех стадий: отсчёт начинается при первом
+    запросе по городу, а следующие стадии получают оставшееся время.
+    Для пакета городов действует самый ранний из их сроков.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._at = {}
+        self._lock = threading.Lock()
+
+    def scope(self, keys):
+        if not self.seconds:
+            return deadline_at(None)
+        now = time.monotonic()
+        with self._lock:
+            at = min(self._at.setdefault(key, now + self.seconds) for key in keys)
+        return deadline_at(at)
+
+
+def _remaining():
+    at = getattr(_deadline, 'at', None)
+    return None if at is None else at - time.monotonic()
+
+
+def retry_after(response):
+    """Пауза из заголовка Retry-After (секунды или HTTP-дата) или None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """Клиент одного внешнего сервиса с постоянной сессией"""
+
+    def __init__(self, limiter, headers=None, pool_size=4, max_retries=5, backoff=5.0):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _sleep(self, wait):
+        with self._retries_lock:
+            self.retries += 1
+        remaining = _remaining()
+        if remaining is not None and wait >= remaining:
+            raise DeadlineExceeded(f"Повтор через {wait:.0f} с не укладывается в срок города")
+        time.sleep(wait)
+
+    def request(self, method, url, timeout=30, **kwargs):
+        """
+        Ответ с кодом 2xx. Исключение requests — при ошибке, исчерпании
+        повторов или истечении срока города.
+        """
+        for attempt in range(self.max_retries):
+            remaining = _remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise DeadlineExceeded("Срок на обработку города истёк")
+                timeout = min(timeout, remaining)
+            try:
+                with LIMITERS[self.limiter].slot():
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                wait = min(self.backoff * 2 ** attempt, MAX_BACKOFF)
+                logger.warning(f"  ⚠️ {self.limiter}: {type(e).__name__}. Повтор через {wait:.0f} сек...")
+                self._sleep(wait)
+                continue
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries - 1:
+                response.raise_for_status()
+                return response
+            wait = retry_after(response)
+            if wait is None:
+                wait = min(self.backoff * 2 ** attempt, MAX_BACKOFF) * random.uniform(1, 1.5)
+            else:
+                # Слишком долгий Retry-After не должен съедать весь срок города
+                wait = min(wait, MAX_BACKOFF)
+            logger.warning(f"  ⚠️ {self.limiter}: {response.status_code}. Повтор через {wait:.0f} сек...")
+            self._sleep(wait)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -0,0 +1,267 @@
+"""
+Локальная замена Nominatim и Overpass для нагрузочных и регрессионных
+проверок загрузки.
+
+Реализует то подмножество API, которым пользуется fetch_data.py:
+GET /search (Nominatim, format=json) и POST /interpreter (Overpass,
+запросы `out count` из core/ingest/overpass.py). Ответы берутся из файла
+фикстур, а для неизвестных городов и областей генерируются
+детерминированно по хэшу запроса. Задержка, доля ответов 429/5xx и
+ограничения параллелизма настраиваются, GET /stats возвращает счётчики.
+
+Запуск:
+    python -m core.ingest.fake_services --port 8765 --latency 0.2 --p429 0.05
+
+и в .env:
+    NOMINATIM_API_URL=http://127.0.0.1:8765/search
+    OVERPASS_API_URL=http://127.0.0.1:8765/interpreter
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+SELECTOR_PATTERN = re.compile(r'(node|way|relation)\["([^"]+)"="([^"]+)"\]\(([^)]*)\)')
+
+FAKE_REGIONS = ['Тестовая область', 'Республика Тестовая', 'Тестовый край']
+
+
+def _seed(*parts):
+    return int(hashlib.sha256('|'.join(parts).encode()).hexdigest()[:12], 16)
+
+
+def fake_place(query):
+    """Детерминированный ответ геокодера для неизвестного города"""
+    seed = _seed(query)
+    lat = 45 + seed % 1500 / 100
+    lon = 30 + seed // 1500 % 9000 / 100
+    size = 0.05 + seed % 7 / 100
+    region = FAKE_REGIONS[seed % len(FAKE_REGIONS)]
+    return {
+        'display_name': f"{query}, городской округ {query}, {region}, Россия",
+        'lat': str(lat),
+        'lon': str(lon),
+        'boundingbox': [str(lat - size), str(lat + size), str(lon - size), str(lon + size)],
+    }
+
+
+def fake_count(element_type, tag_key, tag_value, area):
+    """Детерминированное число объектов для области"""
+    return _seed(element_type, tag_key, tag_value, area) % (60 if element_type == 'node' else 15)
+
+
+class FakeServices:
+    """Состояние сервера: фикстуры, параметры сбоев, счётчики"""
+
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, p429=0.0, p5xx=0.0, retry_after=1,
+                 overpass_slots=2, nominatim_min_interval=0.0, strict=False, seed=None):
+        fixtures = fixtures or {}
+        self.places = fixtures.get('nominatim', {})
+        self.counts = fixtures.get('overpass', {})
+        self.latency = latency
+        self.jitter = jitter
+        self.p429 = p429
+        self.p5xx = p5xx
+        self.retry_after = retry_after
+        self.overpass_slots = overpass_slots
+        self.nominatim_min_interval = nominatim_min_interval
+        self.strict = strict
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._active_overpass = 0
+        self._last_nominatim = 0.0
+
+    def search(self, query):
+        if query in self.places:
+            return [self.places[query]]
+        city = query.split(',')[0].strip()
+        if city in self.places:
+            return [self.places[city]]
+        return [] if self.strict else [fake_place(query)]
+
+    def interpret(self, query):
+        elements = []
+        statements = query.split('out count;')[:-1]
+        with self._lock:
+            self.stats['overpass.count_statements'] += len(statements)
+        for statement in statements:
+            selectors = SELECTOR_PATTERN.findall(statement)
+            by_type = Counter()
+            for element_type, tag_key, tag_value, area in selectors:
+                fixture = self.counts.get(area, {}).get(f'{element_type}:{tag_key}={tag_value}')
+                by_type[element_type] += fixture if fixture is not None else fake_count(
+                    element_type, tag_key, tag_value, area,
+                )
+            elements.append({
+                'type': 'count',
+                'id': 0,
+                'tags': {
+                    'nodes': str(by_type['node']),
+                    'ways': str(by_type['way']),
+                    'relations': str(by_type['relation']),
+                    'total': str(sum(by_type.values())),
+                },
+            })
+        return {'version': 0.6, 'generator': 'fake_services', 'elements': elements}
+
+    def injected_error(self):
+        """Код ответа для искусственного сбоя или None"""
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.p429:
+            return 429
+        if roll < self.p429 + self.p5xx:
+            return 504
+        return None
+
+    def delay(self):
+        with self._lock:
+            wait = self.latency + self.random.uniform(0, self.jitter)
+        if wait > 0:
+            time.sleep(wait)
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def enter_nominatim(self):
+        """False, если запрос пришёл раньше допустимого интервала"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_nominatim < self.nominatim_min_interval:
+                return False
+            self._last_nominatim = now
+            return True
+
+    def enter_overpass(self):
+        with self._lock:
+            if self._active_overpass >= self.overpass_slots:
+                return False
+            self._active_overpass += 1
+            return True
+
+    def leave_overpass(self):
+        with self._lock:
+            self._active_overpass -= 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    services = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self, status, key):
+        self.services.count(key)
+        headers = {'Retry-After': str(self.services.retry_after)} if status == 429 else None
+        self._send_json(status, {'error': key}, headers)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._send_json(200, dict(self.services.stats))
+        if url.path != '/search':
+            return self._send_json(404, {'error': 'not found'})
+
+        services = self.services
+        services.count('nominatim.requests')
+        if not services.enter_nominatim():
+            return self._fail(429, 'nominatim.rate_limited')
+        status = services.injected_error()
+        services.delay()
+        if status:
+            return self._fail(status, f'nominatim.injected_{status}')
+        query = parse_qs(url.query).get('q', [''])[0]
+        self._send_json(200, services.search(query))
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/interpreter':
+            return self._send_json(404, {'error': 'not found'})
+
+        services = self.services
+        services.count('overpass.requests')
+        length = int(self.headers.get('Content-Length', 0))
+        query = parse_qs(self.rfile.read(length).decode()).get('data', [''])[0]
+        if not services.enter_overpass():
+            return self._fail(429, 'overpass.slots_exceeded')
+        try:
+            status = services.injected_error()
+            services.delay()
+            if status:
+                return self._fail(status, f'overpass.injected_{status}')
+            self._send_json(200, services.interpret(query))
+        finally:
+            services.leave_overpass()
+
+
+def make_server(host='127.0.0.1', port=8765, **options):
+    """ThreadingHTTPServer с FakeServices(**options); port=0 — свободный порт"""
+    handler = type('FakeHandler', (Handler,), {'services': FakeServices(**options)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Nominatim и Overpass")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixtures', help="JSON: {\"nominatim\": {город: place}, \"overpass\": {область: {\"node:amenity=school\": N}}}")
+    parser.add_argument('--latency', type=float, default=0.0, help="Задержка ответа, с")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument('--p429', type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument('--p5xx', type=float, default=0.0, help="Доля ответов 504")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After для 429, с")
+    parser.add_argument('--overpass-slots', type=int, default=2,
+                        help="Одновременных запросов к Overpass, сверх — 429")
+    parser.add_argument('--nominatim-min-interval', type=float, default=0.0,
+                        help="Минимальный интервал между запросами к Nominatim, чаще — 429")
+    parser.add_argument('--strict', action='store_true', help="Неизвестные города не находятся")
+    parser.add_argument('--seed', type=int, help="Зерно генератора сбоев")
+    args = parser.parse_args()
+
+    fixtures = None
+    if args.fixtures:
+        with open(args.fixtures, encoding='utf-8') as f:
+            fixtures = json.load(f)
+    server = make_server(
+        args.host, args.port, fixtures=fixtures, latency=args.latency, jitter=args.jitter,
+        p429=args.p429, p5xx=args.p5xx, retry_after=args.retry_after,
+        overpass_slots=args.overpass_slots, nominatim_min_interval=args.nominatim_min_interval,
+        strict=args.strict, seed=args.seed,
+    )
+    print(f"Nominatim: http://{args.host}:{server.server_port}/search")
+    print(f"Overpass:  http://{args.host}:{server.server_port}/interpreter")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Постоянный кэш ответов внешних сервисов (Nominatim, Overpass) в SQLite.
+
+Ключ — источник и нормализованный запрос. У каждого источника свой срок
+жизни записей; при превышении размера файла вытесняются давно не
+читавшиеся записи. Повторная загрузка обращается к сети только за новыми
+и устаревшими записями, а в режиме offline не обращается вовсе.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# Границы городов меняются редко, объекты инфраструктуры — чаще
+DEFAULT_TTLS = {
+    'nominatim': 90 * DAY,
+    'overpass': 30 * DAY,
+}
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+EVICT_BATCH = 200
+
+
+def normalize_key(query):
+    """Регистр и повторные пробелы не влияют на ключ"""
+    return ' '.join(str(query).lower().split())
+
+
+class HttpCache:
+    """
+    Кэш JSON-ответов по (source, query).
+
+    refresh — источники, записи которых не читаются из кэша, а запрашиваются
+    заново и перезаписываются. offline — промахи не запрашиваются из сети.
+    """
+
+    def __init__(self, path, ttls=None, max_bytes=DEFAULT_MAX_BYTES, refresh=(), offline=False):
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.max_bytes = max_bytes
+        self.refresh = set(refresh)
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' source TEXT NOT NULL, key TEXT NOT NULL, body TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,'
+            ' PRIMARY KEY (source, key))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._conn.commit()
+
+    def get(self, source, query):
+        """Сохранённый ответ или None, если записи нет или она устарела"""
+        if source in self.refresh:
+            self.misses += 1
+            return None
+        key = normalize_key(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, created_at FROM responses WHERE source = ? AND key = ?',
+                (source, key),
+            ).fetchone()
+            if row is None or now - row[1] > self.ttls.get(source, 0):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE responses SET accessed_at = ? WHERE source = ? AND key = ?',
+                (now, source, key),
+            )
+            self._conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, source, query, value):
+        body = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (source, normalize_key(query), body, len(body.encode()), now, now),
+            )
+            self._conn.commit()
+            self._evict()
+
+    def fetch(self, source, query, compute):
+        """
+        Ответ из кэша или результат compute(), который сохраняется в кэш.
+        None от compute() (ошибка запроса) не кэшируется.
+        """
+        value = self.get(source, query)
+        if value is not None:
+            return value
+        if self.offline:
+            logger.warning(f"Нет записи в кэше ({source}): {query[:80]}")
+            return None
+        value = compute()
+        if value is not None:
+            self.set(source, query, value)
+        return value
+
+    def _evict(self):
+        """Удаляет давно не читавшиеся записи, пока размер не станет допустимым"""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT source, key, size FROM responses ORDER BY accessed_at LIMIT ?',
+                (EVICT_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            for source, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute('DELETE FROM responses WHERE source = ? AND key = ?', (source, key))
+                total -= size
+                evicted += 1
+        if evicted:
+            self._conn.commit()
+            logger.info(f"Из кэша HTTP вытеснено записей: {evicted}")
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for source, ttl in self.ttls.items():
+                self._conn.execute(
+                    'DELETE FROM responses WHERE source = ? AND created_at < ?', (source, now - ttl),
+                )
+            self._conn.commit()
+
+    def report(self):
+        return f"кэш HTTP: попаданий {self.hits}, промахов {self.misses}"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
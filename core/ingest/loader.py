@@ -0,0 +1,135 @@
+"""
+Пакетная запись загруженных городов в основные таблицы.
+
+Вместо трёх update_or_create на город (SELECT и INSERT/UPDATE для каждой
+модели) пакет записывается несколькими INSERT ... ON CONFLICT DO UPDATE:
+города по oktmo_code, экономика по (locality, year), инфраструктура по
+locality. Внешние ключи сопоставляются в памяти по коду ОКТМО.
+
+Сигналы save при bulk_create не срабатывают, поэтому после загрузки
+нужно вызвать rebuild_scores().
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import EconomicData, InfrastructureData, Locality
+
+
+ECONOMICS_YEAR = 2023
+
+BATCH_SIZE = 500
+
+
+class UpsertStats:
+    """
+    Число вставленных и обновлённых строк по каждой модели и регионы,
+    которых коснулась загрузка (прежние и новые регионы городов).
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.regions = set()
+
+    def add(self, model, inserted, updated):
+        name = model._meta.model_name
+        current = self.counts.get(name, (0, 0))
+        self.counts[name] = (current[0] + inserted, current[1] + updated)
+
+    def merge(self, other):
+        self.regions |= other.regions
+        for name, (inserted, updated) in other.counts.items():
+            current = self.counts.get(name, (0, 0))
+            self.counts[name] = (current[0] + inserted, current[1] + updated)
+
+    def report(self):
+        return '; '.join(
+            f"{name}: добавлено {inserted}, обновлено {updated}"
+            for name, (inserted, updated) in self.counts.items()
+        )
+
+
+def upsert_cities(records, year=ECONOMICS_YEAR):
+    """
+    Создаёт или обновляет города, экономические данные за year и
+    инфраструктуру по записям загрузки. Возвращает UpsertStats.
+    """
+    stats = UpsertStats()
+    # При повторе кода ОКТМО в пакете побеждает последняя запись
+    records = list({str(record['oktmo_code']): record for record in records}.values())
+    if not records:
+        return stats
+    codes = [str(record['oktmo_code']) for record in records]
+    now = timezone.now()
+
+    with transaction.atomic():
+        previous = dict(Locality.objects.filter(oktmo_code__in=codes).values_list('oktmo_code', 'region'))
+        existing = set(previous)
+        stats.regions |= set(previous.values()) | {record['region'] for record in records}
+        Locality.objects.bulk_create(
+            [
+                Locality(
+                    oktmo_code = str(record['oktmo_code']),
+                    city = record['city_name'],
+                    region = record['region'],
+                    population = record['population'],
+                    is_active = True,
+                    source_fingerprint = record.get('fingerprint', ''),
+                )
+                for record in records
+            ],
+            update_conflicts = True,
+            unique_fields = ['oktmo_code'],
+            update_fields = ['city', 'region', 'population', 'is_active', 'source_fingerprint'],
+            batch_size = BATCH_SIZE,
+        )
+        stats.add(Locality, len(records) - len(existing), len(existing))
+
+        # Ключи читаются заново: не все бэкенды возвращают pk для обновлённых строк
+        ids = dict(Locality.objects.filter(oktmo_code__in=codes).values_list('oktmo_code', 'id'))
+        locality_ids = [ids[code] for code in codes]
+
+        existing = EconomicData.objects.filter(locality_id__in=locality_ids, year=year).count()
+        EconomicData.objects.bulk_create(
+            [
+                EconomicData(
+                    locality_id = locality_id,
+                    year = year,
+                    ndfl_total = record['ndfl'],
+                    unemployment_rate = record['unemployment_rate'],
+                )
+                for locality_id, record in zip(locality_ids, records)
+            ],
+            update_conflicts = True,
+            unique_fields = ['locality', 'year'],
+            update_fields = ['ndfl_total', 'unemployment_rate'],
+            batch_size = BATCH_SIZE,
+        )
+        stats.add(EconomicData, len(records) - existing, existing)
+
+        # Без счётчиков (сбой Overpass) прежняя строка и её fetched_at не меняются
+        counted = [
+            (locality_id, record['infrastructure'])
+            for locality_id, record in zip(locality_ids, records)
+            if record.get('infrastructure') is not None
+        ]
+        existing = InfrastructureData.objects.filter(
+            locality_id__in=[locality_id for locality_id, _ in counted],
+        ).count()
+        InfrastructureData.objects.bulk_create(
+            [
+                InfrastructureData(
+                    locality_id = locality_id,
+                    schools = counts['schools'],
+                    gas_stations = counts['gas_stations'],
+                    bus_stops = counts['bus_stops'],
+                    fetched_at = now,
+                )
+                for locality_id, counts in counted
+            ],
+            update_conflicts = True,
+            unique_fields = ['locality'],
+            update_fields = ['schools', 'gas_stations', 'bus_stops', 'fetched_at'],
+            batch_size = BATCH_SIZE,
+        )
+        stats.add(InfrastructureData, len(counted) - existing, existing)
+    return stats
@@ -0,0 +1,187 @@
+"""
+Подсчёт инфраструктуры по локальной выгрузке OSM вместо Overpass.
+
+Области городов (bbox или круг around:5000, как в get_city_coordinates)
+раскладываются по ячейкам регулярной сетки. Выгрузка читается потоком,
+и каждый подходящий объект засчитывается тем областям, чьи ячейки
+совпадают с его ячейкой и которые действительно его содержат. Так все
+города считаются вместе, а объекты в памяти не хранятся.
+
+Форматы:
+- .osm / .osm.gz / .osm.bz2 — XML через iterparse. Точки считаются за
+  первый проход. Линии (way) ссылаются на точки по id, а хранить
+  координаты всех точек выгрузки слишком дорого, поэтому при наличии
+  подходящих линий файл читается второй раз, только до конца точек, ради
+  координат точек этих линий. Выгрузка должна быть упорядочена, как
+  выгрузки Geofabrik и planet: все точки, затем линии и отношения
+  (иначе — `osmium sort`); порядок проверяется при первом проходе.
+- .osm.pbf — через pyosmium (pip install osmium), за один проход
+  с индексом координат точек самого osmium.
+
+Линия засчитывается по центру её точек; Overpass засчитывает линию,
+если хотя бы часть её попадает в область, поэтому на границах областей
+счётчики могут немного отличаться.
+"""
+import bz2
+import gzip
+import logging
+import math
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+from .overpass import AROUND_RADIUS, INFRA_TAGS
+
+
+logger = logging.getLogger(__name__)
+
+CELL_SIZE = 0.1
+
+EARTH_RADIUS = 6371000
+
+
+def _match(element_type, tags):
+    """Ключ INFRA_TAGS, которому соответствует объект, или None"""
+    for key, (element_types, tag_key, tag_value) in INFRA_TAGS.items():
+        if element_type in element_types and tags.get(tag_key) == tag_value:
+            return key
+    return None
+
+
+class AreaIndex:
+    """Сеточный индекс областей городов и счётчики объектов по ним"""
+
+    def __init__(self, coords_list, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.areas = [self._bounds(coords) for coords in coords_list]
+        self.counts = [dict.fromkeys(INFRA_TAGS, 0) for _ in coords_list]
+        self.cells = defaultdict(list)
+        for i, (min_lat, min_lon, max_lat, max_lon, _) in enumerate(self.areas):
+            for row in range(self._cell(min_lat), self._cell(max_lat) + 1):
+                for col in range(self._cell(min_lon), self._cell(max_lon) + 1):
+                    self.cells[row, col].append(i)
+
+    def _cell(self, value):
+        return math.floor(value / self.cell_size)
+
+    @staticmethod
+    def _bounds(coords):
+        if coords['type'] == 'bbox':
+            return coords['min_lat'], coords['min_lon'], coords['max_lat'], coords['max_lon'], None
+        lat, lon = coords['lat'], coords['lon']
+        dlat = math.degrees(AROUND_RADIUS / EARTH_RADIUS)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        return lat - dlat, lon - dlon, lat + dlat, lon + dlon, (lat, lon)
+
+    @staticmethod
+    def _distance(lat1, lon1, lat2, lon2):
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+    def add(self, key, lat, lon):
+        for i in self.cells.get((self._cell(lat), self._cell(lon)), ()):
+            min_lat, min_lon, max_lat, max_lon, center = self.areas[i]
+            if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+                continue
+            if center is not None and self._distance(lat, lon, *center) > AROUND_RADIUS:
+                continue
+            self.counts[i][key] += 1
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _iter_elements(path):
+    """(тег, элемент) для node/way/relation с очисткой уже разобранных"""
+    root = None
+    with _open(path) as source:
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event == 'end' and element.tag in ('node', 'way', 'relation'):
+                yield element.tag, element
+                # Разобранные элементы не должны копиться в корне документа
+                root.clear()
+
+
+def _tags(element):
+    return {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+
+
+def _count_xml(path, index):
+    ways = []
+    nodes_done = False
+    for element_type, element in _iter_elements(path):
+        if element_type != 'node':
+            nodes_done = True
+        elif nodes_done:
+            raise ValueError(f"{path}: точки должны идти перед линиями и отношениями (osmium sort)")
+        if element_type == 'relation':
+            continue
+        key = _match(element_type, _tags(element))
+        if key is None:
+            continue
+        if element_type == 'node':
+            index.add(key, float(element.get('lat')), float(element.get('lon')))
+        else:
+            ways.append((key, [int(nd.get('ref')) for nd in element.iter('nd')]))
+
+    if not ways:
+        return
+    needed = {ref for _, refs in ways for ref in refs}
+    locations = {}
+    for element_type, element in _iter_elements(path):
+        # Точки идут первыми (проверено выше): дальше читать не нужно
+        if element_type != 'node':
+            break
+        node_id = int(element.get('id'))
+        if node_id in needed:
+            locations[node_id] = (float(element.get('lat')), float(element.get('lon')))
+    for key, refs in ways:
+        points = [locations[ref] for ref in refs if ref in locations]
+        if points:
+            index.add(key, sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+
+
+def _count_pbf(path, index):
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Для чтения .osm.pbf установите pyosmium: pip install osmium") from e
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, node):
+            key = _match('node', node.tags)
+            if key is not None and node.location.valid():
+                index.add(key, node.location.lat, node.location.lon)
+
+        def way(self, way):
+            key = _match('way', way.tags)
+            if key is None:
+                return
+            points = [(nd.location.lat, nd.location.lon) for nd in way.nodes if nd.location.valid()]
+            if points:
+                index.add(key, sum(p[0] for p in points) / len(points),
+                          sum(p[1] for p in points) / len(points))
+
+    Handler().apply_file(path, locations=True)
+
+
+def count_infrastructure(path, coords_list):
+    """
+    Счётчики INFRA_TAGS для каждой области из coords_list по выгрузке path.
+    Возвращает список словарей в порядке coords_list, как get_infrastructure_batch.
+    """
+    index = AreaIndex(coords_list)
+    logger.info(f"Подсчёт инфраструктуры по выгрузке {path} для {len(coords_list)} городов")
+    if path.endswith('.pbf'):
+        _count_pbf(path, index)
+    else:
+        _count_xml(path, index)
+    return index.counts
@@ -0,0 +1,69 @@
+"""
+Запросы подсчёта объектов инфраструктуры в Overpass QL.
+
+Для каждой области в запрос добавляется по одному оператору `out count`
+на тип объектов, поэтому один запрос возвращает все счётчики сразу,
+а ответ содержит только числа, а не идентификаторы каждого объекта.
+Несколько областей (городов) можно объединить в одном запросе: блоки
+счётчиков идут в ответе в том же порядке, что и в запросе.
+"""
+
+
+# Ключ результата → (типы элементов, ключ тега, значение тега)
+INFRA_TAGS = {
+    'schools': (('node', 'way'), 'amenity', 'school'),
+    'gas_stations': (('node', 'way'), 'amenity', 'fuel'),
+    'bus_stops': (('node',), 'highway', 'bus_stop'),
+}
+
+AROUND_RADIUS = 5000
+
+QUERY_TIMEOUT = 60
+
+
+def area_clause(coords):
+    """Фильтр области Overpass по результату геокодирования"""
+    if coords['type'] == 'bbox':
+        return f"{coords['min_lat']},{coords['min_lon']},{coords['max_lat']},{coords['max_lon']}"
+    return f"around:{AROUND_RADIUS},{coords['lat']},{coords['lon']}"
+
+
+def _count_statement(element_types, tag_key, tag_value, area):
+    selectors = ''.join(
+        f'{element_type}["{tag_key}"="{tag_value}"]({area});' for element_type in element_types
+    )
+    return f'({selectors});out count;'
+
+
+def build_count_query(areas):
+    """
+    Один запрос со счётчиками всех INFRA_TAGS для каждой области из areas.
+    Таймаут растёт с числом областей.
+    """
+    timeout = QUERY_TIMEOUT * max(1, len(areas))
+    statements = [
+        _count_statement(element_types, tag_key, tag_value, area)
+        for area in areas
+        for element_types, tag_key, tag_value in INFRA_TAGS.values()
+    ]
+    return f'[out:json][timeout:{timeout}];' + ''.join(statements)
+
+
+def parse_counts(data, n_areas):
+    """
+    Разбирает ответ build_count_query: список словарей
+    {'schools': ..., 'gas_stations': ..., 'bus_stops': ...} по областям.
+    """
+    totals = [
+        int(element.get('tags', {}).get('total', 0))
+        for element in data.get('elements', [])
+        if element.get('type') == 'count'
+    ]
+    expected = n_areas * len(INFRA_TAGS)
+    if len(totals) != expected:
+        raise ValueError(f"Ожидалось {expected} счётчиков, получено {len(totals)}")
+    keys = list(INFRA_TAGS)
+    return [
+        dict(zip(keys, totals[i:i + len(keys)]))
+        for i in range(0, expected, len(keys))
+    ]
@@ -0,0 +1,271 @@
+"""
+Конвейер загрузки: extract → geocode → infra → enrich → load.
+
+Каждая стадия — генератор, который принимает поток записей городов от
+предыдущей стадии и отдаёт следующей. Внешние функции (геокодер, подсчёт
+инфраструктуры, сопоставление регионов) передаются параметрами, поэтому
+стадии можно запускать и проверять по отдельности. Сетевые стадии
+обрабатывают записи пулом потоков через concurrent_map и начинают работу,
+не дожидаясь окончания предыдущей стадии.
+
+По каждой стадии собирается телеметрия (StageStats): число записей на
+входе и выходе, ошибки, повторы запросов, время работы. RunReport
+сводит её в JSON-отчёт запуска.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from .scheduler import concurrent_map
+
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 10
+
+
+class StageStats:
+    """Телеметрия одной стадии"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.dropped = 0
+        self.errors = 0
+        self.retries = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timed(self):
+        """Учитывает время обработки одной записи (из любого потока)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.busy_seconds += time.monotonic() - start
+
+    def mark(self):
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        self.finished = now
+
+    @property
+    def wall_seconds(self):
+        return self.finished - self.started if self.started is not None else 0.0
+
+    def as_dict(self):
+        wall = self.wall_seconds
+        return {
+            'stage': self.name,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'retries': self.retries,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'wall_seconds': round(wall, 3),
+            'items_per_minute': round(self.items_out / wall * 60, 1) if wall else None,
+        }
+
+
+class RunReport:
+    """Сводный отчёт запуска по стадиям"""
+
+    def __init__(self, **meta):
+        self.meta = meta
+        self.stages = {}
+        self.started = time.monotonic()
+
+    def stage(self, name):
+        return self.stages.setdefault(name, StageStats(name))
+
+    def as_dict(self):
+        return {
+            **self.meta,
+            'elapsed_seconds': round(time.monotonic() - self.started, 3),
+            'stages': [stats.as_dict() for stats in self.stages.values()],
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), ensure_ascii=False, indent=2)
+
+    def summary(self):
+        return '; '.join(
+            f"{s.name}: {s.items_out}/{s.items_in} за {s.wall_seconds:.0f} с"
+            + (f", ошибок {s.errors}" if s.errors else '')
+            + (f", повторов {s.retries}" if s.retries else '')
+            for s in self.stages.values()
+        )
+
+
+def _guarded(stats, func):
+    """func(item) с учётом времени; исключение считается ошибкой и отбрасывает запись"""
+    def wrapper(item):
+        with stats.timed():
+            try:
+                return func(item)
+            except Exception as e:
+                logger.error(f"{stats.name}: {item.get('city_name', item) if isinstance(item, dict) else item}: {e}")
+                with stats._lock:
+                    stats.errors += 1
+                return None
+    return wrapper
+
+
+def _map_stage(stats, items, func, workers, on_drop=None):
+    """Общая часть стадий: func(item) → запись или None (запись отбрасывается)"""
+    def counted(source):
+        for item in source:
+            stats.items_in += 1
+            stats.mark()
+            yield item
+
+    for item, result in concurrent_map(_guarded(stats, func), counted(items), workers):
+        stats.mark()
+        if result is None:
+            stats.dropped += 1
+            if on_drop is not None:
+                on_drop(item)
+            continue
+        stats.items_out += 1
+        yield result
+
+
+def extract(stats, load_frame, skip_codes=()):
+    """
+    Записи городов из исходных таблиц. load_frame() возвращает DataFrame
+    с колонками Название, ОКТМО, Население, НДФЛ, fingerprint.
+    """
+    stats.mark()
+    with stats.timed():
+        frame = load_frame()
+    stats.mark()
+    for _, row in frame.iterrows():
+        stats.items_in += 1
+        code = str(row['ОКТМО'])
+        if code in skip_codes:
+            stats.dropped += 1
+            continue
+        stats.items_out += 1
+        yield {
+            'city_name': row['Название'][3:].strip(),
+            'oktmo_code': code,
+            'population': _plain(row['Население']),
+            'ndfl': _plain(row['НДФЛ']),
+            'fingerprint': row['fingerprint'],
+        }
+
+
+def _no_scope(items):
+    return nullcontext()
+
+
+def geocode(stats, items, geocoder, workers, on_not_found=None, scope=_no_scope):
+    """
+    Добавляет coords и osm_display_name; ненайденные города отбрасываются.
+    scope(items) — контекст вокруг внешнего вызова (например, срок на город).
+    """
+    def step(item):
+        with scope([item]):
+            coords = geocoder(item['city_name'])
+        if not coords:
+            logger.warning(f"  ❌ Не найден: {item['city_name']}")
+            return None
+        return {**item, 'coords': coords, 'osm_display_name': coords['display_name']}
+
+    return _map_stage(stats, items, step, workers, on_drop=on_not_found)
+
+
+def infra(stats, items, counter, workers, batch_size=1, scope=_no_scope):
+    """
+    Добавляет infrastructure. counter(coords_list) возвращает счётчики по
+    списку областей (None — для областей, которые не удалось посчитать);
+    batch_size городов передаются одним вызовом, batch_size=None — все
+    города одним вызовом (локальная выгрузка OSM). scope — как в geocode.
+    """
+    def batches(source):
+        batch = []
+        for item in source:
+            batch.append(item)
+            if batch_size is not None and len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def step(batch):
+        with scope(batch):
+            counts = counter([item['coords'] for item in batch])
+        return [{**item, 'infrastructure': infra} for item, infra in zip(batch, counts)]
+
+    def counted(source):
+        for item in source:
+            stats.items_in += 1
+            yield item
+
+    for _, results in concurrent_map(_guarded(stats, step), batches(counted(items)), workers):
+        stats.mark()
+        if results is None:
+            continue
+        for result in results:
+            stats.items_out += 1
+            counts = result['infrastructure']
+            if counts is None:
+                # Город сохраняется без инфраструктуры: прежние счётчики остаются
+                stats.errors += 1
+                logger.warning(f"  ⚠️ {result['city_name']}: нет данных об инфраструктуре")
+            else:
+                logger.info(f"  ✅ {result['city_name']}: школы={counts['schools']}, "
+                            f"АЗС={counts['gas_stations']}, остановки={counts['bus_stops']}")
+            yield result
+    stats.dropped = stats.items_in - stats.items_out
+
+
+def enrich(stats, items, region_of, unemployment_of):
+    """Добавляет region по ответу геокодера и unemployment_rate по региону"""
+    def step(item):
+        region = region_of(item['osm_display_name'])
+        return {**item, 'region': region, 'unemployment_rate': _plain(unemployment_of(region))}
+
+    return _map_stage(stats, items, step, workers=1)
+
+
+def load(stats, items, record, flush, flush_every):
+    """
+    Сохраняет поток записей: record(item) для каждой записи (контрольная
+    точка) и flush() каждые flush_every записей и в конце. Возвращает
+    список результатов flush().
+    """
+    flushed = []
+    pending = 0
+    for item in items:
+        stats.items_in += 1
+        stats.mark()
+        with stats.timed():
+            record(item)
+        pending += 1
+        if pending >= flush_every:
+            with stats.timed():
+                flushed.append(flush())
+            stats.items_out += pending
+            pending = 0
+        if stats.items_in % PROGRESS_EVERY == 0:
+            logger.info(f"Прогресс: сохранено {stats.items_in}")
+    with stats.timed():
+        flushed.append(flush())
+    stats.items_out += pending
+    stats.mark()
+    return flushed
+
+
+def _plain(value):
+    """Значение pandas/numpy в обычный тип Python для JSON"""
+    return value.item() if hasattr(value, 'item') else value
@@ -0,0 +1,171 @@
+"""
+Определение субъекта РФ по ответу Nominatim и сопоставление его
+с названиями регионов в таблице безработицы.
+
+Нормализованные названия, алиасы и индекс по значимым словам строятся
+один раз при создании RegionResolver, поэтому сопоставление не
+перебирает все регионы для каждого города. Результаты запоминаются,
+а несопоставленные названия собираются для отчёта.
+"""
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+# Краткие названия: полные
+REGION_ALIAS = {
+    # Республики
+    'Хакасия': 'Республика Хакасия',
+    'Башкирия': 'Республика Башкортостан',
+    'Адыгея': 'Республика Адыгея',
+    'Татарстан': 'Республика Татарстан',
+    'Коми': 'Республика Коми',
+    'Карелия': 'Республика Карелия',
+    'Мордовия': 'Республика Мордовия',
+    'Удмуртия': 'Удмуртская Республика',
+    'Чувашия': 'Чувашская Республика',
+    'Марий Эл': 'Республика Марий Эл',
+    'Северная Осетия': 'Республика Северная Осетия - Алания',
+    'Северная Осетия - Алания': 'Республика Северная Осетия - Алания',
+    'Дагестан': 'Республика Дагестан',
+    'Ингушетия': 'Республика Ингушетия',
+    'Кабардино-Балкария': 'Кабардино-Балкарская Республика',
+    'Карачаево-Черкесия': 'Карачаево-Черкесская Республика',
+    'Тыва': 'Республика Тыва',
+    'Алтай': 'Республика Алтай',
+    'Бурятия': 'Республика Бурятия',
+    'Якутия': 'Республика Саха (Якутия)',
+    # Города федерального значения
+    'Москва': 'г. Москва',
+    'Санкт-Петербург': 'г.Санкт-Петербург',
+    'Севастополь': 'г. Севастополь',
+    'Крым': 'Республика Крым',
+    # Области/края
+    'Ростовская': 'Ростовская область',
+    'Воронежская': 'Воронежская область',
+}
+
+REGION_KEYWORDS = tuple(k.lower() for k in [
+    'область', 'край', 'республика', 'автономный округ',
+    'г.', 'город', 'Хакасия', 'Башкирия', 'Адыгея', 'Татарстан',
+    'Коми', 'Карелия', 'Мордовия', 'Удмуртия', 'Чувашия', 'Марий Эл',
+    'Северная Осетия', 'Дагестан', 'Ингушетия', 'Кабардино-Балкария',
+    'Карачаево-Черкесия', 'Тыва', 'Алтай', 'Бурятия', 'Якутия',
+    'Крым', 'Севастополь', 'Москва', 'Санкт-Петербург'
+])
+
+SHORT_REPUBLICS = frozenset([
+    'Адыгея', 'Хакасия', 'Башкирия', 'Татарстан', 'Коми', 'Карелия',
+    'Мордовия', 'Удмуртия', 'Чувашия', 'Марий Эл', 'Тыва', 'Алтай',
+    'Бурятия', 'Якутия', 'Крым',
+])
+
+MUNICIPAL_MARKERS = ('городской округ', 'муниципальный округ', 'район', 'поселение')
+
+# Слова, общие для многих регионов: по ним регион не определить
+GENERIC_TOKENS = frozenset([
+    'область', 'край', 'республика', 'автономный', 'автономная', 'округ', 'округа',
+    'авт', 'без', 'город',
+])
+
+TOKEN_PATTERN = re.compile(r'[а-яёa-z0-9]+')
+
+
+def extract_region_from_osm(display_name):
+    """
+    Извлекает регион из строки Nominatim.
+    Ищет последнюю часть, которая выглядит как субъект РФ
+    """
+    if not isinstance(display_name, str):
+        return None
+
+    parts = [p.strip() for p in display_name.split(',') if p.strip()]
+    if parts and parts[-1] == 'Россия':
+        parts = parts[:-1]
+
+    # Идём с конца — ищем первый элемент, похожий на регион
+    for part in reversed(parts):
+        part_lower = part.lower()
+        # Пропускаем мелкие муниципальные образования
+        if any(x in part_lower for x in MUNICIPAL_MARKERS):
+            continue
+        # Если содержит ключевые слова — это регион
+        if any(kw in part_lower for kw in REGION_KEYWORDS):
+            return part.replace('—', '-')
+        # Или если это короткое название республики
+        if part in SHORT_REPUBLICS:
+            return part
+    return parts[-1] if parts else None
+
+
+def _compact(name):
+    return name.replace(' ', '').lower()
+
+
+def _tokens(name):
+    return {
+        token for token in TOKEN_PATTERN.findall(name.lower())
+        if len(token) > 2 and token not in GENERIC_TOKENS
+    }
+
+
+class RegionResolver:
+    """
+    Значения по региону (например, уровень безработицы) для названий
+    регионов из OSM. Порядок проверок: точное совпадение, алиас, совпадение
+    без пробелов и регистра, вхождение одного названия в другое среди
+    регионов с общими значимыми словами.
+    """
+
+    def __init__(self, values, aliases=REGION_ALIAS):
+        self.values = {key: value for key, value in values.items() if isinstance(key, str)}
+        self.aliases = {
+            alias: full_name for alias, full_name in aliases.items() if full_name in self.values
+        }
+        self.compact = {}
+        self.token_index = {}
+        for position, key in enumerate(self.values):
+            self.compact.setdefault(_compact(key), key)
+            for token in _tokens(key):
+                self.token_index.setdefault(token, []).append(position)
+        self.keys = list(self.values)
+        self.unresolved = set()
+        self._resolved = {}
+
+    def resolve(self, region):
+        """Название региона из таблицы или None"""
+        if not region:
+            return None
+        if region not in self._resolved:
+            key = self._lookup(region)
+            if key is None:
+                self.unresolved.add(region)
+            self._resolved[region] = key
+        return self._resolved[region]
+
+    def _lookup(self, region):
+        if region in self.values:
+            return region
+        if region in self.aliases:
+            return self.aliases[region]
+        compact = _compact(region)
+        if compact in self.compact:
+            return self.compact[compact]
+        candidates = sorted({
+            position for token in _tokens(region) for position in self.token_index.get(token, ())
+        })
+        for position in candidates:
+            key_compact = _compact(self.keys[position])
+            if compact in key_compact or key_compact in compact:
+                return self.keys[position]
+        return None
+
+    def value(self, region):
+        key = self.resolve(region)
+        return self.values[key] if key is not None else None
+
+    def report(self):
+        if not self.unresolved:
+            return "все регионы сопоставлены"
+        return f"не сопоставлено регионов: {len(self.unresolved)} ({', '.join(sorted(self.unresolved))})"
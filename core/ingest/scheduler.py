@@ -0,0 +1,96 @@
+"""
+Параллельная обработка городов с ограничениями на каждый внешний сервис.
+
+Стадии загрузки обрабатывают города пулом потоков, а каждый запрос к Nominatim или
+Overpass проходит через HostLimiter своего хоста: он ограничивает число
+одновременных запросов и минимальный интервал между ними. Общее время
+загрузки определяется политиками сервисов, а не последовательными
+сетевыми задержками.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+
+
+class HostLimiter:
+    """
+    Ограничение параллелизма и частоты запросов к одному хосту.
+    Частота ограничивается корзиной токенов: токен добавляется раз
+    в min_interval секунд, в корзине помещается не более burst токенов.
+    """
+
+    def __init__(self, name, max_concurrency, min_interval, burst=1):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self.burst = burst
+        self.requests = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _acquire(self):
+        """Забирает токен и возвращает, сколько ждать до его появления"""
+        with self._lock:
+            now = time.monotonic()
+            if self.min_interval > 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.min_interval)
+            else:
+                self._tokens = self.burst
+            self._updated = now
+            self._tokens -= 1
+            self.requests += 1
+            # Отрицательный остаток — очередь ожидающих токен
+            return max(0.0, -self._tokens * self.min_interval)
+
+    @contextmanager
+    def slot(self):
+        with self._semaphore:
+            wait = self._acquire()
+            if wait:
+                time.sleep(wait)
+            yield
+
+
+# Политика Nominatim: не более 1 запроса в секунду.
+# Публичный Overpass выдаёт по 2 слота на IP.
+LIMITERS = {
+    'nominatim': HostLimiter('nominatim', max_concurrency=1, min_interval=1.0),
+    'overpass': HostLimiter('overpass', max_concurrency=2, min_interval=1.0, burst=2),
+}
+
+
+def configure_limits(name, max_concurrency=None, min_interval=None, burst=None):
+    """Меняет ограничения хоста (например, для собственного инстанса Overpass)"""
+    current = LIMITERS[name]
+    LIMITERS[name] = HostLimiter(
+        name,
+        max_concurrency or current.max_concurrency,
+        current.min_interval if min_interval is None else min_interval,
+        burst or current.burst,
+    )
+
+
+def concurrent_map(func, items, workers):
+    """
+    Пары (item, func(item)) по мере готовности. items читается лениво:
+    в работе одновременно не больше 2 * workers элементов, поэтому
+    следующая стадия конвейера начинает работу до окончания предыдущей.
+    Исключение func пробрасывается при получении соответствующей пары.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for item in items:
+            pending[pool.submit(func, item)] = item
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        for future in as_completed(list(pending)):
+            yield pending.pop(future), future.result()
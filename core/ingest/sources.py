@@ -0,0 +1,109 @@
+"""
+Кэш исходных таблиц Excel в формате Parquet.
+
+Чтение xlsx через openpyxl занимает секунды на каждом запуске. Каждый
+источник один раз разбирается, нормализуется (типы колонок, очищенные
+названия и числа) и сохраняется в Parquet с ключом по хэшу содержимого
+файла. Пока xlsx не изменился, загрузка читает готовый Parquet.
+"""
+import hashlib
+import logging
+import os
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении нормализации, чтобы старые кэши не использовались
+CACHE_FORMAT = 1
+
+CITY_NAME_PATTERN = r'(г\.\s*[А-ЯЁа-яё][А-ЯЁа-яё\s\-]*)'
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_parquet_frame(frame):
+    """Колонки-объекты со смешанными типами приводятся к строкам, имена колонок — к str"""
+    frame = frame.copy()
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            frame[column] = frame[column].astype('string')
+    frame.columns = [str(column) for column in frame.columns]
+    return frame
+
+
+def _from_parquet_frame(frame):
+    # Годы в заголовках Excel читаются как int, а Parquet хранит только строки
+    frame.columns = [int(column) if column.isdigit() else column for column in frame.columns]
+    return frame
+
+
+def load_source(path, normalize=None, cache_dir=None):
+    """
+    Таблица из xlsx path после normalize(frame). Если cache_dir задан,
+    результат берётся из Parquet-кэша или сохраняется в него.
+    """
+    if cache_dir is None:
+        frame = pd.read_excel(path)
+        return normalize(frame) if normalize else frame
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    key = f"{stem}-v{CACHE_FORMAT}-{file_hash(path)[:16]}"
+    cache_path = os.path.join(cache_dir, f"{key}.parquet")
+    if os.path.exists(cache_path):
+        logger.info(f"{os.path.basename(path)}: из кэша {cache_path}")
+        return _from_parquet_frame(pd.read_parquet(cache_path))
+
+    frame = pd.read_excel(path)
+    if normalize:
+        frame = normalize(frame)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Кэши прежних версий файла больше не нужны
+    for name in os.listdir(cache_dir):
+        if name.startswith(f"{stem}-") and name.endswith('.parquet'):
+            os.remove(os.path.join(cache_dir, name))
+    _to_parquet_frame(frame).to_parquet(cache_path, index=False)
+    logger.info(f"{os.path.basename(path)}: разобран и сохранён в {cache_path}")
+    return _from_parquet_frame(_to_parquet_frame(frame))
+
+
+def normalize_ndfl(frame):
+    frame = frame[['Название', 'ОКТМО', 'НДФЛ']].copy()
+    frame['Название'] = frame['Название'].astype(str).str.strip()
+    return frame
+
+
+def normalize_population(frame):
+    frame = frame[['Название', 'Население']].copy()
+    population = frame['Население'].astype(str).str.replace(r'[^\d.,]', '', regex=True)
+    population = population.str.replace(',', '.')
+    frame['Население'] = pd.to_numeric(population, errors='coerce')
+    return frame
+
+
+def source_fingerprints(frame, columns=('ОКТМО', 'Население', 'НДФЛ')):
+    """
+    Отпечаток исходных значений каждой строки: по нему повторная загрузка
+    определяет, изменились ли данные города.
+    """
+    joined = frame[list(columns)].astype(str).agg('|'.join, axis=1)
+    return joined.map(lambda value: hashlib.sha256(value.encode()).hexdigest())
+
+
+def extract_city_names(names, valid_names):
+    """
+    Для каждой строки names — первая подстрока вида «г. ...», которая после
+    нормализации пробела после «г.» есть среди valid_names, иначе NaN.
+    """
+    matches = names.astype(str).str.extractall(CITY_NAME_PATTERN)[0]
+    matches = matches.str.replace(r'г\.\s*', 'г. ', regex=True)
+    matches = matches[matches.isin(valid_names)]
+    first = matches.groupby(level=0).first()
+    return first.reindex(names.index)
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    help = "Замеряет время ответа, число запросов и память представлений на текущем каталоге"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10, help="Замеров на сценарий")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help="Только указанный сценарий (можно повторять)")
+        parser.add_argument('--output', help="Сохранить JSON-отчёт в файл (по умолчанию — stdout)")
+        parser.add_argument('--baseline', help="JSON-отчёт другого коммита для сравнения")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations должно быть положительным")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        report = benchmark.run(options['iterations'], options['scenarios'])
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+            self.stdout.write(self.style.SUCCESS(f"Отчёт сохранён в {options['output']}"))
+        else:
+            self.stdout.write(content)
+
+        if baseline is not None:
+            for line in benchmark.compare_reports(baseline, report):
+                self.stdout.write(line)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import synthetic
+from core.scoring import rebuild_scores
+
+
+class Command(BaseCommand):
+    help = "Создаёт синтетический каталог городов для нагрузочных проверок и бенчмарков"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=1000, help="Число городов (1000, 10000, 100000)")
+        parser.add_argument('--regions', type=int, default=85, help="Число регионов")
+        parser.add_argument('--years', type=int, nargs='+', default=[2021, 2022, 2023],
+                            help="Годы экономических данных")
+        parser.add_argument('--seed', type=int, default=0, help="Зерно генератора")
+        parser.add_argument('--clear', action='store_true',
+                            help="Удалить прежние синтетические города (реальные не затрагиваются)")
+
+    def handle(self, *args, **options):
+        if options['cities'] < 1 or options['regions'] < 1:
+            raise CommandError("--cities и --regions должны быть положительными")
+        existing = synthetic.synthetic_cities().count()
+        if options['clear']:
+            # Рейтинг пересчитывается один раз, после генерации
+            synthetic.clear(rebuild=False)
+            self.stdout.write(f"Удалено синтетических городов: {existing}")
+            existing = 0
+        elif existing:
+            raise CommandError(f"Уже есть {existing} синтетических городов, запустите с --clear")
+
+        created = synthetic.generate(
+            options['cities'], options['regions'], options['years'], seed=options['seed'],
+        )
+        self.stdout.write('; '.join(f"{name}: {count}" for name, count in created.items()))
+        version = rebuild_scores()
+        self.stdout.write(self.style.SUCCESS(f"Рейтинг пересчитан, версия данных: {version}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.scoring import rebuild_scores
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает таблицу индексов городов (CityScore)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--region',
+            action = 'append',
+            dest = 'regions',
+            help = "Пересчитать только указанный регион (можно повторять)",
+        )
+
+    def handle(self, *args, **options):
+        version = rebuild_scores(options['regions'])
+        self.stdout.write(self.style.SUCCESS(f"Рейтинг пересчитан, версия данных: {version}"))
@@ -1,8 +1,10 @@
+import argparse
 import os
 import sys
-import time
 import logging
-import re
+from contextlib import closing
+from datetime import timedelta
+from functools import partial
 import requests
 import pandas as pd
 import django
@@ -14,57 +16,71 @@ sys.path.append(BASE_DIR)
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cityindex.settings')
 django.setup()
 
-from core.models import Locality, EconomicData, InfrastructureData
-from django.db import transaction
+from core.models import Locality
+from core.scoring import rebuild_scores
+from core.ingest.client import CityDeadlines, HttpClient
+from core.ingest.checkpoint import LOAD_BATCH_SIZE, RunCheckpoint
+from core.ingest.loader import UpsertStats
+from core.ingest.pipeline import RunReport, enrich, extract, geocode, infra, load
+from core.ingest.http_cache import DAY, DEFAULT_TTLS, HttpCache
+from core.ingest.sources import (
+    extract_city_names, load_source, normalize_ndfl, normalize_population, source_fingerprints,
+)
+from core.ingest.osm_extract import count_infrastructure
+from core.ingest.overpass import QUERY_TIMEOUT, area_clause, build_count_query, parse_counts
+from core.ingest.regions import RegionResolver, extract_region_from_osm
+from core.ingest.scheduler import LIMITERS, configure_limits
+from django.utils import timezone
 
 
-OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
-NOMINATIM_API_URL = "https://nominatim.openstreetmap.org/search"
-
 load_dotenv()
 
+# Переопределяются, например, для локальной замены (core/ingest/fake_services.py)
+OVERPASS_API_URL = os.getenv('OVERPASS_API_URL', "https://overpass-api.de/api/interpreter")
+NOMINATIM_API_URL = os.getenv('NOMINATIM_API_URL', "https://nominatim.openstreetmap.org/search")
+
 EMAIL = os.getenv('GORODINDEX_EMAIL', 'contact@gorodindex.local')
 HEADERS = {
     'User-Agent': f'GorodIndex/1.0 ({EMAIL})',
     'Accept-Language': 'ru'
 }
 
+# Сессии с пулом соединений; повторы с учётом Retry-After
+NOMINATIM = HttpClient('nominatim', HEADERS, pool_size=2, max_retries=3)
+OVERPASS = HttpClient('overpass', HEADERS, pool_size=4, backoff=10.0)
+
+# Общий срок на все запросы по одному городу, с
+CITY_DEADLINE = 300
+
 DATA_DIR = os.path.join(BASE_DIR, "data", "data_clean")
 NDLF_FILE = os.path.join(DATA_DIR, "ndfl.xlsx")
 POPULATION_FILE = os.path.join(DATA_DIR, "population.xlsx")
 UNEMPLOYMENT_FILE = os.path.join(DATA_DIR, "unemployment.xlsx")
+SOURCE_CACHE_DIR = os.path.join(BASE_DIR, "cache", "sources")
+
+HTTP_CACHE_PATH = os.getenv('CITYINDEX_HTTP_CACHE', os.path.join(BASE_DIR, "cache", "http.sqlite3"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('CITYINDEX_HTTP_CACHE_MAX_MB', 256)) * 1024 * 1024
+
+
+def open_http_cache(**options):
+    """Кэш HTTP по HTTP_CACHE_PATH; файл создаётся при первом открытии, а не при импорте"""
+    return HttpCache(HTTP_CACHE_PATH, max_bytes=HTTP_CACHE_MAX_BYTES, **options)
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def ndfl(input_file):
     """Обработка данных НДФЛ и населения"""
-    ndfl = pd.read_excel(input_file)
-    ndfl['Название'] = ndfl['Название'].astype(str).str.strip()
+    ndfl = load_source(input_file, normalize_ndfl, SOURCE_CACHE_DIR)
     valid_names = set(ndfl['Название'].dropna())
 
     logger.info(f"Загружено {len(valid_names)} городов из ndfl.xlsx")
 
-    df = pd.read_excel(POPULATION_FILE)
-
-    df['Население'] = df['Население'].astype(str).str.replace(r'[^\d.,]', '', regex=True)
-    df['Население'] = df['Население'].str.replace(',', '.')
-    df['Население'] = pd.to_numeric(df['Население'], errors='coerce')
+    df = load_source(POPULATION_FILE, normalize_population, SOURCE_CACHE_DIR)
 
-    # Функция: извлечь все подстроки вида "г. ..." из строки и проверить, есть ли среди них валидное название
-    def extract_valid_city_name(text):
-        if pd.isna(text):
-            return None
-        text = str(text)
-        matches = re.findall(r'г\.\s*[А-ЯЁа-яё][А-ЯЁа-яё\s\-]*', text)
-        for match in matches:
-            # Нормализуем: убираем лишние пробелы после точки
-            normalized = re.sub(r'г\.\s*', 'г. ', match)
-            if normalized in valid_names:
-                return normalized
-        return None
-
-    df['Чистое_название'] = df['Название'].apply(extract_valid_city_name)
+    # Из строки берётся первая подстрока вида "г. ...", которая есть среди названий НДФЛ
+    df['Чистое_название'] = extract_city_names(df['Название'], valid_names)
     filtered_df = df[
         (df['Население'] >= 12000) &
         (df['Население'] <= 100000) &
@@ -86,14 +102,19 @@ def ndfl(input_file):
     return final_clean.reset_index(drop=True)
 
 
-def get_city_coordinates(city_name, region_name=None):
+def nominatim_search(query):
+    params = {'q': query, 'format': 'json', 'limit': 1, 'addressdetails': 1}
+    logger.info(f"Запрос координат для: {query}")
+    return NOMINATIM.get(NOMINATIM_API_URL, params=params, timeout=10).json()
+
+
+def get_city_coordinates(city_name, region_name=None, http_cache=None):
     try:
         query = f"{city_name}, {region_name}" if region_name else city_name
-        params = {'q': query, 'format': 'json', 'limit': 1, 'addressdetails': 1}
-        logger.info(f"Запрос координат для: {query}")
-        response = requests.get(NOMINATIM_API_URL, params=params, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        if http_cache is None:
+            data = nominatim_search(query)
+        else:
+            data = http_cache.fetch('nominatim', query, lambda: nominatim_search(query))
         if not data:
             logger.warning(f"Не найдены координаты для: {query}")
             return None
@@ -120,119 +141,61 @@ def get_city_coordinates(city_name, region_name=None):
         return None
 
 
-def query_count_with_retry(element_type, tag_key, tag_value, area_clause, max_retries=5):
+def overpass_query(query, label, timeout=70):
     """
-    Запрос к Overpass с таймаутами и паузами.
-    Возвращает число или None при полном провале.
+    Запрос к Overpass через общий клиент (повторы и паузы — в HttpClient).
+    Возвращает разобранный JSON или None при полном провале.
     """
-    for attempt in range(max_retries):
-        try:
-            if element_type:
-                query = f'[out:json][timeout:60];{element_type}["{tag_key}"="{tag_value}"]({area_clause});out ids;'
-            else:
-                query = f'[out:json][timeout:60];(' \
-                        f'node["{tag_key}"="{tag_value}"]({area_clause});' \
-                        f'way["{tag_key}"="{tag_value}"]({area_clause});' \
-                        f');out ids;'
-
-            logger.debug(f"Отправка запроса: {query[:100]}...")
-
-            response = requests.post(
-                OVERPASS_API_URL,
-                data={'data': query},
-                headers=HEADERS,
-                timeout=70
-            )
-            response.raise_for_status()
-            data = response.json()
-            count = len(data.get('elements', []))
-            logger.info(f"  → {tag_value}: {count} объектов")
-            return count
-
-        except requests.exceptions.HTTPError as e:
-            status = e.response.status_code
-            if status == 429:
-                wait = 10 + 5 * attempt
-                logger.warning(f"  ⚠️ 429 Too Many Requests. Повтор через {wait} сек...")
-                time.sleep(wait)
-            elif status >= 500:
-                wait = 15 + 5 * attempt
-                logger.warning(f"  ⚠️ Серверная ошибка {status}. Повтор через {wait} сек...")
-                time.sleep(wait)
-            else:
-                logger.error(f"  ❌ Ошибка HTTP {status}")
-                break
-        except requests.exceptions.Timeout:
-            wait = 20
-            logger.warning(f"  ⚠️ Таймаут. Повтор через {wait} сек...")
-            time.sleep(wait)
-        except Exception as e:
-            logger.error(f"  ❌ Неизвестная ошибка: {e}")
-            break
-
-    logger.error(f"  ❌ Все {max_retries} попыток исчерпаны для '{tag_value}'")
+    try:
+        logger.debug(f"Отправка запроса: {query[:100]}...")
+        return OVERPASS.post(OVERPASS_API_URL, data={'data': query}, timeout=timeout).json()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"  ❌ Overpass, '{label}': {e}")
+    except ValueError as e:
+        logger.error(f"  ❌ Overpass, '{label}': некорректный JSON ({e})")
     return None
 
 
-def get_infrastructure_data(coords):
-    if coords['type'] == 'bbox':
-        area = f"{coords['min_lat']},{coords['min_lon']},{coords['max_lat']},{coords['max_lon']}"
-    else:
-        area = f"around:5000,{coords['lat']},{coords['lon']}"
-
-    schools = query_count_with_retry('', 'amenity', 'school', area) or 0
-    gas_stations = query_count_with_retry('', 'amenity', 'fuel', area) or 0
-    bus_stops = query_count_with_retry('node', 'highway', 'bus_stop', area) or 0
-
-    return {
-        'schools': schools,
-        'gas_stations': gas_stations,
-        'bus_stops': bus_stops
-    }
-
-
-def extract_region_from_osm(display_name):
+def get_infrastructure_batch(coords_list, http_cache):
     """
-    Извлекает регион из строки Nominatim.
-    Ищет последнюю часть, которая выглядит как субъект РФ
+    Счётчики инфраструктуры для нескольких городов одним запросом Overpass.
+    Счётчики кэшируются по каждой области отдельно (ключ — запрос для
+    одной области), поэтому в сеть уходят только промахи кэша.
+    Для областей, по которым запрос не удался (или которых нет в кэше в
+    режиме offline), возвращается None: прежние данные города не
+    перезаписываются, и следующий запуск запросит их снова.
     """
-    if not isinstance(display_name, str):
-        return None
-
-    parts = [p.strip() for p in display_name.split(',') if p.strip()]
-    if parts and parts[-1] in ('Россия'):
-        parts = parts[:-1]
-
-    region_keywords = [
-        'область', 'край', 'республика', 'автономный округ', 
-        'г.', 'город', 'Хакасия', 'Башкирия', 'Адыгея', 'Татарстан',
-        'Коми', 'Карелия', 'Мордовия', 'Удмуртия', 'Чувашия', 'Марий Эл',
-        'Северная Осетия', 'Дагестан', 'Ингушетия', 'Кабардино-Балкария',
-        'Карачаево-Черкесия', 'Тыва', 'Алтай', 'Бурятия', 'Якутия',
-        'Крым', 'Севастополь', 'Москва', 'Санкт-Петербург'
-    ]
-
-    # Идём с конца — ищем первый элемент, похожий на регион
-    for part in reversed(parts):
-        part_lower = part.lower()
-        # Пропускаем мелкие муниципальные образования
-        if any(x in part_lower for x in ['городской округ', 'муниципальный округ', 'район', 'поселение']):
-            continue
-        # Если содержит ключевые слова — это регион
-        if any(kw in part_lower for kw in [k.lower() for k in region_keywords]):
-            return part.replace('—', '-')
-        # Или если это короткое название республики
-        if part in ['Адыгея', 'Хакасия', 'Башкирия', 'Татарстан', 'Коми', 'Карелия',
-                    'Мордовия', 'Удмуртия', 'Чувашия', 'Марий Эл', 'Тыва', 'Алтай',
-                    'Бурятия', 'Якутия', 'Крым']:
-            return part
-    return parts[-1] if parts else None
+    areas = [area_clause(coords) for coords in coords_list]
+    results = [http_cache.get('overpass', build_count_query([area])) for area in areas]
+    missing = [i for i, counts in enumerate(results) if counts is None]
+    if not missing:
+        return results
+    if http_cache.offline:
+        logger.warning(f"  Нет счётчиков в кэше для {len(missing)} обл., режим offline")
+        return results
+
+    # Сетевой таймаут чуть больше серверного, заданного в самом запросе
+    data = overpass_query(
+        build_count_query([areas[i] for i in missing]), f"{len(missing)} обл.",
+        timeout = QUERY_TIMEOUT * len(missing) + 10,
+    )
+    fetched = None
+    if data is not None:
+        try:
+            fetched = parse_counts(data, len(missing))
+        except ValueError as e:
+            logger.error(f"  ❌ Некорректный ответ Overpass: {e}")
+    if fetched is not None:
+        for position, i in enumerate(missing):
+            results[i] = fetched[position]
+            http_cache.set('overpass', build_count_query([areas[i]]), fetched[position])
+    return results
 
 
 def get_unemployment_data():
     """Загружает и обрабатывает данные о безработице"""
     logger.info("Загрузка данных о безработице...")
-    df_unemp = pd.read_excel(UNEMPLOYMENT_FILE)
+    df_unemp = load_source(UNEMPLOYMENT_FILE, cache_dir=SOURCE_CACHE_DIR)
 
     if 'Unnamed: 0' not in df_unemp.columns or 2023 not in df_unemp.columns:
         raise ValueError("В файле unemployment.xlsx должны быть колонки 'Unnamed: 0' и 2023")
@@ -241,146 +204,185 @@ def get_unemployment_data():
     unemployment_dict = dict(zip(df_unemp['Unnamed: 0'], df_unemp[2023]))
     logger.info(f"Загружено {len(unemployment_dict)} регионов с данными о безработице.")
     
-    # Маппинг алиасов (краткие названия: полные)
-    REGION_ALIAS = {
-        # Республики
-        'Хакасия': 'Республика Хакасия',
-        'Башкирия': 'Республика Башкортостан',
-        'Адыгея': 'Республика Адыгея',
-        'Татарстан': 'Республика Татарстан',
-        'Коми': 'Республика Коми',
-        'Карелия': 'Республика Карелия',
-        'Мордовия': 'Республика Мордовия',
-        'Удмуртия': 'Удмуртская Республика',
-        'Чувашия': 'Чувашская Республика',
-        'Марий Эл': 'Республика Марий Эл',
-        'Северная Осетия': 'Республика Северная Осетия - Алания',
-        'Северная Осетия - Алания': 'Республика Северная Осетия - Алания',
-        'Дагестан': 'Республика Дагестан',
-        'Ингушетия': 'Республика Ингушетия',
-        'Кабардино-Балкария': 'Кабардино-Балкарская Республика',
-        'Карачаево-Черкесия': 'Карачаево-Черкесская Республика',
-        'Тыва': 'Республика Тыва',
-        'Алтай': 'Республика Алтай',
-        'Бурятия': 'Республика Бурятия',
-        'Якутия': 'Республика Саха (Якутия)',
-        # Города федерального значения
-        'Москва': 'г. Москва',
-        'Санкт-Петербург': 'г.Санкт-Петербург',
-        'Севастополь': 'г. Севастополь',
-        'Крым': 'Республика Крым',
-        # Области/края
-        'Ростовская': 'Ростовская область',
-        'Воронежская': 'Воронежская область',
+    return unemployment_dict
+
+
+def select_changed(cities_data, max_age_days):
+    """
+    Города, исходные строки которых изменились (по отпечатку) или данные
+    OSM которых старше max_age_days; новые города тоже попадают в выборку.
+    """
+    cutoff = timezone.now() - timedelta(days=max_age_days)
+    stored = {
+        code: (fingerprint, fetched_at)
+        for code, fingerprint, fetched_at in Locality.objects.values_list(
+            'oktmo_code', 'source_fingerprint', 'infrastructure__fetched_at',
+        )
     }
-    
-    return unemployment_dict, REGION_ALIAS
 
+    def changed(row):
+        fingerprint, fetched_at = stored.get(str(row['ОКТМО']), (None, None))
+        return fingerprint != row['fingerprint'] or fetched_at is None or fetched_at < cutoff
 
-def find_unemployment_rate(region_raw, unemp_dict, alias_map):
-    if not region_raw:
-        return None
-    if region_raw in unemp_dict:
-        return unemp_dict[region_raw]
-    if region_raw in alias_map:
-        full_name = alias_map[region_raw]
-        if full_name in unemp_dict:
-            return unemp_dict[full_name]
-    region_clean = region_raw.replace(' ', '').lower()
-    for key in unemp_dict:
-        if isinstance(key, str):
-            key_clean = key.replace(' ', '').lower()
-            if region_clean in key_clean or key_clean in region_clean:
-                return unemp_dict[key]
-    return None
+    mask = cities_data.apply(changed, axis=1) if len(cities_data) else []
+    return cities_data[mask]
 
 
-def fetch_and_save_data():
-    """Основная функция для загрузки и сохранения данных"""
-    logger.info("Загрузка и обработка данных НДФЛ и населения...")
-    
+def fetch_and_save_data(workers=4, overpass_batch=1, resume=None, osm_extract=None,
+                        incremental=False, max_age_days=30, deadline=CITY_DEADLINE, report_path=None,
+                        http_cache=None):
+    """
+    Основная функция для загрузки и сохранения данных: конвейер
+    extract → geocode → infra → enrich → load (см. core/ingest/pipeline.py).
+    При overpass_batch > 1 инфраструктура запрашивается одним запросом
+    на overpass_batch городов.
+    При osm_extract инфраструктура считается по локальной выгрузке OSM
+    за один проход для всех городов, без запросов к Overpass.
+    resume — id запуска (или 'latest'), который нужно продолжить.
+    При incremental обрабатываются только изменившиеся и устаревшие
+    города (см. select_changed), а пересчитываются только их регионы.
+    deadline — общий срок в секундах на запросы по одному городу во всех
+    стадиях; для пакета городов действует самый ранний срок.
+    Отчёт по стадиям сохраняется в IngestionRun.report и, если задан, в report_path.
+    http_cache — кэш ответов сервисов (HttpCache); если не задан, открывается
+    open_http_cache() на время запуска.
+    """
     for file_path in [NDLF_FILE, POPULATION_FILE, UNEMPLOYMENT_FILE]:
         if not os.path.exists(file_path):
             logger.error(f"Файл не найден: {file_path}")
             sys.exit(1)
-    
-    cities_data = ndfl(NDLF_FILE)
-    logger.info(f"Отобрано {len(cities_data)} городов для обработки")
-    
-    unemp_dict, region_aliases = get_unemployment_data()
-    
-    results = []
-    for idx, row in cities_data.iterrows():
-        raw_name = row['Название']
-        city_clean = raw_name[3:].strip()
-        logger.info(f"[{idx+1}/{len(cities_data)}] Обработка: {raw_name} → '{city_clean}'")
-
-        coords = get_city_coordinates(city_clean)
-        if not coords:
-            logger.warning(f"  ❌ Не найден: {city_clean}")
-            continue
-
-        infra = get_infrastructure_data(coords)
-        logger.info(f"  ✅ Результат: школы={infra['schools']}, АЗС={infra['gas_stations']}, остановки={infra['bus_stops']}")
-
-        region_name = extract_region_from_osm(coords['display_name'])
-        unemp_rate = find_unemployment_rate(region_name, unemp_dict, region_aliases)
-        
-        results.append({
-            'city_name': city_clean,
-            'region': region_name,
-            'population': row['Население'],
-            'oktmo_code': row['ОКТМО'],
-            'ndfl': row['НДФЛ'],
-            'unemployment_rate': unemp_rate,
-            'infrastructure': infra,
-            'osm_display_name': coords['display_name']
-        })
-
-        # Пауза между городами
-        time.sleep(2)
-
-    logger.info("Сохранение данных в базу Django...")
-    with transaction.atomic():
-        for item in results:
-            # Создаем или обновляем запись о городе
-            locality, _ = Locality.objects.update_or_create(
-                oktmo_code=item['oktmo_code'],
-                defaults={
-                    'city': item['city_name'],
-                    'region': item['region'],
-                    'population': item['population'],
-                    'is_active': True
-                }
-            )
-            
-            # Создаем или обновляем экономические данные
-            EconomicData.objects.update_or_create(
-                locality=locality,
-                year=2023,
-                defaults={
-                    'ndfl_total': item['ndfl'],
-                    'unemployment_rate': item['unemployment_rate']
-                }
-            )
-            
-            # Создаем или обновляем данные об инфраструктуре
-            InfrastructureData.objects.update_or_create(
-                locality=locality,
-                defaults={
-                    'schools': item['infrastructure']['schools'],
-                    'gas_stations': item['infrastructure']['gas_stations'],
-                    'bus_stops': item['infrastructure']['bus_stops']
-                }
+
+    if http_cache is None:
+        with closing(open_http_cache()) as http_cache:
+            return fetch_and_save_data(
+                workers=workers, overpass_batch=overpass_batch, resume=resume, osm_extract=osm_extract,
+                incremental=incremental, max_age_days=max_age_days, deadline=deadline,
+                report_path=report_path, http_cache=http_cache,
             )
-            
-            logger.info(f"Сохранен город: {locality.city} ({locality.region})")
-    
-    logger.info(f"Всего сохранено городов: {len(results)}")
-    return results
+
+    def load_frame():
+        logger.info("Загрузка и обработка данных НДФЛ и населения...")
+        cities_data = ndfl(NDLF_FILE)
+        cities_data['fingerprint'] = source_fingerprints(cities_data)
+        logger.info(f"Отобрано {len(cities_data)} городов для обработки")
+        if incremental:
+            total = len(cities_data)
+            cities_data = select_changed(cities_data, max_age_days)
+            logger.info(f"Изменились или устарели: {len(cities_data)} из {total} городов")
+        return cities_data
+
+    checkpoint = RunCheckpoint.start(0, resume)
+    completed = checkpoint.completed_codes()
+    if completed:
+        logger.info(f"Продолжение запуска #{checkpoint.run.pk}: пропущено {len(completed)} готовых городов")
+    regions = RegionResolver(get_unemployment_data())
+    report = RunReport(run_id=checkpoint.run.pk, workers=workers, overpass_batch=overpass_batch,
+                       osm_extract=osm_extract, incremental=incremental)
+    retries = {'geocode': NOMINATIM.retries, 'infra': OVERPASS.retries}
+
+    deadlines = CityDeadlines(deadline)
+
+    def scope(items):
+        return deadlines.scope([item['oktmo_code'] for item in items])
+
+    def counter(coords_list):
+        if osm_extract is not None:
+            return count_infrastructure(osm_extract, coords_list)
+        return get_infrastructure_batch(coords_list, http_cache)
+
+    def not_found(item):
+        checkpoint.record(item['oktmo_code'], item['city_name'], None)
+
+    def record(item):
+        # Контрольная точка сохраняется, как только по городу есть все данные
+        checkpoint.record(item['oktmo_code'], item['city_name'], item)
+
+    if osm_extract is not None:
+        infra_workers, infra_batch = 1, None
+    else:
+        infra_workers, infra_batch = LIMITERS['overpass'].max_concurrency, max(overpass_batch, 1)
+
+    try:
+        items = extract(report.stage('extract'), load_frame, completed)
+        geocoder = partial(get_city_coordinates, http_cache=http_cache)
+        items = geocode(report.stage('geocode'), items, geocoder, workers,
+                        on_not_found=not_found, scope=scope)
+        items = infra(report.stage('infra'), items, counter, infra_workers, infra_batch, scope=scope)
+        items = enrich(report.stage('enrich'), items, extract_region_from_osm, regions.value)
+        # Паузы между запросами обеспечивают ограничители хостов, а не sleep между городами
+        batches = load(report.stage('load'), items, record, checkpoint.load, LOAD_BATCH_SIZE)
+    except BaseException:
+        checkpoint.finish('failed', report.as_dict())
+        logger.error(f"Запуск #{checkpoint.run.pk} прерван, продолжить: --resume {checkpoint.run.pk}")
+        raise
+    finally:
+        report.stage('geocode').retries = NOMINATIM.retries - retries['geocode']
+        report.stage('infra').retries = OVERPASS.retries - retries['infra']
+
+    saved = sum(loaded for loaded, _ in batches)
+    upserts = UpsertStats()
+    for _, stats in batches:
+        upserts.merge(stats)
+    logger.info(f"Загрузка из внешних источников завершена: {report.summary()}; {http_cache.report()}")
+    logger.info(f"Регионы безработицы: {regions.report()}")
+    logger.info(f"Всего сохранено городов: {saved} ({upserts.report()})")
+
+    if incremental and resume is None:
+        if upserts.regions:
+            version = rebuild_scores(upserts.regions)
+            logger.info(f"Пересчитаны регионы ({len(upserts.regions)}), версия данных: {version}")
+    else:
+        version = rebuild_scores()
+        logger.info(f"Рейтинг пересчитан, версия данных: {version}")
+
+    checkpoint.finish('completed', report.as_dict())
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(report.to_json())
+        logger.info(f"Отчёт запуска: {report_path}")
+    return report
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка данных ГородИндекс")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Число городов, обрабатываемых одновременно")
+    parser.add_argument('--overpass-concurrency', type=int,
+                        help="Одновременных запросов к Overpass (по умолчанию 2)")
+    parser.add_argument('--overpass-interval', type=float,
+                        help="Минимальный интервал между запросами к Overpass, с")
+    parser.add_argument('--overpass-batch', type=int, default=1,
+                        help="Городов в одном запросе к Overpass")
+    parser.add_argument('--refresh', nargs='*', choices=sorted(DEFAULT_TTLS), metavar='SOURCE',
+                        help="Не читать кэш HTTP (все источники или nominatim/overpass)")
+    parser.add_argument('--offline', action='store_true',
+                        help="Только кэш HTTP, без обращений к сети")
+    parser.add_argument('--resume', nargs='?', const='latest', metavar='RUN_ID',
+                        help="Продолжить прерванный запуск (по умолчанию последний незавершённый)")
+    parser.add_argument('--osm-extract', metavar='PATH',
+                        help="Считать инфраструктуру по выгрузке OSM (.osm, .osm.gz, .osm.pbf) вместо Overpass")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Только изменившиеся города и города с устаревшими данными OSM")
+    parser.add_argument('--max-age', type=int, default=30, metavar='DAYS',
+                        help="Возраст данных OSM, после которого город обновляется (по умолчанию 30)")
+    parser.add_argument('--city-deadline', type=int, default=CITY_DEADLINE, metavar='SECONDS',
+                        help="Общий срок на все запросы по одному городу во всех стадиях, включая повторы")
+    parser.add_argument('--report', metavar='PATH',
+                        help="Сохранить JSON-отчёт по стадиям в файл")
+    args = parser.parse_args()
+    http_cache = open_http_cache(offline=args.offline)
+    if args.incremental:
+        # Устаревшие города не должны получать ответ Overpass из кэша старше max-age
+        http_cache.ttls['overpass'] = min(http_cache.ttls['overpass'], args.max_age * DAY)
+    if args.refresh is not None:
+        http_cache.refresh = set(args.refresh or DEFAULT_TTLS)
+    http_cache.purge_expired()
+    configure_limits('overpass', args.overpass_concurrency, args.overpass_interval)
+
     logger.info("Запуск скрипта загрузки данных...")
-    fetch_and_save_data()
-    logger.info("Скрипт завершен")
\ No newline at end of file
+    with closing(http_cache):
+        fetch_and_save_data(workers=args.workers, overpass_batch=args.overpass_batch, resume=args.resume,
+                            osm_extract=args.osm_extract, incremental=args.incremental,
+                            max_age_days=args.max_age, deadline=args.city_deadline,
+                            report_path=args.report, http_cache=http_cache)
+    logger.info("Скрипт завершен")
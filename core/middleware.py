@@ -0,0 +1,237 @@
+"""
+Учёт запросов к БД и времени ответа по представлениям.
+
+QueryInstrumentationMiddleware (включается CITYINDEX_QUERY_INSTRUMENTATION,
+см. settings.py) на время обработки запроса подключает к соединениям БД
+execute_wrapper и считает число SQL-запросов, их суммарное время и
+повторы: запросы с одинаковой сигнатурой (текст SQL без параметров и с
+IN-списками, свёрнутыми до одного элемента) — типичный признак N+1.
+Отдельно учитывается время рендеринга шаблонов и общее время ответа.
+
+Результат отдаётся в заголовке Server-Timing (виден в DevTools браузера)
+и пишется JSON-строкой в логгер core.instrumentation. Для потоковых
+ответов заголовок содержит только время до начала отдачи, а запись в
+лог делается после отдачи всего тела.
+
+ProfilingMiddleware по запросу сотрудника (?profile=1 или заголовок
+X-Profile: 1) выполняет представление под cProfile и сохраняет профиль
+вместе с журналом SQL-запросов в RequestProfile (см. админку).
+"""
+import cProfile
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.db import connections
+from django.template.backends.django import Template
+
+from .models import RequestProfile
+
+
+logger = logging.getLogger('core.instrumentation')
+
+IN_LIST_PATTERN = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+
+# Сколько повторяющихся запросов выводить в лог
+DUPLICATES_LOGGED = 5
+
+QUERY_LOG_LIMIT = 1000
+
+QUERY_LOG_SQL_CHARS = 2000
+
+
+def sql_signature(sql):
+    """Текст запроса без различий в длине IN-списков и пробелах"""
+    return ' '.join(IN_LIST_PATTERN.sub('(%s, ...)', sql).split())
+
+
+class QueryStats:
+    """Запросы к БД и время рендеринга шаблонов за один HTTP-запрос"""
+
+    def __init__(self, keep_log=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.signatures = Counter()
+        # Полный журнал запросов (для профилей), не больше QUERY_LOG_LIMIT записей
+        self.log = [] if keep_log else None
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper для connection.execute_wrapper()"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.db_seconds += duration
+            self.queries += 1
+            self.signatures[sql_signature(sql)] += 1
+            if self.log is not None and len(self.log) < QUERY_LOG_LIMIT:
+                self.log.append({
+                    'sql': sql[:QUERY_LOG_SQL_CHARS],
+                    'ms': round(duration * 1000, 3),
+                    'db': context['connection'].alias,
+                })
+
+    @contextmanager
+    def capture(self):
+        """Учитывает запросы ко всем БД и рендеринг шаблонов внутри блока"""
+        previous = getattr(_active, 'stats', None)
+        _active.stats = self
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                yield self
+        finally:
+            _active.stats = previous
+
+    def duplicates(self):
+        """Сигнатуры запросов, выполненных больше одного раза, по убыванию числа"""
+        return [(sql, count) for sql, count in self.signatures.most_common() if count > 1]
+
+    def as_dict(self):
+        duplicates = self.duplicates()
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_seconds * 1000, 2),
+            'duplicate_queries': sum(count - 1 for _, count in duplicates),
+            'duplicates': [
+                {
+                    'signature': hashlib.sha1(sql.encode()).hexdigest()[:12],
+                    'count': count,
+                    'sql': sql[:300],
+                }
+                for sql, count in duplicates[:DUPLICATES_LOGGED]
+            ],
+            'template_ms': round(self.template_seconds * 1000, 2),
+        }
+
+
+_active = threading.local()
+
+_template_render = Template.render
+
+
+@wraps(_template_render)
+def _timed_render(self, context=None, request=None):
+    stats = getattr(_active, 'stats', None)
+    if stats is None:
+        return _template_render(self, context, request)
+    start = time.perf_counter()
+    try:
+        return _template_render(self, context, request)
+    finally:
+        stats.template_seconds += time.perf_counter() - start
+
+
+def instrument_templates():
+    """
+    Подменяет render шаблонов бэкенда DjangoTemplates. Вложенные include
+    и extends рендерятся внутри него, поэтому время не учитывается дважды.
+    """
+    Template.render = _timed_render
+
+
+def server_timing(data, total_seconds):
+    """Значение заголовка Server-Timing"""
+    db_description = f"{data['queries']} queries"
+    if data['duplicate_queries']:
+        db_description += f", {data['duplicate_queries']} duplicate"
+    return ', '.join([
+        f'db;dur={data["db_ms"]};desc="{db_description}"',
+        f'tpl;dur={data["template_ms"]};desc="templates"',
+        f'total;dur={total_seconds * 1000:.2f};desc="view"',
+    ])
+
+
+class QueryInstrumentationMiddleware:
+    """Число и время SQL-запросов, повторы, рендеринг и время ответа"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with stats.capture():
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        data = stats.as_dict()
+        response.headers['Server-Timing'] = server_timing(data, elapsed)
+        if response.streaming:
+            response.streaming_content = self._streamed(
+                request, response, response.streaming_content, stats, start,
+            )
+        else:
+            self._log(request, response, stats, elapsed)
+        return response
+
+    def _streamed(self, request, response, content, stats, start):
+        with stats.capture():
+            yield from content
+        self._log(request, response, stats, time.perf_counter() - start, streaming=True)
+
+    def _log(self, request, response, stats, elapsed, streaming=False):
+        match = request.resolver_match
+        record = {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(elapsed * 1000, 2),
+            **stats.as_dict(),
+        }
+        if streaming:
+            record['streaming'] = True
+        level = logging.WARNING if record['duplicate_queries'] else logging.INFO
+        logger.log(level, json.dumps(record, ensure_ascii=False), extra={'instrumentation': record})
+
+
+PROFILE_PARAMETER = 'profile'
+
+PROFILE_HEADER = 'X-Profile'
+
+
+class ProfilingMiddleware:
+    """
+    Профиль отдельного запроса для сотрудников. Должен стоять после
+    AuthenticationMiddleware. Для потоковых ответов профилируется только
+    подготовка ответа, без отдачи тела. Номер сохранённого профиля
+    возвращается в заголовке X-Profile-Id.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def requested(self, request):
+        # Пользователь загружается только при наличии флага
+        flag = request.GET.get(PROFILE_PARAMETER) or request.headers.get(PROFILE_HEADER)
+        return bool(flag) and request.user.is_staff
+
+    def __call__(self, request):
+        if not self.requested(request):
+            return self.get_response(request)
+
+        stats = QueryStats(keep_log=True)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with stats.capture():
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        profile = RequestProfile.capture(request, response, profiler, stats, elapsed)
+        response.headers['X-Profile-Id'] = str(profile.pk)
+        return response
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия данных')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Версия данных',
+                'verbose_name_plural': 'Версия данных',
+            },
+        ),
+        migrations.CreateModel(
+            name='CityScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=100, verbose_name='Субъект РФ')),
+                ('eco_score', models.FloatField(null=True, verbose_name='Экономика')),
+                ('demo_score', models.FloatField(null=True, verbose_name='Безработица')),
+                ('infra_score', models.FloatField(verbose_name='Инфраструктура')),
+                ('inv_index', models.FloatField(verbose_name='Инвестиционный индекс')),
+                ('rank', models.PositiveIntegerField(default=0, verbose_name='Место в рейтинге')),
+                ('region_rank', models.PositiveIntegerField(default=0, verbose_name='Место в регионе')),
+                ('data_version', models.PositiveIntegerField(default=0, verbose_name='Версия данных')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('locality', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='score', to='core.locality', verbose_name='Город')),
+            ],
+            options={
+                'verbose_name': 'Индекс города',
+                'verbose_name_plural': 'Индексы городов',
+                'ordering': ['rank'],
+                'indexes': [models.Index(fields=['rank'], name='core_citysc_rank_1f04b4_idx'), models.Index(fields=['-inv_index'], name='core_citysc_inv_ind_fd5026_idx'), models.Index(fields=['region', 'region_rank'], name='core_citysc_region_a9240b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_cityscore_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=100, unique=True, verbose_name='Субъект РФ')),
+                ('ndfl_median', models.FloatField(null=True, verbose_name='НДФЛ на душу (база региона)')),
+                ('schools_per_1k', models.FloatField(verbose_name='Школы на 1000 жителей')),
+                ('gas_stations_per_1k', models.FloatField(verbose_name='АЗС на 1000 жителей')),
+                ('bus_stops_per_1k', models.FloatField(verbose_name='Остановки на 1000 жителей')),
+                ('data_version', models.PositiveIntegerField(default=0, verbose_name='Версия данных')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Статистика региона',
+                'verbose_name_plural': 'Статистика регионов',
+                'ordering': ['region'],
+            },
+        ),
+    ]
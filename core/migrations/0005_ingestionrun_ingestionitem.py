@@ -0,0 +1,47 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_regionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('completed', 'Завершён'), ('failed', 'Ошибка')], default='running', max_length=20, verbose_name='Статус')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Городов в запуске')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начат')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершён')),
+            ],
+            options={
+                'verbose_name': 'Запуск загрузки',
+                'verbose_name_plural': 'Запуски загрузки',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestionItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('oktmo_code', models.CharField(max_length=11, verbose_name='Код ОКТМО')),
+                ('city_name', models.CharField(max_length=100, verbose_name='Город')),
+                ('status', models.CharField(choices=[('fetched', 'Получен'), ('not_found', 'Не найден'), ('loaded', 'Сохранён')], max_length=20, verbose_name='Статус')),
+                ('payload', models.JSONField(blank=True, null=True, verbose_name='Данные')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.ingestionrun', verbose_name='Запуск')),
+            ],
+            options={
+                'verbose_name': 'Город в загрузке',
+                'verbose_name_plural': 'Города в загрузке',
+                'indexes': [models.Index(fields=['run', 'status'], name='core_ingest_run_id_fab9ec_idx')],
+                'unique_together': {('run', 'oktmo_code')},
+            },
+        ),
+    ]
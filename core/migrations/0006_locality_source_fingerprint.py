@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_ingestionrun_ingestionitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='infrastructuredata',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Получено из OSM'),
+        ),
+        migrations.AddField(
+            model_name='locality',
+            name='source_fingerprint',
+            field=models.CharField(blank=True, default='', help_text='Хэш строк НДФЛ и населения при последней загрузке', max_length=64, verbose_name='Отпечаток исходных данных'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_locality_source_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionrun',
+            name='report',
+            field=models.JSONField(blank=True, null=True, verbose_name='Отчёт по стадиям'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_ingestionrun_report'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Снят')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=500, verbose_name='Адрес')),
+                ('view_name', models.CharField(blank=True, max_length=200, verbose_name='Представление')),
+                ('status', models.PositiveSmallIntegerField(verbose_name='Код ответа')),
+                ('total_ms', models.FloatField(verbose_name='Время ответа (мс)')),
+                ('queries', models.PositiveIntegerField(verbose_name='SQL-запросов')),
+                ('db_ms', models.FloatField(verbose_name='Время БД (мс)')),
+                ('query_log', models.JSONField(default=list, verbose_name='Журнал SQL-запросов')),
+                ('summary', models.TextField(blank=True, verbose_name='Самые затратные функции')),
+                ('stats', models.BinaryField(verbose_name='Профиль (pstats)')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Размер (байт)')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
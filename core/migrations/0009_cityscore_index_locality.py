@@ -0,0 +1,21 @@
+# Generated by Django 5.2.9 on 2026-10-17 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_requestprofile'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cityscore',
+            name='core_citysc_inv_ind_fd5026_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cityscore',
+            index=models.Index(fields=['inv_index', 'locality'], name='core_citysc_inv_ind_c533d8_idx'),
+        ),
+    ]
@@ -1,6 +1,29 @@
-from django.db import models
+import io
+import marshal
+import pstats
+import threading
+
+from django.conf import settings
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
-from django.db.models import Avg, F
+from django.db.models import F, FilteredRelation, OuterRef, Q, Subquery
+
+
+class LocalityQuerySet(models.QuerySet):
+
+    def with_latest_economics(self):
+        """Аннотирует ndfl_total и unemployment_rate за последний год (JOIN, без N+1)"""
+        latest_year = EconomicData.objects.filter(
+            locality = OuterRef('pk'),
+        ).order_by('-year').values('year')[:1]
+        return self.annotate(
+            latest_eco = FilteredRelation(
+                'economics', condition=Q(economics__year=Subquery(latest_year)),
+            ),
+        ).annotate(
+            ndfl_total = F('latest_eco__ndfl_total'),
+            unemployment_rate = F('latest_eco__unemployment_rate'),
+        )
 
 
 class Locality(models.Model):
@@ -26,6 +49,15 @@ class Locality(models.Model):
         verbose_name = "Участвует в рейтинге",
         help_text = "Поле для отладки, исключение 'некорректных городов'"
     )
+    source_fingerprint = models.CharField(
+        max_length = 64,
+        blank = True,
+        default = '',
+        verbose_name = "Отпечаток исходных данных",
+        help_text = "Хэш строк НДФЛ и населения при последней загрузке",
+    )
+
+    objects = LocalityQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Город"
@@ -37,9 +69,12 @@ class Locality(models.Model):
     
     def calculate_inv_index(self):
         eco = self.economics.order_by('-year').first()
-        eco_score = min(eco.ndfl_per_capita / eco.ndfl_median(self.region), 1)
+        # Без базы региона (в нём нет населения) составляющая равна 0, как в scoring.score_frame()
+        ndfl_median = eco.ndfl_median(self.region)
+        eco_score = min(eco.ndfl_per_capita / ndfl_median, 1) if ndfl_median else 0.0
         unemployment = eco.unemployment_rate
-        demo_score = 1 - unemployment / 100
+        # Без данных о безработице составляющая равна 0, как и без инфраструктуры
+        demo_score = 1 - unemployment / 100 if unemployment is not None else 0.0
         infra_score = 0.0
         if hasattr(self, 'infrastructure'):
             infra_score = self.infrastructure.infra_score(self.region)        
@@ -82,13 +117,7 @@ class EconomicData(models.Model):
         return 0
     
     def ndfl_median(self,region_name):
-        ndfl_agg=EconomicData.objects.filter(
-            locality__region=region_name,
-            locality__is_active=True).aggregate(
-                avg_ndfl = Avg('ndfl_total'),
-                avg_pop = Avg('locality__population')
-            )
-        return ndfl_agg['avg_ndfl']/ndfl_agg['avg_pop']
+        return RegionStats.for_region(region_name).ndfl_median
 
 
 class InfrastructureData(models.Model):
@@ -110,6 +139,11 @@ class InfrastructureData(models.Model):
         default = 0,
         verbose_name = "Остановки ОТ",
     )
+    fetched_at = models.DateTimeField(
+        null = True,
+        blank = True,
+        verbose_name = "Получено из OSM",
+    )
 
     class Meta:
         verbose_name = "Инфраструктура"
@@ -120,29 +154,17 @@ class InfrastructureData(models.Model):
     
     @classmethod
     def infra_median(cls,region_name):
-        qs=cls.objects.filter(
-            locality__region = region_name,
-            locality__is_active = True,
-            locality__population__gt = 0
-        ).annotate(
-            schools_per_1k = F('schools')*1000 / F('locality__population'),
-            gas_per_1k = F('gas_stations')*1000 / F('locality__population'),
-            bus_per_1k = F('bus_stops')*1000 / F('locality__population')
-        )
-        agg=qs.aggregate(
-            avg_schools = Avg('schools_per_1k'),
-            avg_gas = Avg('gas_per_1k'),
-            avg_bus = Avg('bus_per_1k')
-            )
-        
+        stats = RegionStats.for_region(region_name)
         return{
-            'schools_per_1k': agg['avg_schools'] or 0.4,
-            'gas_stations_per_1k': agg['avg_gas'] or 0.1,
-            'bus_stops_per_1k': agg['avg_bus'] or 2
+            'schools_per_1k': stats.schools_per_1k,
+            'gas_stations_per_1k': stats.gas_stations_per_1k,
+            'bus_stops_per_1k': stats.bus_stops_per_1k
         }
 
     def infra_score(self,region_name):
         regional_medians = self.infra_median(region_name)
+        if not self.locality.population:
+            return 0.0
         pop_k = self.locality.population/1000
 
         ratios={'schools': self.schools / pop_k / regional_medians['schools_per_1k'],
@@ -156,4 +178,481 @@ class InfrastructureData(models.Model):
             ratio = ratios[key]
             score += ratio * weights[key]
         
-        return min(score,1.0)
\ No newline at end of file
+        return min(score,1.0)
+
+# Значения по умолчанию для регионов без данных об инфраструктуре
+INFRA_DEFAULTS = {
+    'schools_per_1k': 0.4,
+    'gas_stations_per_1k': 0.1,
+    'bus_stops_per_1k': 2,
+}
+
+
+def _sql_avg(total, count):
+    """Среднее как в SQL AVG: точная целая сумма, делённая на количество"""
+    if not count:
+        return None
+    return float(int(total)) / count
+
+
+class RegionStats(models.Model):
+    region = models.CharField(
+        max_length = 100,
+        unique = True,
+        verbose_name = "Субъект РФ",
+    )
+    ndfl_median = models.FloatField(
+        null = True,
+        verbose_name = "НДФЛ на душу (база региона)",
+    )
+    schools_per_1k = models.FloatField(
+        verbose_name = "Школы на 1000 жителей",
+    )
+    gas_stations_per_1k = models.FloatField(
+        verbose_name = "АЗС на 1000 жителей",
+    )
+    bus_stops_per_1k = models.FloatField(
+        verbose_name = "Остановки на 1000 жителей",
+    )
+    data_version = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Версия данных",
+    )
+    updated_at = models.DateTimeField(
+        auto_now = True,
+        verbose_name = "Обновлено",
+    )
+
+    class Meta:
+        verbose_name = "Статистика региона"
+        verbose_name_plural = "Статистика регионов"
+        ordering = ['region']
+
+    def __str__(self):
+        return f"Статистика: {self.region}"
+
+    @classmethod
+    def compute(cls, regions):
+        """
+        Считает базы сравнения по активным городам регионов двумя
+        сгруппированными запросами. Возвращает несохранённые объекты.
+        """
+        regions = list(set(regions))
+        ndfl_rows = EconomicData.objects.filter(
+            locality__region__in = regions,
+            locality__is_active = True,
+        ).values('locality__region').annotate(
+            ndfl_sum = models.Sum('ndfl_total'),
+            pop_sum = models.Sum('locality__population'),
+            rows = models.Count('id'),
+        ).order_by()
+        infra_rows = InfrastructureData.objects.filter(
+            locality__region__in = regions,
+            locality__is_active = True,
+            locality__population__gt = 0,
+        ).values('locality__region').annotate(
+            schools_sum = models.Sum(F('schools')*1000 / F('locality__population')),
+            gas_sum = models.Sum(F('gas_stations')*1000 / F('locality__population')),
+            bus_sum = models.Sum(F('bus_stops')*1000 / F('locality__population')),
+            rows = models.Count('id'),
+        ).order_by()
+
+        stats = {region: cls(region=region, **INFRA_DEFAULTS) for region in regions}
+        for row in ndfl_rows:
+            avg_ndfl = _sql_avg(row['ndfl_sum'], row['rows'])
+            avg_pop = _sql_avg(row['pop_sum'], row['rows'])
+            # Без населения база не определена: ndfl_median остаётся None,
+            # и eco_score городов региона равен 0
+            if avg_ndfl is not None and avg_pop:
+                stats[row['locality__region']].ndfl_median = avg_ndfl / avg_pop
+        for row in infra_rows:
+            item = stats[row['locality__region']]
+            item.schools_per_1k = _sql_avg(row['schools_sum'], row['rows']) or INFRA_DEFAULTS['schools_per_1k']
+            item.gas_stations_per_1k = _sql_avg(row['gas_sum'], row['rows']) or INFRA_DEFAULTS['gas_stations_per_1k']
+            item.bus_stops_per_1k = _sql_avg(row['bus_sum'], row['rows']) or INFRA_DEFAULTS['bus_stops_per_1k']
+        return stats
+
+    @classmethod
+    def refresh(cls, regions, version=None):
+        """Пересчитывает и сохраняет статистику регионов"""
+        stats = cls.compute(regions)
+        if version is None:
+            version = DataVersion.current()
+        for item in stats.values():
+            item.data_version = version
+        cls.objects.bulk_create(
+            stats.values(),
+            update_conflicts = True,
+            unique_fields = ['region'],
+            update_fields = ['ndfl_median', 'schools_per_1k', 'gas_stations_per_1k',
+                             'bus_stops_per_1k', 'data_version', 'updated_at'],
+        )
+        return stats
+
+    @classmethod
+    def invalidate(cls, regions):
+        """
+        Сбрасывает сохранённую статистику. До пересчёта в rebuild_scores
+        она считается при чтении заново.
+        """
+        cls.objects.filter(region__in=list(regions)).delete()
+
+    @classmethod
+    def for_regions(cls, regions):
+        """
+        Статистика по регионам: сохранённая или посчитанная заново. Посчитанная
+        не сохраняется: чтение (страницы, API) не пишет в БД, это делает
+        rebuild_scores через refresh().
+        """
+        regions = set(regions)
+        stats = {item.region: item for item in cls.objects.filter(region__in=list(regions))}
+        missing = regions - stats.keys()
+        if missing:
+            stats.update(cls.compute(missing))
+        return stats
+
+    @classmethod
+    def for_region(cls, region_name):
+        return cls.for_regions([region_name])[region_name]
+
+
+# Версия данных, прочитанная в текущем запросе: страница проверяет версию
+# несколько раз, а читать её достаточно один раз. Между запросами значение
+# не хранится, поэтому загрузка в другом процессе видна со следующего запроса
+_data_version = threading.local()
+
+
+class DataVersion(models.Model):
+    version = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Версия данных",
+    )
+    updated_at = models.DateTimeField(
+        auto_now = True,
+        verbose_name = "Обновлено",
+    )
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версия данных"
+
+    def __str__(self):
+        return f"Версия данных {self.version}"
+
+    @classmethod
+    def current(cls):
+        """
+        Текущая версия набора данных рейтинга. Читается из БД (один запрос
+        по первичному ключу), а не из кэша Django: версию увеличивают и
+        отдельные процессы (fetch_data.py, rebuild_scores), о чём locmem
+        воркеров не узнает. Внутри запроса значение читается один раз
+        (см. remember_per_request), вне запросов — при каждом вызове.
+        """
+        version = getattr(_data_version, 'value', None)
+        if version is None:
+            version = cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+            if getattr(_data_version, 'per_request', False):
+                _data_version.value = version
+        return version
+
+    @classmethod
+    def remember_per_request(cls, enabled):
+        """
+        Включает (в начале запроса) или выключает (в конце) запоминание
+        прочитанной версии в этом потоке, см. core/signals.py
+        """
+        _data_version.value = None
+        _data_version.per_request = enabled
+
+    @classmethod
+    def forget(cls):
+        """Сбрасывает прочитанную версию в этом потоке"""
+        _data_version.value = None
+
+    @classmethod
+    def bump(cls):
+        """
+        Увеличивает версию данных и возвращает новое значение. Другие
+        соединения видят новую версию только после фиксации транзакции,
+        поэтому под ней не закэшируются старые данные.
+        """
+        obj, created = cls.objects.get_or_create(pk=1, defaults={'version': 1})
+        if not created:
+            cls.objects.filter(pk=1).update(version=F('version') + 1)
+            obj.refresh_from_db(fields=['version'])
+        cls.forget()
+        transaction.on_commit(cls.forget)
+        return obj.version
+
+
+class CityScore(models.Model):
+    locality = models.OneToOneField(
+        Locality,
+        on_delete = models.CASCADE,
+        related_name = 'score',
+        verbose_name = "Город"
+    )
+    region = models.CharField(
+        max_length = 100,
+        verbose_name = "Субъект РФ",
+    )
+    eco_score = models.FloatField(
+        null = True,
+        verbose_name = "Экономика",
+    )
+    demo_score = models.FloatField(
+        null = True,
+        verbose_name = "Безработица",
+    )
+    infra_score = models.FloatField(
+        verbose_name = "Инфраструктура",
+    )
+    inv_index = models.FloatField(
+        verbose_name = "Инвестиционный индекс",
+    )
+    rank = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Место в рейтинге",
+    )
+    region_rank = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Место в регионе",
+    )
+    data_version = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Версия данных",
+    )
+    updated_at = models.DateTimeField(
+        auto_now = True,
+        verbose_name = "Обновлено",
+    )
+
+    class Meta:
+        verbose_name = "Индекс города"
+        verbose_name_plural = "Индексы городов"
+        ordering = ['rank']
+        indexes = [
+            models.Index(fields=['rank']),
+            models.Index(fields=['inv_index', 'locality']),
+            models.Index(fields=['region', 'region_rank']),
+        ]
+
+    def __str__(self):
+        return f"{self.locality.city}: {self.inv_index:.2f}"
+
+
+class IngestionRun(models.Model):
+    STATUS_CHOICES = [
+        ('running', "Выполняется"),
+        ('completed', "Завершён"),
+        ('failed', "Ошибка"),
+    ]
+
+    status = models.CharField(
+        max_length = 20,
+        choices = STATUS_CHOICES,
+        default = 'running',
+        verbose_name = "Статус",
+    )
+    total = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Городов в запуске",
+    )
+    started_at = models.DateTimeField(
+        auto_now_add = True,
+        verbose_name = "Начат",
+    )
+    finished_at = models.DateTimeField(
+        null = True,
+        blank = True,
+        verbose_name = "Завершён",
+    )
+    report = models.JSONField(
+        null = True,
+        blank = True,
+        verbose_name = "Отчёт по стадиям",
+    )
+
+    class Meta:
+        verbose_name = "Запуск загрузки"
+        verbose_name_plural = "Запуски загрузки"
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Загрузка #{self.pk} ({self.get_status_display()})"
+
+
+class IngestionItem(models.Model):
+    """
+    Контрольная точка загрузки по одному городу: полученная из внешних
+    сервисов запись сохраняется сразу, а в основные таблицы переносится
+    пакетами. При возобновлении запуска города со статусом fetched/loaded
+    повторно не запрашиваются.
+    """
+    STATUS_CHOICES = [
+        ('fetched', "Получен"),
+        ('not_found', "Не найден"),
+        ('loaded', "Сохранён"),
+    ]
+
+    run = models.ForeignKey(
+        IngestionRun,
+        on_delete = models.CASCADE,
+        related_name = 'items',
+        verbose_name = "Запуск",
+    )
+    oktmo_code = models.CharField(
+        max_length = 11,
+        verbose_name = "Код ОКТМО",
+    )
+    city_name = models.CharField(
+        max_length = 100,
+        verbose_name = "Город",
+    )
+    status = models.CharField(
+        max_length = 20,
+        choices = STATUS_CHOICES,
+        verbose_name = "Статус",
+    )
+    payload = models.JSONField(
+        null = True,
+        blank = True,
+        verbose_name = "Данные",
+    )
+    updated_at = models.DateTimeField(
+        auto_now = True,
+        verbose_name = "Обновлено",
+    )
+
+    class Meta:
+        verbose_name = "Город в загрузке"
+        verbose_name_plural = "Города в загрузке"
+        unique_together = ['run', 'oktmo_code']
+        indexes = [
+            models.Index(fields=['run', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.city_name}: {self.get_status_display()}"
+
+
+# Строк отчёта pstats, сохраняемых для просмотра в админке
+PROFILE_SUMMARY_LINES = 40
+
+
+class RequestProfile(models.Model):
+    """
+    Профиль запроса (cProfile) с журналом SQL-запросов, снятый
+    ProfilingMiddleware. Хранилище ограничено по размеру и числу записей
+    (PROFILE_STORE_MAX_MB, PROFILE_STORE_MAX_COUNT): старые профили
+    удаляются при сохранении новых.
+    """
+    created_at = models.DateTimeField(
+        auto_now_add = True,
+        verbose_name = "Снят",
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete = models.SET_NULL,
+        null = True,
+        blank = True,
+        related_name = '+',
+        verbose_name = "Пользователь",
+    )
+    method = models.CharField(
+        max_length = 10,
+        verbose_name = "Метод",
+    )
+    path = models.CharField(
+        max_length = 500,
+        verbose_name = "Адрес",
+    )
+    view_name = models.CharField(
+        max_length = 200,
+        blank = True,
+        verbose_name = "Представление",
+    )
+    status = models.PositiveSmallIntegerField(
+        verbose_name = "Код ответа",
+    )
+    total_ms = models.FloatField(
+        verbose_name = "Время ответа (мс)",
+    )
+    queries = models.PositiveIntegerField(
+        verbose_name = "SQL-запросов",
+    )
+    db_ms = models.FloatField(
+        verbose_name = "Время БД (мс)",
+    )
+    query_log = models.JSONField(
+        default = list,
+        verbose_name = "Журнал SQL-запросов",
+    )
+    summary = models.TextField(
+        blank = True,
+        verbose_name = "Самые затратные функции",
+    )
+    stats = models.BinaryField(
+        verbose_name = "Профиль (pstats)",
+    )
+    size = models.PositiveIntegerField(
+        default = 0,
+        verbose_name = "Размер (байт)",
+    )
+
+    class Meta:
+        verbose_name = "Профиль запроса"
+        verbose_name_plural = "Профили запросов"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.total_ms:.0f} мс)"
+
+    @classmethod
+    def capture(cls, request, response, profiler, query_stats, elapsed):
+        """Сохраняет профиль запроса и удаляет старые профили сверх лимитов"""
+        profiler.create_stats()
+        data = marshal.dumps(profiler.stats)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+
+        match = request.resolver_match
+        user = getattr(request, 'user', None)
+        profile = cls.objects.create(
+            user = user if user is not None and user.is_authenticated else None,
+            method = request.method,
+            path = request.get_full_path()[:500],
+            view_name = match.view_name if match else '',
+            status = response.status_code,
+            total_ms = round(elapsed * 1000, 2),
+            queries = query_stats.queries,
+            db_ms = round(query_stats.db_seconds * 1000, 2),
+            query_log = query_stats.log,
+            summary = summary.getvalue(),
+            stats = data,
+            size = len(data) + len(summary.getvalue()),
+        )
+        cls.trim()
+        return profile
+
+    @classmethod
+    def trim(cls, max_bytes=None, max_count=None):
+        """
+        Удаляет самые старые профили сверх max_bytes суммарного размера и
+        max_count штук. Самый новый профиль сохраняется при любом размере.
+        """
+        if max_bytes is None:
+            max_bytes = settings.PROFILE_STORE_MAX_MB * 1024 * 1024
+        if max_count is None:
+            max_count = settings.PROFILE_STORE_MAX_COUNT
+        kept, total = 0, 0
+        expired = []
+        for pk, size in cls.objects.order_by('-created_at', '-pk').values_list('pk', 'size'):
+            total += size
+            kept += 1
+            if kept > 1 and (kept > max_count or total > max_bytes):
+                expired.append(pk)
+        if expired:
+            cls.objects.filter(pk__in=expired).delete()
+        return len(expired)
+
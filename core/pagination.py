@@ -0,0 +1,109 @@
+"""
+Keyset-пагинация (seek) для таблиц рейтинга.
+
+Вместо OFFSET страница задаётся курсором — значением колонки сортировки
+и id граничной строки. Запрос страницы N стоит столько же, сколько первой,
+а курсоры не «съезжают» при вставке строк перед текущей позицией.
+"""
+from django.core import signing
+from django.db.models import F, FloatField, IntegerField, Q, Value
+from django.db.models.functions import Coalesce
+
+
+PAGE_SIZE = 20
+
+CURSOR_SALT = 'core.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class SortField:
+    """
+    Колонка сортировки. tiebreak — второй ключ порядка вместо pk: колонка
+    той же таблицы, что и field (чтобы сортировка шла по её индексу),
+    со значением, равным pk строки queryset.
+    """
+
+    def __init__(self, label, field, default_direction='desc', null_value=None, tiebreak='pk'):
+        self.label = label
+        self.field = field
+        self.default_direction = default_direction
+        self.null_value = null_value
+        self.tiebreak = tiebreak
+
+    def expression(self):
+        # NULL ломает сравнение кортежей, поэтому заменяем его значением вне диапазона.
+        # Тип задаётся явно: для PositiveSmallIntegerField Django считает
+        # сравнение с отрицательным значением заведомо истинным/ложным.
+        if self.null_value is None:
+            return F(self.field)
+        output_field = FloatField() if isinstance(self.null_value, float) else IntegerField()
+        return Coalesce(F(self.field), Value(self.null_value), output_field=output_field)
+
+
+class KeysetPaginator:
+    """
+    Страница queryset, отсортированного по одному из sort_fields.
+    Для однозначного порядка вторым ключом идёт pk (или SortField.tiebreak).
+    """
+
+    def __init__(self, queryset, sort_fields, sort, direction=None, page_size=PAGE_SIZE):
+        if sort not in sort_fields:
+            raise InvalidCursor(f"Неизвестная колонка сортировки: {sort}")
+        self.sort = sort
+        self.sort_field = sort_fields[sort]
+        self.direction = direction if direction in ('asc', 'desc') else self.sort_field.default_direction
+        self.page_size = page_size
+        self.queryset = queryset.annotate(sort_key=self.sort_field.expression())
+
+    def encode(self, obj):
+        return signing.dumps(
+            [self.sort, self.direction, obj.sort_key, obj.pk], salt=CURSOR_SALT, compress=True,
+        )
+
+    def decode(self, cursor):
+        try:
+            sort, direction, value, pk = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, ValueError, TypeError) as e:
+            raise InvalidCursor("Некорректный курсор") from e
+        if sort != self.sort or direction != self.direction:
+            raise InvalidCursor("Курсор относится к другой сортировке")
+        return value, pk
+
+    def _ordered(self, forward):
+        descending = (self.direction == 'desc') == forward
+        prefix = '-' if descending else ''
+        return self.queryset.order_by(f'{prefix}sort_key', f'{prefix}{self.sort_field.tiebreak}'), descending
+
+    def page(self, after=None, before=None):
+        """
+        Строки после курсора after (или перед курсором before) и курсоры
+        соседних страниц: {'object_list', 'next_cursor', 'previous_cursor'}.
+        """
+        forward = before is None
+        queryset, descending = self._ordered(forward)
+        cursor = after if forward else before
+        if cursor:
+            value, pk = self.decode(cursor)
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'sort_key__{op}': value}) | Q(sort_key=value, **{f'{self.sort_field.tiebreak}__{op}': pk})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if not forward:
+            rows.reverse()
+
+        if forward:
+            has_next, has_previous = has_more, bool(cursor)
+        else:
+            has_next, has_previous = True, has_more
+        return {
+            'object_list': rows,
+            'next_cursor': self.encode(rows[-1]) if rows and has_next else None,
+            'previous_cursor': self.encode(rows[0]) if rows and has_previous else None,
+        }
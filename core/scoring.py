@@ -0,0 +1,312 @@
+"""
+Пакетный расчёт инвестиционного индекса.
+
+Вместо вызова Locality.calculate_inv_index() для каждого города данные
+по всему queryset загружаются несколькими запросами, а компоненты индекса
+считаются векторно в pandas. Формулы и порядок операций повторяют методы
+моделей, поэтому результат совпадает с поштучным расчётом.
+
+Результаты сохраняются в таблицу CityScore: полностью после загрузки
+данных и по отдельным регионам при изменении записей (см. core/signals.py).
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Q
+
+from .models import CityScore, DataVersion, EconomicData, Locality, RegionStats
+
+
+logger = logging.getLogger(__name__)
+
+INFRA_WEIGHTS = {'schools': 0.4, 'gas_stations': 0.3, 'bus_stops': 0.3}
+
+SCORE_COLUMNS = ['eco_score', 'demo_score', 'infra_score', 'inv_index']
+
+BASELINE_COLUMNS = ['ndfl_median', 'schools_per_1k', 'gas_stations_per_1k', 'bus_stops_per_1k']
+
+
+def regional_baselines(regions):
+    """
+    Региональные базы сравнения из RegionStats.
+    Возвращает DataFrame с индексом по региону и колонками BASELINE_COLUMNS.
+    """
+    stats = RegionStats.for_regions(regions)
+    frame = pd.DataFrame.from_records(
+        [[item.region] + [getattr(item, col) for col in BASELINE_COLUMNS] for item in stats.values()],
+        columns = ['region'] + BASELINE_COLUMNS,
+    ).set_index('region')
+    return frame.astype(float)
+
+
+def _latest_economics(locality_ids):
+    """Последний год экономических данных для каждого города"""
+    rows = EconomicData.objects.filter(
+        locality_id__in = locality_ids,
+    ).order_by('locality_id', '-year').values_list(
+        'locality_id', 'year', 'ndfl_total', 'unemployment_rate'
+    )
+    frame = pd.DataFrame.from_records(
+        list(rows), columns=['id', 'year', 'ndfl_total', 'unemployment_rate']
+    )
+    return frame.drop_duplicates(subset='id', keep='first').set_index('id')
+
+
+def _empty_frame():
+    frame = pd.DataFrame(columns=['region', 'population'] + SCORE_COLUMNS)
+    frame.index.name = 'id'
+    return frame
+
+
+def score_frame(queryset=None):
+    """
+    Компоненты и инвестиционный индекс для всех городов queryset.
+
+    Региональные базы всегда считаются по активным городам региона,
+    а не по отфильтрованному queryset, как и в Locality.calculate_inv_index().
+    Города без экономических данных в результат не попадают. Без данных
+    о безработице demo_score равен 0, без инфраструктуры или населения
+    infra_score равен 0, как в поштучном расчёте.
+    """
+    if queryset is None:
+        queryset = Locality.objects.filter(is_active=True)
+
+    localities = pd.DataFrame.from_records(
+        list(queryset.order_by().values_list(
+            'id', 'region', 'population',
+            'infrastructure__id', 'infrastructure__schools',
+            'infrastructure__gas_stations', 'infrastructure__bus_stops',
+        )),
+        columns=['id', 'region', 'population', 'infra_id',
+                 'schools', 'gas_stations', 'bus_stops'],
+    ).set_index('id')
+    if localities.empty:
+        return _empty_frame()
+
+    frame = localities.join(_latest_economics(localities.index.tolist()), how='inner')
+    if frame.empty:
+        return _empty_frame()
+    frame = frame.join(regional_baselines(frame['region']), on='region')
+
+    population = frame['population'].to_numpy(dtype=np.int64)
+    ndfl_total = frame['ndfl_total'].to_numpy(dtype=np.int64)
+    unemployment = frame['unemployment_rate'].to_numpy(dtype=float)
+    ndfl_median = frame['ndfl_median'].to_numpy(dtype=float)
+    has_population = population > 0
+
+    # Экономика: НДФЛ на душу относительно региональной базы, не выше 1.
+    # Без населения НДФЛ на душу равен 0, как в EconomicData.ndfl_per_capita;
+    # без базы (в регионе нет населения) eco_score равен 0
+    per_capita = np.divide(ndfl_total, population, out=np.zeros(len(frame)), where=has_population)
+    has_baseline = np.nan_to_num(ndfl_median) > 0
+    eco_score = np.minimum(np.divide(per_capita, ndfl_median, out=np.zeros(len(frame)), where=has_baseline), 1)
+    # Без данных о безработице демографическая составляющая равна 0
+    demo_score = np.where(np.isnan(unemployment), 0.0, 1 - unemployment / 100)
+
+    # Инфраструктура: обеспеченность на 1000 жителей относительно региона
+    pop_k = population / 1000
+    has_infra = frame['infra_id'].notna().to_numpy() & has_population
+    infra_score = np.zeros(len(frame))
+    for key, weight in INFRA_WEIGHTS.items():
+        counts = frame[key].fillna(0).to_numpy(dtype=float)
+        per_1k = np.divide(counts, pop_k, out=np.zeros(len(frame)), where=has_infra)
+        infra_score = infra_score + per_1k / frame[f'{key}_per_1k'].to_numpy() * weight
+    infra_score = np.where(has_infra, np.minimum(infra_score, 1.0), 0.0)
+
+    frame['eco_score'] = eco_score
+    frame['demo_score'] = demo_score
+    frame['infra_score'] = infra_score
+    frame['inv_index'] = 0.4 * eco_score + 0.3 * demo_score + 0.3 * infra_score
+    return frame
+
+
+def rebuild_scores(regions=None):
+    """
+    Пересчитывает RegionStats и CityScore для указанных регионов
+    (None — весь каталог). Общий рейтинг после этого переупорядочивается
+    без пересчёта индексов, и только в диапазоне мест, который могли
+    задеть эти регионы. Возвращает новую версию данных.
+    """
+    localities = Locality.objects.filter(is_active=True)
+    stale = CityScore.objects.all()
+    stale_stats = RegionStats.objects.all()
+    if regions is not None:
+        regions = list(set(regions))
+        localities = localities.filter(region__in=regions)
+        stale = stale.filter(region__in=regions)
+        stale_stats = stale_stats.filter(region__in=regions)
+
+    with transaction.atomic():
+        version = DataVersion.bump()
+        # Статистика регионов пересчитывается до индексов, которые на неё опираются
+        active_regions = set(localities.order_by().values_list('region', flat=True).distinct())
+        stale_stats.exclude(region__in=active_regions).delete()
+        RegionStats.refresh(active_regions, version)
+
+        frame = score_frame(localities)
+        unscored = frame['inv_index'].isna()
+        if unscored.any():
+            logger.warning(f"Индекс не определён для {unscored.sum()} городов, они не попадут в рейтинг")
+            frame = frame[~unscored]
+        frame = frame.sort_values(['inv_index', 'id'], ascending=[False, True])
+        frame['region_rank'] = frame.groupby('region').cumcount() + 1
+
+        # Прежние места пересчитываемых городов ограничивают сдвиг рейтинга
+        previous = list(stale.values_list('rank', flat=True)) if regions is not None else None
+        stale.exclude(locality_id__in=frame.index.tolist()).delete()
+        CityScore.objects.bulk_create(
+            [
+                CityScore(
+                    locality_id = locality_id,
+                    region = row.region,
+                    eco_score = row.eco_score,
+                    demo_score = row.demo_score,
+                    infra_score = row.infra_score,
+                    inv_index = row.inv_index,
+                    region_rank = row.region_rank,
+                    data_version = version,
+                )
+                for locality_id, row in zip(frame.index, frame.itertuples())
+            ],
+            update_conflicts = True,
+            unique_fields = ['locality'],
+            update_fields = ['region', 'eco_score', 'demo_score', 'infra_score',
+                             'inv_index', 'region_rank', 'data_version', 'updated_at'],
+            batch_size = 500,
+        )
+        span = _rank_span(frame, previous)
+        if span is not None:
+            _rerank(version, *span)
+    return version
+
+
+def _position(locality_id, inv_index):
+    """Место города в общем рейтинге по сохранённым индексам"""
+    ahead = CityScore.objects.filter(Q(inv_index__gt=inv_index) | Q(inv_index=inv_index, locality_id__lt=locality_id))
+    return ahead.count() + 1
+
+
+def _rank_span(frame, previous):
+    """
+    Диапазон мест (first, last), которые могли сдвинуться после пересчёта
+    городов frame (отсортирован по рейтингу); previous — прежние места этих
+    регионов, None при пересчёте всего каталога. Остальные города сохраняют
+    взаимный порядок, поэтому места вне диапазона между лучшим и худшим
+    прежним и новым местом не меняются, если число городов перед ним и
+    после него прежнее. Иначе (город удалён или добавлен) диапазон
+    расширяется до начала или конца рейтинга: last равен None.
+    Возвращает None, если переупорядочивать нечего.
+    """
+    if previous is None:
+        return 1, None
+    positions = [rank for rank in previous if rank]
+    if not frame.empty:
+        positions.append(_position(frame.index[0], frame['inv_index'].iloc[0]))
+        positions.append(_position(frame.index[-1], frame['inv_index'].iloc[-1]))
+    if not positions:
+        return None
+    first, last = min(positions), max(positions)
+    # Места, освободившиеся без записи в previous (каскадное удаление города)
+    if CityScore.objects.filter(rank__gte=1, rank__lt=first).count() != first - 1:
+        first = 1
+    if CityScore.objects.filter(rank__gt=last).count() != CityScore.objects.count() - last:
+        last = None
+    return first, last
+
+
+def _rerank(version, first=1, last=None):
+    """
+    Проставляет общее место в рейтинге на местах first..last (None — до
+    конца), обновляя только изменившиеся строки
+    """
+    changed = []
+    rows = CityScore.objects.order_by('-inv_index', 'locality_id').only('pk', 'rank', 'data_version')
+    for position, score in enumerate(rows[first - 1:last], start=first):
+        if score.rank != position:
+            score.rank = position
+            score.data_version = version
+            changed.append(score)
+    CityScore.objects.bulk_update(changed, ['rank', 'data_version'], batch_size=500)
+
+
+_pending = threading.local()
+
+
+class _Batch:
+    """Регионы, помеченные для пересчёта в одной транзакции"""
+
+    def __init__(self):
+        self.regions = set()
+        self.done = False
+
+
+def _state():
+    if not hasattr(_pending, 'batch'):
+        _pending.batch = None
+        _pending.suspended = 0
+    return _pending
+
+
+def refresh_regions_on_commit(regions):
+    """
+    Помечает регионы для пересчёта после фиксации транзакции.
+    Несколько изменений в одной транзакции дают один пересчёт на регион.
+
+    Обработчик on_commit регистрируется при каждом вызове: при откате
+    транзакции Django отбрасывает её обработчики, и пакет, для которого
+    обработчик зарегистрирован один раз, остался бы неотправленным.
+    Повторные обработчики пакета ничего не делают. Регионы из откаченной
+    транзакции попадают в следующий пакет; их лишний пересчёт безвреден.
+    """
+    state = _state()
+    if state.suspended:
+        return
+    regions = {r for r in regions if r}
+    if not regions:
+        return
+    # Старая статистика сбрасывается сразу, чтобы чтения до фиксации её не видели
+    RegionStats.invalidate(regions)
+    if state.batch is None or state.batch.done:
+        state.batch = _Batch()
+    state.batch.regions |= regions
+    transaction.on_commit(partial(_flush_batch, state.batch))
+
+
+def bump_version():
+    """
+    Новая версия данных без пересчёта индексов: для изменений, которые
+    видны на страницах рейтинга, но не влияют на индекс (название города)
+    """
+    if _state().suspended:
+        return
+    DataVersion.bump()
+
+
+def _flush_batch(batch):
+    if batch.done:
+        return
+    batch.done = True
+    state = _state()
+    if state.batch is batch:
+        state.batch = None
+    rebuild_scores(batch.regions)
+
+
+def score_refresh_is_suspended():
+    return bool(_state().suspended)
+
+
+@contextmanager
+def score_refresh_suspended():
+    """Отключает поштучный пересчёт, например на время массовой загрузки"""
+    state = _state()
+    state.suspended += 1
+    try:
+        yield
+    finally:
+        state.suspended -= 1
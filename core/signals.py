@@ -0,0 +1,69 @@
+"""
+Инкрементальное обновление CityScore.
+
+Любое изменение экономических данных, инфраструктуры или населения/статуса
+города через админку или ORM помечает его регион для пересчёта. Пересчёт
+выполняется один раз на регион после фиксации транзакции.
+
+Версия данных (DataVersion.current) запоминается только на время
+одного HTTP-запроса.
+"""
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import DataVersion, EconomicData, InfrastructureData, Locality
+from .scoring import bump_version, refresh_regions_on_commit, score_refresh_is_suspended
+
+
+# Поля города, от которых зависит индекс
+SCORED_FIELDS = ('region', 'population', 'is_active')
+
+
+def _locality_region(instance):
+    return Locality.objects.filter(pk=instance.locality_id).values_list('region', flat=True).first()
+
+
+@receiver(post_save, sender=EconomicData)
+@receiver(post_delete, sender=EconomicData)
+@receiver(post_save, sender=InfrastructureData)
+@receiver(post_delete, sender=InfrastructureData)
+def related_data_changed(sender, instance, **kwargs):
+    # Регион читается из БД, поэтому при массовых изменениях запрос не делается
+    if score_refresh_is_suspended():
+        return
+    refresh_regions_on_commit([_locality_region(instance)])
+
+
+@receiver(pre_save, sender=Locality)
+def remember_scored_fields(sender, instance, **kwargs):
+    instance._scored_before = None
+    if instance.pk and not kwargs.get('raw'):
+        instance._scored_before = Locality.objects.filter(pk=instance.pk).values(*SCORED_FIELDS).first()
+
+
+@receiver(post_save, sender=Locality)
+def locality_changed(sender, instance, created, **kwargs):
+    before = getattr(instance, '_scored_before', None)
+    if not created and before and all(before[f] == getattr(instance, f) for f in SCORED_FIELDS):
+        bump_version()
+        return
+    regions = [instance.region]
+    if before:
+        regions.append(before['region'])
+    refresh_regions_on_commit(regions)
+
+
+@receiver(post_delete, sender=Locality)
+def locality_deleted(sender, instance, **kwargs):
+    refresh_regions_on_commit([instance.region])
+
+
+@receiver(request_started)
+def remember_data_version(sender, **kwargs):
+    DataVersion.remember_per_request(True)
+
+
+@receiver(request_finished)
+def forget_data_version(sender, **kwargs):
+    DataVersion.remember_per_request(False)
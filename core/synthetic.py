@@ -0,0 +1,147 @@
+"""
+Синтетический каталог городов для нагрузочных проверок и бенчмарков.
+
+Распределения приближены к реальным данным: население логнормальное в
+пределах диапазона реального каталога (POPULATION_RANGE, как фильтр в
+fetch_data.py), регионы неравны по числу
+городов, уровень доходов и безработицы задаётся на уровне региона с
+разбросом по городам, инфраструктура пропорциональна населению.
+Результат детерминирован при одинаковом seed.
+
+Коды ОКТМО синтетических городов начинаются с SYNTHETIC_PREFIX (такого
+кода субъекта нет), поэтому их можно удалить, не затрагивая реальные.
+"""
+import numpy as np
+from django.db import transaction
+
+from .models import EconomicData, InfrastructureData, Locality
+from .scoring import rebuild_scores, score_refresh_suspended
+
+
+SYNTHETIC_PREFIX = '00'
+
+BATCH_SIZE = 5000
+
+MAX_SMALLINT = 32767
+
+# Население городов каталога: fetch_data.py отбирает города в этом диапазоне,
+# медиана и разброс логарифма — по данным population.xlsx внутри него
+POPULATION_RANGE = (12000, 100000)
+POPULATION_MEDIAN = 24000
+POPULATION_SIGMA = 0.6
+
+# Базовые значения на 1000 жителей, как INFRA_DEFAULTS в models.py
+INFRA_RATES = {'schools': 0.4, 'gas_stations': 0.1, 'bus_stops': 2.0}
+
+
+def synthetic_cities():
+    return Locality.objects.filter(oktmo_code__startswith=SYNTHETIC_PREFIX)
+
+
+def clear(rebuild=True):
+    """
+    Удаляет синтетические города со всеми данными пачками по BATCH_SIZE.
+    При rebuild пересчитывает рейтинг (и версию данных). Возвращает число
+    удалённых городов.
+    """
+    deleted = 0
+    with score_refresh_suspended(), transaction.atomic():
+        while True:
+            ids = list(synthetic_cities().values_list('pk', flat=True)[:BATCH_SIZE])
+            if not ids:
+                break
+            Locality.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
+    if rebuild:
+        rebuild_scores()
+    return deleted
+
+
+def sample_population(rng, size):
+    """Логнормальное население; значения вне POPULATION_RANGE разыгрываются заново"""
+    low, high = POPULATION_RANGE
+    population = rng.lognormal(np.log(POPULATION_MEDIAN), POPULATION_SIGMA, size)
+    outside = (population < low) | (population > high)
+    while outside.any():
+        population[outside] = rng.lognormal(np.log(POPULATION_MEDIAN), POPULATION_SIGMA, outside.sum())
+        outside = (population < low) | (population > high)
+    return population.astype(int)
+
+
+def generate(cities, regions=85, years=(2021, 2022, 2023), seed=0, start=0):
+    """
+    Создаёт cities городов в regions регионах с экономическими данными за
+    years и инфраструктурой. Номера городов начинаются со start.
+    Возвращает словарь с числом созданных строк по моделям.
+    """
+    rng = np.random.default_rng(seed)
+    years = sorted(years)
+
+    # Регионы: размер по закону Ципфа, уровень доходов и безработицы
+    weights = 1 / np.arange(1, regions + 1) ** 0.8
+    weights = rng.permutation(weights / weights.sum())
+    region_names = np.array([f"Синтетический регион {n + 1:02d}" for n in range(regions)])
+    region_income = rng.lognormal(0, 0.35, regions)
+    region_unemployment = rng.uniform(2, 12, regions)
+    region_infra = rng.lognormal(0, 0.3, (regions, len(INFRA_RATES)))
+
+    region = rng.choice(regions, size=cities, p=weights)
+    population = sample_population(rng, cities)
+    per_capita = 25000 * region_income[region] * rng.lognormal(0, 0.25, cities)
+    unemployment = region_unemployment[region] + rng.normal(0, 1, cities)
+    active = rng.random(cities) > 0.01
+    has_infra = rng.random(cities) > 0.03
+
+    codes = [f"{SYNTHETIC_PREFIX}{n:09d}" for n in range(start, start + cities)]
+    with score_refresh_suspended(), transaction.atomic():
+        Locality.objects.bulk_create(
+            [
+                Locality(
+                    oktmo_code = code,
+                    city = f"Город {start + n}",
+                    region = region_names[region[n]],
+                    population = int(population[n]),
+                    is_active = bool(active[n]),
+                )
+                for n, code in enumerate(codes)
+            ],
+            batch_size = BATCH_SIZE,
+        )
+        ids = dict(synthetic_cities().values_list('oktmo_code', 'id'))
+        locality_ids = [ids[code] for code in codes]
+
+        economics = []
+        for offset, year in enumerate(years):
+            growth = 1.08 ** (offset - len(years) + 1)
+            rates = np.clip(unemployment + rng.normal(0, 0.3, cities), 0.5, 30).round(1)
+            missing = rng.random(cities) < 0.02
+            for n, locality_id in enumerate(locality_ids):
+                economics.append(EconomicData(
+                    locality_id = locality_id,
+                    year = year,
+                    ndfl_total = int(population[n] * per_capita[n] * growth),
+                    unemployment_rate = None if missing[n] else float(rates[n]),
+                ))
+        EconomicData.objects.bulk_create(economics, batch_size=BATCH_SIZE)
+
+        counts = {
+            name: np.clip(
+                rng.poisson(population / 1000 * rate * region_infra[region, column]), 0, MAX_SMALLINT,
+            )
+            for column, (name, rate) in enumerate(INFRA_RATES.items())
+        }
+        infrastructure = [
+            InfrastructureData(
+                locality_id = locality_id,
+                **{name: int(values[n]) for name, values in counts.items()},
+            )
+            for n, locality_id in enumerate(locality_ids)
+            if has_infra[n]
+        ]
+        InfrastructureData.objects.bulk_create(infrastructure, batch_size=BATCH_SIZE)
+
+    return {
+        'locality': cities,
+        'economicdata': len(economics),
+        'infrastructuredata': len(infrastructure),
+    }
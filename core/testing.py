@@ -0,0 +1,64 @@
+"""
+Проверка бюджета запросов к БД в тестах.
+
+В отличие от assertNumQueries, бюджет задаёт верхнюю границу, а не точное
+число, и отдельно запрещает повторяющиеся запросы (N+1). При нарушении
+сообщение содержит все выполненные запросы и их повторы.
+
+    class HomeTests(QueryBudgetMixin, TestCase):
+        def test_home(self):
+            with self.assertQueryBudget(4):
+                self.client.get('/')
+"""
+from contextlib import contextmanager
+
+from django.db import connections
+
+from .middleware import QueryStats
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Число или повторы запросов превысили бюджет"""
+
+
+def _report(stats, max_queries, max_duplicates):
+    lines = [
+        f"Бюджет запросов: не больше {max_queries}, повторов не больше {max_duplicates}; "
+        f"выполнено {stats.queries}, повторов {stats.as_dict()['duplicate_queries']}",
+    ]
+    lines += [f"  {count}× {sql}" for sql, count in stats.signatures.most_common()]
+    return '\n'.join(lines)
+
+
+@contextmanager
+def query_budget(max_queries, max_duplicates=0, using=None):
+    """
+    Блок должен выполнить не больше max_queries запросов, из них не больше
+    max_duplicates повторов одной сигнатуры. using — алиас БД (по умолчанию
+    учитываются все соединения). Возвращает QueryStats.
+    """
+    stats = QueryStats()
+    if using is None:
+        with stats.capture():
+            yield stats
+    else:
+        with connections[using].execute_wrapper(stats):
+            yield stats
+    duplicates = stats.as_dict()['duplicate_queries']
+    if stats.queries > max_queries or duplicates > max_duplicates:
+        raise QueryBudgetExceeded(_report(stats, max_queries, max_duplicates))
+
+
+class QueryBudgetMixin:
+    """assertQueryBudget для TestCase"""
+
+    def assertQueryBudget(self, max_queries, max_duplicates=0, using=None):
+        return query_budget(max_queries, max_duplicates, using)
+
+    def assertResponseWithinBudget(self, max_queries, method, path, max_duplicates=0, **kwargs):
+        """Запрос тестовым клиентом в пределах бюджета; тело потоковых ответов читается целиком"""
+        with query_budget(max_queries, max_duplicates) as stats:
+            response = getattr(self.client, method)(path, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, stats
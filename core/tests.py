@@ -1,3 +1,1011 @@
-from django.test import TestCase
+import gzip
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import warnings
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import benchmark, exports, scoring, synthetic
+from .ingest import client, osm_extract, overpass, sources
+from .ingest.checkpoint import RunCheckpoint
+from .ingest.fake_services import FAKE_REGIONS, make_server
+from .ingest.http_cache import HttpCache
+from .ingest.loader import upsert_cities
+from .ingest.regions import REGION_ALIAS, RegionResolver, extract_region_from_osm
+from .ingest.scheduler import LIMITERS, HostLimiter
+from .management import fetch_data
+from .models import (
+    CityScore, DataVersion, EconomicData, InfrastructureData, IngestionRun, Locality, RegionStats, RequestProfile,
+)
+from .scoring import rebuild_scores
+from .testing import QueryBudgetExceeded, QueryBudgetMixin
+
+
+REGIONS = ['Тестовая область', 'Республика Тестовая', 'Тестовый край']
+
+
+def cold_cache():
+    """Холодный кэш страниц и непрочитанная версия данных"""
+    cache.clear()
+    DataVersion.forget()
+
+
+def make_cities(count, start=0):
+    """count городов по REGIONS с экономикой и инфраструктурой, без сигналов"""
+    localities = Locality.objects.bulk_create([
+        Locality(
+            city = f"Город {n}",
+            region = REGIONS[n % len(REGIONS)],
+            population = 10000 + n * 137,
+            oktmo_code = f"45{n:09d}",
+        )
+        for n in range(start, start + count)
+    ])
+    EconomicData.objects.bulk_create([
+        EconomicData(
+            locality = locality,
+            year = year,
+            ndfl_total = locality.population * (300 + year % 10),
+            unemployment_rate = 2 + locality.pk % 5,
+        )
+        for locality in localities
+        for year in (2022, 2023)
+    ])
+    InfrastructureData.objects.bulk_create([
+        InfrastructureData(
+            locality = locality,
+            schools = 3 + locality.pk % 4,
+            gas_stations = 1 + locality.pk % 3,
+            bus_stops = 10 + locality.pk % 7,
+        )
+        for locality in localities
+    ])
+    rebuild_scores()
+    return localities
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Бюджеты запросов страниц и API при холодном кэше. Число запросов не
+    должно зависеть от числа городов: повтор одной сигнатуры — это N+1.
+    """
+
+    def setUp(self):
+        cold_cache()
+        self.cities = make_cities(12)
+
+    def assertFlat(self, method, path, **kwargs):
+        """Число запросов одинаково при 12 и 40 городах"""
+        cold_cache()
+        _, before = self.assertResponseWithinBudget(100, method, path, **kwargs)
+        make_cities(28, start=100)
+        cold_cache()
+        _, after = self.assertResponseWithinBudget(100, method, path, **kwargs)
+        self.assertEqual(before.queries, after.queries, f"{path}: число запросов растёт с числом городов")
+
+    def test_home(self):
+        response, _ = self.assertResponseWithinBudget(3, 'get', reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFlat('get', reverse('home'))
+
+    def test_n_plus_one_detected(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with self.assertQueryBudget(100):
+                for city in Locality.objects.all():
+                    city.economics.first()
+
+    def test_home_cached(self):
+        """Из кэша: остаётся только чтение версии данных"""
+        self.client.get(reverse('home'))
+        self.assertResponseWithinBudget(1, 'get', reverse('home'))
+
+    def test_version_bumped_elsewhere(self):
+        """Версию увеличил другой процесс: страницы пересчитываются со следующего запроса"""
+        self.client.get(reverse('home'))
+        leader = CityScore.objects.get(rank=1).locality_id
+        Locality.objects.filter(pk=leader).update(city="Переименованный")
+        DataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        self.assertContains(self.client.get(reverse('home')), "Переименованный")
+
+    def test_version_read_outside_request(self):
+        DataVersion.current()
+        DataVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        version = DataVersion.objects.get(pk=1).version
+        with self.assertNumQueries(1):
+            self.assertEqual(DataVersion.current(), version)
+
+    def test_main(self):
+        response, _ = self.assertResponseWithinBudget(3, 'get', reverse('main'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFlat('get', reverse('main'))
+
+    def test_main_filtered(self):
+        response, _ = self.assertResponseWithinBudget(3, 'get', reverse('main'), data={
+            'region': REGIONS[0], 'population_min': 10500, 'sort': 'population',
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_compare(self):
+        ids = [city.pk for city in self.cities[:3]]
+        response, _ = self.assertResponseWithinBudget(6, 'post', reverse('compare'), data={'cities': ids})
+        self.assertEqual(response.status_code, 200)
+
+    def test_compare_figure_embedded_safely(self):
+        Locality.objects.filter(pk=self.cities[0].pk).update(city="</script><b>&")
+        ids = [city.pk for city in self.cities[:2]]
+        response = self.client.post(reverse('compare'), {'cities': ids})
+        self.assertNotContains(response, "</script><b>")
+        content = response.content.decode()
+        start = content.index('<script id="compare-figure" type="application/json">')
+        script = content[content.index('>', start) + 1:content.index('</script>', start)]
+        names = [trace['name'] for trace in json.loads(script)['data']]
+        self.assertIn("</script><b>&", names)
+
+    def test_export_csv(self):
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        response, _ = self.assertResponseWithinBudget(5, 'get', reverse('export_csv'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_ranking(self):
+        response, _ = self.assertResponseWithinBudget(3, 'get', reverse('api_ranking'))
+        self.assertEqual(len(response.json()['results']), 12)
+        self.assertFlat('get', reverse('api_ranking'), data={'limit': 100})
+
+    def test_api_city(self):
+        response, _ = self.assertResponseWithinBudget(3, 'get', reverse('api_city', args=[self.cities[0].pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_compare(self):
+        ids = [city.pk for city in self.cities[:3]]
+        response, _ = self.assertResponseWithinBudget(4, 'get', reverse('api_compare'), data={'cities': ids})
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_compare_etag_per_user(self):
+        ids = [city.pk for city in self.cities[:5]]
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        response = self.client.get(reverse('api_compare'), {'cities': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response.headers['Vary'])
+
+        self.client.logout()
+        guest = self.client.get(reverse('api_compare'), {'cities': ids}, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(guest.status_code, 400)
+
+
+class ColumnarExportTests(TestCase):
+    """Типизированная выгрузка рейтинга в Parquet и Arrow IPC"""
+
+    def setUp(self):
+        cold_cache()
+        self.cities = make_cities(12)
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+
+    def export(self, fmt, **params):
+        response = self.client.get(reverse('export_columnar', args=[fmt]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], exports.FORMATS[fmt][0])
+        buffer = pa.BufferReader(response.content)
+        return pq.read_table(buffer) if fmt == 'parquet' else pa.ipc.open_file(buffer).read_all()
+
+    def test_schema(self):
+        for fmt in exports.FORMATS:
+            with self.subTest(fmt=fmt):
+                table = self.export(fmt)
+                self.assertEqual(table.schema, exports.SCHEMA)
+                self.assertTrue(pa.types.is_dictionary(table.schema.field('region').type))
+                self.assertEqual(sorted(table.column('region').combine_chunks().dictionary.to_pylist()), sorted(REGIONS))
+                self.assertEqual(table.column('rank').to_pylist(), list(range(1, 13)))
+                self.assertEqual(table.column('population').type, pa.int32())
+                self.assertEqual(table.column('ndfl_total').type, pa.int64())
+
+    def test_filters_passed_through(self):
+        table = self.export('arrow', region=REGIONS[0], population_min=10500)
+        expected = Locality.objects.filter(region=REGIONS[0], population__gte=10500)
+        self.assertEqual(sorted(table.column('oktmo_code').to_pylist()),
+                         sorted(expected.values_list('oktmo_code', flat=True)))
+        self.assertEqual(set(table.column('region').to_pylist()), {REGIONS[0]})
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('export_columnar', args=['xlsx']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('export_columnar', args=['parquet']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_cached_per_data_version(self):
+        leader = CityScore.objects.get(rank=1).locality_id
+        self.export('parquet')
+        Locality.objects.filter(pk=leader).update(city="Переименованный")
+        # Без смены версии отдаётся файл из кэша
+        with self.assertNumQueries(3):
+            self.assertNotIn("Переименованный", self.export('parquet').column('city').to_pylist())
+        # Другие фильтры и формат — другой ключ
+        self.assertIn("Переименованный", self.export('arrow').column('city').to_pylist())
+        DataVersion.bump()
+        self.assertIn("Переименованный", self.export('parquet').column('city').to_pylist())
+
+
+class MainPaginationTests(TestCase):
+
+    def pages(self, **params):
+        cold_cache()
+        ids = []
+        while True:
+            response = self.client.get(reverse('main'), params)
+            ids += [city.pk for city in response.context['cities']]
+            if not response.context['next_cursor']:
+                return ids
+            params['after'] = response.context['next_cursor']
+
+    def test_pages_follow_city_score(self):
+        make_cities(45)
+        # Равные индексы: порядок внутри них задаёт locality_id
+        CityScore.objects.filter(locality_id__lte=Locality.objects.order_by('pk')[5].pk).update(inv_index=1.0)
+        expected = list(CityScore.objects.order_by('-inv_index', '-locality_id').values_list('locality_id', flat=True))
+
+        self.assertEqual(self.pages(), expected)
+        self.assertEqual(self.pages(dir='asc'), expected[::-1])
+
+    def test_city_without_region_stats_listed(self):
+        make_cities(6)
+        RegionStats.objects.filter(region=REGIONS[0]).delete()
+
+        self.assertEqual(len(self.pages()), 6)
+
+    def test_selection_carried_across_pages(self):
+        make_cities(45)
+        cold_cache()
+        first = self.client.get(reverse('main'), {'sort': 'population'})
+        chosen = [city.pk for city in first.context['cities'][:2]]
+
+        # «Далее» отправляет форму сравнения: отмеченные города уходят в запрос
+        second = self.client.get(reverse('main'), {
+            'sort': 'population', 'cities': chosen, 'after': first.context['next_cursor'],
+        })
+        self.assertEqual(second.context['selected'], chosen)
+        self.assertEqual(second.context['selected_elsewhere'], 2)
+        for pk in chosen:
+            self.assertContains(second, f'<input type="hidden" name="cities" value="{pk}">', count=2)
+        self.assertContains(second, '<input type="hidden" name="sort" value="population">')
+
+        # На странице, где город отмечен, он остаётся отмеченным, а не скрытым полем
+        back = self.client.get(reverse('main'), {'sort': 'population', 'cities': chosen})
+        self.assertContains(back, f'value="{chosen[0]}" id="city_{chosen[0]}" checked')
+        self.assertEqual(back.context['selected_elsewhere'], 0)
+
+        other = second.context['cities'][0].pk
+        response = self.client.get(reverse('compare'), {'sort': 'population', 'cities': chosen + [other]})
+        self.assertCountEqual([row['id'] for row in response.context['rows']], chosen + [other])
+
+    def test_invalid_selection_keeps_query(self):
+        make_cities(6)
+        pk = Locality.objects.first().pk
+        response = self.client.get(reverse('compare'), {'cities': [pk], 'sort': 'population'})
+        self.assertRedirects(response, f"{reverse('main')}?cities={pk}&sort=population")
+
+
+class IncrementalRefreshTests(TestCase):
+
+    def setUp(self):
+        cold_cache()
+        self.cities = make_cities(6)
+
+    def test_one_rebuild_per_transaction(self):
+        with mock.patch.object(scoring, 'rebuild_scores', wraps=scoring.rebuild_scores) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                for city in self.cities:
+                    city.population += 1000
+                    city.save()
+        rebuild.assert_called_once_with(set(REGIONS))
+
+    def test_rename_bumps_version(self):
+        self.client.get(reverse('home'))
+        leader = CityScore.objects.get(rank=1).locality
+        leader.city = "Переименованный"
+        with self.captureOnCommitCallbacks(execute=True):
+            leader.save()
+        self.assertContains(self.client.get(reverse('home')), "Переименованный")
+
+    def test_refresh_after_rollback(self):
+        city = self.cities[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                city.population = 1
+                city.save()
+                raise ValueError
+
+        city.refresh_from_db()
+        city.population *= 50
+        with self.captureOnCommitCallbacks(execute=True):
+            city.save()
+        score = CityScore.objects.get(locality=city)
+        self.assertEqual(score.data_version, DataVersion.current())
+        self.assertAlmostEqual(score.inv_index, city.calculate_inv_index())
+
+    def assertRanksConsistent(self):
+        expected = list(CityScore.objects.order_by('-inv_index', 'locality_id').values_list('locality_id', flat=True))
+        ranked = list(CityScore.objects.order_by('rank').values_list('locality_id', 'rank'))
+        self.assertEqual(ranked, [(locality_id, rank) for rank, locality_id in enumerate(expected, start=1)])
+
+    def test_rerank_limited_to_affected_span(self):
+        make_cities(30, start=100)
+        # Город в собственном регионе: пересчёт задевает только его место
+        city = self.cities[0]
+        with scoring.score_refresh_suspended():
+            Locality.objects.filter(pk=city.pk).update(region="Отдельная область")
+            rebuild_scores()
+        old_rank = CityScore.objects.get(locality=city).rank
+        economics = city.economics.latest('year')
+        economics.unemployment_rate = 40
+        with mock.patch.object(scoring, '_rerank', wraps=scoring._rerank) as rerank:
+            with self.captureOnCommitCallbacks(execute=True):
+                economics.save()
+        new_rank = CityScore.objects.get(locality=city).rank
+        self.assertGreater(new_rank, old_rank)
+        (_, first, last), _ = rerank.call_args
+        self.assertEqual((first, last), (old_rank, new_rank))
+        self.assertLess(last - first + 1, CityScore.objects.count())
+        self.assertRanksConsistent()
+
+    def test_rerank_after_delete(self):
+        make_cities(30, start=100)
+        with mock.patch.object(scoring, '_rerank', wraps=scoring._rerank) as rerank:
+            with self.captureOnCommitCallbacks(execute=True):
+                CityScore.objects.get(rank=3).locality.delete()
+        (_, first, last), _ = rerank.call_args
+        self.assertIsNone(last)
+        self.assertRanksConsistent()
+
+
+class LoaderTests(TestCase):
+
+    def record(self, infrastructure):
+        return {
+            'oktmo_code': '12345678901', 'city_name': "Город", 'region': REGIONS[0],
+            'population': 20000, 'ndfl': 9000000, 'unemployment_rate': 4.5,
+            'infrastructure': infrastructure, 'fingerprint': 'f',
+        }
+
+    def test_failed_infrastructure_keeps_previous_counts(self):
+        upsert_cities([self.record({'schools': 7, 'gas_stations': 3, 'bus_stops': 40})])
+        before = InfrastructureData.objects.get()
+
+        stats = upsert_cities([self.record(None)])
+        after = InfrastructureData.objects.get()
+        self.assertEqual((after.schools, after.bus_stops, after.fetched_at),
+                         (before.schools, before.bus_stops, before.fetched_at))
+        self.assertEqual(stats.counts['infrastructuredata'], (0, 0))
+        self.assertEqual(stats.counts['locality'], (0, 1))
+
+    def test_failed_infrastructure_for_new_city(self):
+        upsert_cities([self.record(None)])
+        self.assertEqual(Locality.objects.count(), 1)
+        self.assertFalse(InfrastructureData.objects.exists())
+
+
+class ScoringTests(TestCase):
+
+    def setUp(self):
+        make_cities(20)
+        # Без инфраструктуры, с более поздним годом и с единственным годом
+        InfrastructureData.objects.filter(locality__oktmo_code__in=['45000000003', '45000000007']).delete()
+        city = Locality.objects.get(oktmo_code='45000000005')
+        EconomicData.objects.create(locality=city, year=2024, ndfl_total=city.population * 900, unemployment_rate=9)
+        EconomicData.objects.filter(locality__oktmo_code='45000000011', year=2023).delete()
+        # Без безработицы за последний год и без населения
+        EconomicData.objects.filter(locality__oktmo_code='45000000013', year=2023).update(unemployment_rate=None)
+        Locality.objects.filter(oktmo_code='45000000014').update(population=0)
+        rebuild_scores()
+
+    def test_batch_matches_per_object(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            frame = scoring.score_frame()
+        scores = dict(CityScore.objects.values_list('locality_id', 'inv_index'))
+        self.assertEqual(len(scores), 20)
+        for city in Locality.objects.all():
+            expected = city.calculate_inv_index()
+            self.assertEqual(frame.loc[city.pk, 'inv_index'], expected, city.oktmo_code)
+            self.assertEqual(scores[city.pk], expected, city.oktmo_code)
+
+    def test_missing_components_scored_as_zero(self):
+        scores = {score.locality.oktmo_code: score for score in CityScore.objects.select_related('locality')}
+        self.assertEqual(scores['45000000013'].demo_score, 0.0)
+        self.assertEqual((scores['45000000014'].eco_score, scores['45000000014'].infra_score), (0.0, 0.0))
+        self.assertEqual(sorted(score.rank for score in scores.values()), list(range(1, 21)))
+
+
+class RegionStatsTests(TestCase):
+
+    def setUp(self):
+        self.city = Locality.objects.create(city="Пустой", region="Пустой регион", population=0, oktmo_code='1')
+        EconomicData.objects.create(locality=self.city, year=2023, ndfl_total=1000, unemployment_rate=5)
+        make_cities(3)
+
+    def test_region_without_population(self):
+        stats = RegionStats.compute(["Пустой регион", REGIONS[0]])
+        self.assertIsNone(stats["Пустой регион"].ndfl_median)
+        self.assertIsNotNone(stats[REGIONS[0]].ndfl_median)
+
+        # Одна и та же замена базы в поштучном и пакетном расчёте
+        score = CityScore.objects.get(locality=self.city)
+        self.assertEqual(score.eco_score, 0.0)
+        self.assertEqual(self.city.calculate_inv_index(), score.inv_index)
+
+    def test_read_does_not_persist(self):
+        RegionStats.invalidate([REGIONS[0]])
+        # Чтение сохранённой статистики и два запроса compute(), без записи
+        with self.assertNumQueries(3):
+            stats = RegionStats.for_region(REGIONS[0])
+        self.assertIsNotNone(stats.ndfl_median)
+        self.assertFalse(RegionStats.objects.filter(region=REGIONS[0]).exists())
+
+
+class HttpCacheTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'http.sqlite3')
+        # Часы кэша идут на секунду за каждое обращение
+        clock = mock.patch('core.ingest.http_cache.time')
+        clock.start().time.side_effect = itertools.count(1000)
+        self.addCleanup(clock.stop)
+
+    def open(self, **options):
+        http_cache = HttpCache(self.path, **options)
+        self.addCleanup(http_cache.close)
+        return http_cache
+
+    def test_ttl_expiry(self):
+        http_cache = self.open(ttls={'nominatim': 1})
+        http_cache.set('nominatim', "Тестовск", [{'lat': '1'}])
+        self.assertEqual(http_cache.get('nominatim', "  тестовск "), [{'lat': '1'}])
+        self.assertIsNone(http_cache.get('nominatim', "Тестовск"))
+        self.assertEqual((http_cache.hits, http_cache.misses), (1, 1))
+
+        http_cache.purge_expired()
+        self.assertIsNone(self.open(ttls={'nominatim': 10 ** 6}).get('nominatim', "Тестовск"))
+
+    def test_refresh(self):
+        self.open().set('nominatim', "Тестовск", ['старый'])
+        self.open().set('overpass', "query", ['счётчики'])
+        http_cache = self.open(refresh={'nominatim'})
+        self.assertEqual(http_cache.fetch('nominatim', "Тестовск", lambda: ['новый']), ['новый'])
+        self.assertEqual(http_cache.fetch('overpass', "query", lambda: ['лишний запрос']), ['счётчики'])
+        self.assertEqual(self.open().get('nominatim', "Тестовск"), ['новый'])
+
+    def test_offline(self):
+        self.open().set('nominatim', "Тестовск", ['сохранён'])
+        http_cache = self.open(offline=True)
+        compute = mock.Mock(return_value=['из сети'])
+        self.assertEqual(http_cache.fetch('nominatim', "Тестовск", compute), ['сохранён'])
+        with self.assertLogs('core.ingest.http_cache', 'WARNING'):
+            self.assertIsNone(http_cache.fetch('nominatim', "Проверочный", compute))
+        compute.assert_not_called()
+
+    def test_eviction(self):
+        # В кэш помещаются две записи по 102 байта
+        http_cache = self.open(max_bytes=250)
+        http_cache.set('nominatim', 'a', 'x' * 100)
+        http_cache.set('nominatim', 'b', 'x' * 100)
+        http_cache.get('nominatim', 'a')
+        with self.assertLogs('core.ingest.http_cache', 'INFO'):
+            http_cache.set('nominatim', 'c', 'x' * 100)
+        self.assertIsNone(http_cache.get('nominatim', 'b'))
+        self.assertIsNotNone(http_cache.get('nominatim', 'a'))
+        self.assertIsNotNone(http_cache.get('nominatim', 'c'))
+
+    def test_not_created_on_import(self):
+        self.assertFalse(hasattr(fetch_data, 'HTTP_CACHE'))
+        with mock.patch.object(fetch_data, 'HTTP_CACHE_PATH', self.path):
+            http_cache = fetch_data.open_http_cache(offline=True)
+        http_cache.close()
+        self.assertTrue(http_cache.offline)
+        self.assertTrue(os.path.exists(self.path))
+
+
+class HttpClientTests(TestCase):
+
+    def setUp(self):
+        limiters = mock.patch.dict(LIMITERS, {'test': HostLimiter('test', max_concurrency=1, min_interval=0)})
+        limiters.start()
+        self.addCleanup(limiters.stop)
+        sleep = mock.patch.object(client.time, 'sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        quiet = mock.patch.object(client, 'logger')
+        quiet.start()
+        self.addCleanup(quiet.stop)
+        self.http = client.HttpClient('test', max_retries=3)
+
+    def respond(self, *responses):
+        """Ответы сессии по очереди: (код, заголовки)"""
+        results = []
+        for status, headers in responses:
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            results.append(response)
+        request = mock.patch.object(self.http.session, 'request', side_effect=results)
+        self.addCleanup(request.stop)
+        return request.start()
+
+    def test_retry_after_seconds(self):
+        self.respond((429, {'Retry-After': '7'}), (200, {}))
+        self.assertEqual(self.http.get('http://test/').status_code, 200)
+        self.sleep.assert_called_once_with(7.0)
+        self.assertEqual(self.http.retries, 1)
+
+    def test_retry_after_capped(self):
+        self.respond((503, {'Retry-After': '86400'}), (200, {}))
+        self.http.get('http://test/')
+        self.sleep.assert_called_once_with(client.MAX_BACKOFF)
+
+    def test_retry_after_http_date(self):
+        response = requests.Response()
+        response.headers['Retry-After'] = format_datetime(
+            datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True,
+        )
+        self.assertAlmostEqual(client.retry_after(response), 30, delta=2)
+        response.headers['Retry-After'] = "Mon, 01 Jan 2001 00:00:00 GMT"
+        self.assertEqual(client.retry_after(response), 0.0)
+        response.headers['Retry-After'] = "завтра"
+        self.assertIsNone(client.retry_after(response))
+
+    def test_retry_beyond_deadline(self):
+        request = self.respond((429, {'Retry-After': '100'}), (200, {}))
+        with client.city_deadline(60):
+            with self.assertRaises(client.DeadlineExceeded):
+                self.http.get('http://test/')
+        self.sleep.assert_not_called()
+        self.assertEqual(request.call_count, 1)
+
+    def test_deadline_limits_timeout(self):
+        request = self.respond((200, {}))
+        with client.city_deadline(5):
+            self.http.get('http://test/', timeout=30)
+        self.assertLessEqual(request.call_args.kwargs['timeout'], 5)
+
+    def test_retries_exhausted(self):
+        self.respond((504, {'Retry-After': '0'}), (504, {'Retry-After': '0'}), (504, {}))
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.http.get('http://test/')
+        self.assertEqual(self.http.retries, 2)
+
+
+OSM_EXTRACT = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="55.05" lon="37.05"><tag k="amenity" v="school"/></node>
+  <node id="2" lat="55.02" lon="37.02"><tag k="highway" v="bus_stop"/></node>
+  <node id="3" lat="55.2" lon="37.05"><tag k="highway" v="bus_stop"/></node>
+  <node id="4" lat="56.01" lon="38.0"><tag k="amenity" v="fuel"/></node>
+  <node id="5" lat="56.04" lon="38.07"><tag k="highway" v="bus_stop"/></node>
+  <node id="6" lat="55.055" lon="37.055"/>
+  <node id="7" lat="55.065" lon="37.055"/>
+  <node id="8" lat="55.065" lon="37.065"/>
+  <node id="9" lat="55.055" lon="37.065"/>
+  <node id="10" lat="56.0" lon="38.005"/>
+  <node id="11" lat="56.002" lon="38.007"/>
+  <way id="100"><nd ref="6"/><nd ref="7"/><nd ref="8"/><nd ref="9"/><nd ref="6"/><tag k="amenity" v="school"/></way>
+  <way id="101"><nd ref="10"/><nd ref="11"/><tag k="amenity" v="fuel"/></way>
+  <way id="102"><nd ref="6"/><nd ref="7"/><tag k="highway" v="bus_stop"/></way>
+  <relation id="200"><member type="way" ref="100" role="outer"/><tag k="amenity" v="school"/></relation>
+</osm>
+"""
+
+
+def baseline_city_name(text, valid_names):
+    """Поштучное извлечение названия, как в fetch_data.ndfl() до векторизации"""
+    if pd.isna(text):
+        return None
+    for match in re.findall(r'г\.\s*[А-ЯЁа-яё][А-ЯЁа-яё\s\-]*', str(text)):
+        normalized = re.sub(r'г\.\s*', 'г. ', match)
+        if normalized in valid_names:
+            return normalized
+    return None
+
+
+class SourcesTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def test_city_names_match_baseline(self):
+        valid_names = {"г. Тестовск", "г. Сбойск", "г. Новый Уренгой", "г. Комсомольск-на-Амуре"}
+        names = pd.Series([
+            "г. Тестовск", "г.Сбойск", "г.  Новый Уренгой", "Муниципальный округ г. Нет, г. Тестовск",
+            "г. Комсомольск-на-Амуре (городской округ)", "пгт. Тестовск", None, float('nan'), 42, "",
+        ], index=range(10, 20))
+        extracted = sources.extract_city_names(names, valid_names)
+        self.assertEqual(extracted.index.tolist(), names.index.tolist())
+        self.assertEqual([None if pd.isna(name) else name for name in extracted],
+                         [baseline_city_name(text, valid_names) for text in names])
+
+    def test_city_names_match_baseline_on_bundled_data(self):
+        ndfl = sources.normalize_ndfl(pd.read_excel(fetch_data.NDLF_FILE))
+        valid_names = set(ndfl['Название'].dropna())
+        names = pd.read_excel(fetch_data.POPULATION_FILE)['Название']
+        extracted = sources.extract_city_names(names, valid_names)
+        mismatches = [
+            (text, name)
+            for text, name in zip(names, extracted)
+            if (None if pd.isna(name) else name) != baseline_city_name(text, valid_names)
+        ]
+        self.assertEqual(mismatches, [])
+        self.assertGreater(extracted.notna().sum(), 0)
+
+    def write_source(self, rate):
+        path = os.path.join(self.dir, 'unemployment.xlsx')
+        pd.DataFrame({'Unnamed: 0': ["Тестовая область", "Тестовый край"], 2023: [rate, 3.5]}).to_excel(path, index=False)
+        return path
+
+    def test_parquet_cache(self):
+        cache_dir = os.path.join(self.dir, 'sources')
+        path = self.write_source(4.5)
+        with self.assertLogs('core.ingest.sources', 'INFO'):
+            first = sources.load_source(path, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        with mock.patch.object(sources.pd, 'read_excel') as read_excel, self.assertLogs('core.ingest.sources', 'INFO'):
+            cached = sources.load_source(path, cache_dir=cache_dir)
+        read_excel.assert_not_called()
+        pd.testing.assert_frame_equal(cached, first)
+        self.assertIn(2023, cached.columns)
+
+        # Изменённый файл разбирается заново, старый кэш удаляется
+        self.write_source(6.0)
+        with self.assertLogs('core.ingest.sources', 'INFO'):
+            changed = sources.load_source(path, cache_dir=cache_dir)
+        self.assertEqual(changed[2023].tolist(), [6.0, 3.5])
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+
+def baseline_unemployment_rate(region_raw, unemp_dict, alias_map):
+    """Перебор всей таблицы, как в fetch_data.find_unemployment_rate() до RegionResolver"""
+    if not region_raw:
+        return None
+    if region_raw in unemp_dict:
+        return unemp_dict[region_raw]
+    if region_raw in alias_map:
+        full_name = alias_map[region_raw]
+        if full_name in unemp_dict:
+            return unemp_dict[full_name]
+    region_clean = region_raw.replace(' ', '').lower()
+    for key in unemp_dict:
+        if isinstance(key, str):
+            key_clean = key.replace(' ', '').lower()
+            if region_clean in key_clean or key_clean in region_clean:
+                return unemp_dict[key]
+    return None
+
+
+class RegionResolverTests(TestCase):
+
+    def setUp(self):
+        frame = pd.read_excel(fetch_data.UNEMPLOYMENT_FILE)
+        self.rates = dict(zip(frame['Unnamed: 0'], frame[2023]))
+        self.resolver = RegionResolver(self.rates)
+
+    def assertMatchesBaseline(self, names):
+        mismatches = [
+            (name, self.resolver.value(name), baseline_unemployment_rate(name, self.rates, REGION_ALIAS))
+            for name in names
+            if self.resolver.value(name) != baseline_unemployment_rate(name, self.rates, REGION_ALIAS)
+        ]
+        self.assertEqual(mismatches, [])
+
+    def test_canonical_names_and_aliases(self):
+        keys = [key for key in self.rates if isinstance(key, str)]
+        self.assertMatchesBaseline(keys)
+        self.assertMatchesBaseline(list(REGION_ALIAS))
+        self.assertMatchesBaseline(['Тюменская', 'Ханты-Мансийский автономный округ', 'Удмуртская Республика (Удмуртия)'])
+        for alias, full_name in REGION_ALIAS.items():
+            self.assertEqual(self.resolver.resolve(alias), full_name)
+
+    def test_compact_match_preferred_to_containment(self):
+        """
+        Без пробелов и регистра название сопоставляется со своим регионом.
+        Прежний перебор брал первый ключ, содержащий название:
+        «ОМСКАЯ ОБЛАСТЬ» становилась Костромской, «ТОМСКАЯ ОБЛАСТЬ» — Омской.
+        """
+        keys = [key for key in self.rates if isinstance(key, str)]
+        for key in keys:
+            self.assertEqual(self.resolver.resolve(key.upper()), key)
+            self.assertEqual(self.resolver.resolve(key.replace(' ', '')), key)
+        self.assertEqual(baseline_unemployment_rate('ОМСКАЯ ОБЛАСТЬ', self.rates, REGION_ALIAS),
+                         self.rates['Костромская область'])
+        self.assertEqual(self.resolver.value('ОМСКАЯ ОБЛАСТЬ'), self.rates['Омская область'])
+
+    def test_nominatim_display_names(self):
+        display_names = {
+            "Старый Оскол, Старооскольский городской округ, Белгородская область, 309500, Россия": "Белгородская область",
+            "Абакан, городской округ Абакан, Хакасия, Россия": "Республика Хакасия",
+            "Сестрорецк, Курортный район, Санкт-Петербург, Россия": "г.Санкт-Петербург",
+            "Ханты-Мансийск, Ханты-Мансийский автономный округ — Югра, Россия":
+                "Ханты-Мансийский автономный округ - Югра",
+            "Нарьян-Мар, Ненецкий автономный округ, Россия": "Ненецкий автономный округ",
+            "Якутск, городской округ Якутск, Республика Саха (Якутия), Россия": "Республика Саха (Якутия)",
+            "Черкесск, Карачаево-Черкесия, Россия": "Карачаево-Черкесская Республика",
+            "Владикавказ, Республика Северная Осетия — Алания, Россия": "Республика Северная Осетия - Алания",
+            "Новокузнецк, Новокузнецкий городской округ, Кемеровская область — Кузбасс, Россия": "Кемеровская область",
+        }
+        regions = [extract_region_from_osm(name) for name in display_names]
+        self.assertEqual([self.resolver.resolve(region) for region in regions], list(display_names.values()))
+        self.assertMatchesBaseline(regions + ['Луна', '', None])
+
+    def test_unresolved_names_reported(self):
+        self.assertIsNone(self.resolver.value('Луна'))
+        # Без значимых слов регион не угадывается (прежний перебор брал первую строку таблицы)
+        self.assertIsNone(self.resolver.value('область'))
+        self.assertEqual(self.resolver.unresolved, {'Луна', 'область'})
+        self.assertIn('Луна', self.resolver.report())
+
+
+class OverpassQueryTests(TestCase):
+
+    def test_counts_assigned_per_area(self):
+        areas = [
+            overpass.area_clause({'type': 'bbox', 'min_lat': 55.0, 'max_lat': 55.1, 'min_lon': 37.0, 'max_lon': 37.1}),
+            overpass.area_clause({'type': 'center', 'lat': 56.0, 'lon': 38.0}),
+        ]
+        query = overpass.build_count_query(areas)
+        self.assertTrue(query.startswith('[out:json][timeout:120];'))
+
+        # Операторы идут по областям, внутри области — в порядке INFRA_TAGS
+        statements = query.split('out count;')[:-1]
+        expected = [(area, key) for area in areas for key in overpass.INFRA_TAGS]
+        self.assertEqual(len(statements), len(expected))
+        for statement, (area, key) in zip(statements, expected):
+            element_types, tag_key, tag_value = overpass.INFRA_TAGS[key]
+            for element_type in element_types:
+                self.assertIn(f'{element_type}["{tag_key}"="{tag_value}"]({area});', statement)
+
+        totals = [7, 2, 31, 4, 1, 12]
+        response = {'elements': [
+            {'type': 'count', 'id': 0, 'tags': {'nodes': str(total), 'total': str(total)}} for total in totals
+        ]}
+        self.assertEqual(overpass.parse_counts(response, 2), [
+            {'schools': 7, 'gas_stations': 2, 'bus_stops': 31},
+            {'schools': 4, 'gas_stations': 1, 'bus_stops': 12},
+        ])
+        with self.assertRaises(ValueError):
+            overpass.parse_counts({'elements': response['elements'][:5]}, 2)
+
+
+class OsmExtractTests(TestCase):
+
+    AREAS = [
+        {'type': 'bbox', 'min_lat': 55.0, 'max_lat': 55.1, 'min_lon': 37.0, 'max_lon': 37.1},
+        # Круг around:5000; точка 5 попадает в его описанный квадрат, но не в круг
+        {'type': 'center', 'lat': 56.0, 'lon': 38.0},
+    ]
+
+    EXPECTED = [
+        {'schools': 2, 'gas_stations': 0, 'bus_stops': 1},
+        {'schools': 0, 'gas_stations': 2, 'bus_stops': 0},
+    ]
+
+    def write(self, name, content):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, name)
+        with (gzip.open if name.endswith('.gz') else open)(path, 'wt', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_counts_nodes_and_ways(self):
+        for name in ['extract.osm', 'extract.osm.gz']:
+            with self.subTest(name), self.assertLogs('core.ingest.osm_extract', 'INFO'):
+                counts = osm_extract.count_infrastructure(self.write(name, OSM_EXTRACT), self.AREAS)
+            self.assertEqual(counts, self.EXPECTED)
+
+    def test_unsorted_extract_rejected(self):
+        way = '  <way id="101"><nd ref="10"/><nd ref="11"/><tag k="amenity" v="fuel"/></way>\n'
+        unsorted = OSM_EXTRACT.replace(way, '').replace('  <node id="10"', way + '  <node id="10"')
+        with self.assertRaisesRegex(ValueError, "osmium sort"), self.assertLogs('core.ingest.osm_extract', 'INFO'):
+            osm_extract.count_infrastructure(self.write('unsorted.osm', unsorted), self.AREAS)
+
+
+class CityDeadlineTests(TestCase):
+
+    def test_deadline_shared_between_stages(self):
+        deadlines = client.CityDeadlines(60)
+        with deadlines.scope(['a']):
+            first = client._remaining()
+        with mock.patch.object(client.time, 'monotonic', return_value=client.time.monotonic() + 50):
+            with deadlines.scope(['b', 'a']):
+                self.assertLess(client._remaining(), 10)
+        self.assertGreater(first, 59)
+        self.assertIsNone(client._remaining())
+
+
+class FetchDataTests(TestCase):
+    """fetch_and_save_data против локальной замены Nominatim и Overpass со сбоями"""
+
+    CITIES = ["Тестовск", "Проверочный", "Сбойск", "Повторск", "Запасный"]
+
+    def setUp(self):
+        # seed=1: первый же ответ сервера — сбой, дальше примерно каждый второй
+        self.server = make_server('127.0.0.1', 0, p429=0.3, p5xx=0.2, retry_after=0, seed=1)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.http_cache = HttpCache(os.path.join(tmp.name, 'http.sqlite3'))
+        self.addCleanup(self.http_cache.close)
+
+        frame = pd.DataFrame({
+            'Название': [f"г. {name}" for name in self.CITIES],
+            'ОКТМО': [f"46{n:09d}" for n in range(len(self.CITIES))],
+            'Население': [20000 + n * 1000 for n in range(len(self.CITIES))],
+            'НДФЛ': [900000000 + n * 1000000 for n in range(len(self.CITIES))],
+        })
+        url = f"http://127.0.0.1:{self.server.server_port}"
+        self.geocoded = []
+        geocoder = fetch_data.get_city_coordinates
+
+        def get_city_coordinates(city_name, region_name=None, http_cache=None):
+            self.geocoded.append(city_name)
+            return geocoder(city_name, region_name, http_cache)
+
+        for patcher in [
+            mock.patch.object(fetch_data, 'NOMINATIM_API_URL', f"{url}/search"),
+            mock.patch.object(fetch_data, 'OVERPASS_API_URL', f"{url}/interpreter"),
+            mock.patch.object(fetch_data, 'ndfl', lambda path: frame.copy()),
+            mock.patch.object(fetch_data, 'get_unemployment_data', lambda: {region: 5.0 for region in FAKE_REGIONS}),
+            mock.patch.object(fetch_data, 'get_city_coordinates', get_city_coordinates),
+            # Без пауз: ограничители и повторы — как у собственного инстанса
+            mock.patch.dict(LIMITERS, {
+                'nominatim': HostLimiter('nominatim', max_concurrency=1, min_interval=0),
+                'overpass': HostLimiter('overpass', max_concurrency=2, min_interval=0, burst=2),
+            }),
+            mock.patch.object(fetch_data.NOMINATIM, 'backoff', 0),
+            mock.patch.object(fetch_data.NOMINATIM, 'max_retries', 20),
+            mock.patch.object(fetch_data.OVERPASS, 'backoff', 0),
+            mock.patch.object(fetch_data.OVERPASS, 'max_retries', 20),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def server_stats(self):
+        return self.server.RequestHandlerClass.services.stats
+
+    def fetch(self, **kwargs):
+        with self.assertLogs('core', 'INFO'):
+            return fetch_data.fetch_and_save_data(workers=2, http_cache=self.http_cache, **kwargs)
+
+    def test_end_to_end_with_retries(self):
+        report = self.fetch(overpass_batch=2)
+
+        self.assertEqual(Locality.objects.count(), len(self.CITIES))
+        self.assertEqual(EconomicData.objects.count(), len(self.CITIES))
+        self.assertEqual(InfrastructureData.objects.count(), len(self.CITIES))
+        self.assertEqual(CityScore.objects.count(), len(self.CITIES))
+        self.assertTrue(set(Locality.objects.values_list('region', flat=True)) <= set(FAKE_REGIONS))
+
+        # Каждый ответ со сбоем (включая 429 за превышение слотов) повторяется
+        stats = self.server_stats()
+        failed = sum(count for key, count in stats.items() if not key.endswith(('.requests', '.count_statements')))
+        retries = report.stage('geocode').retries + report.stage('infra').retries
+        self.assertGreater(sum(count for key, count in stats.items() if '.injected_' in key), 0)
+        self.assertEqual(retries, failed)
+        self.assertEqual(report.stage('load').items_out, len(self.CITIES))
+        self.assertEqual(IngestionRun.objects.get().status, 'completed')
+
+    def test_resume_skips_completed_cities(self):
+        record = RunCheckpoint.record
+        calls = []
+
+        def interrupted(checkpoint, oktmo_code, city_name, payload):
+            # Прерывание после трёх сохранённых городов
+            calls.append(city_name)
+            if len(calls) > 3:
+                raise KeyboardInterrupt
+            return record(checkpoint, oktmo_code, city_name, payload)
+
+        with mock.patch.object(RunCheckpoint, 'record', interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                self.fetch()
+        run = IngestionRun.objects.get()
+        self.assertEqual(run.status, 'failed')
+        completed = set(run.items.values_list('city_name', flat=True))
+        self.assertEqual(len(completed), 3)
+
+        self.geocoded.clear()
+        report = self.fetch(resume='latest')
+        self.assertEqual(IngestionRun.objects.get().status, 'completed')
+        self.assertEqual(report.stage('extract').dropped, len(completed))
+        self.assertEqual(set(self.geocoded), set(self.CITIES) - completed)
+        self.assertEqual(Locality.objects.count(), len(self.CITIES))
+        self.assertEqual(InfrastructureData.objects.count(), len(self.CITIES))
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        cold_cache()
+        make_cities(5)
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True, is_superuser=True)
+
+    def test_staff_profile_saved(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('main'), {'profile': 1, 'region': REGIONS[0]})
+        profile = RequestProfile.objects.get(pk=response.headers['X-Profile-Id'])
+        self.assertEqual(profile.view_name, 'main')
+        self.assertEqual(profile.queries, len(profile.query_log))
+        self.assertIn('main_view', profile.summary)
+
+        download = self.client.get(reverse('admin:core_requestprofile_download', args=[profile.pk]))
+        self.assertEqual(download.content, bytes(profile.stats))
+        self.assertEqual(self.client.get(reverse('admin:core_requestprofile_changelist')).status_code, 200)
+        detail = self.client.get(reverse('admin:core_requestprofile_change', args=[profile.pk]))
+        self.assertContains(detail, 'main_view')
+
+    def test_not_staff(self):
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        response = self.client.get(reverse('main'), {'profile': 1})
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILE_STORE_MAX_COUNT=2)
+    def test_retention(self):
+        self.client.force_login(self.staff)
+        ids = [self.client.get(reverse('home'), HTTP_X_PROFILE='1').headers['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(
+            sorted(RequestProfile.objects.values_list('pk', flat=True)), sorted(int(pk) for pk in ids[1:]),
+        )
+
+
+class SyntheticBenchmarkTests(TestCase):
+
+    def test_generate_and_benchmark(self):
+        created = synthetic.generate(60, regions=7, years=[2022, 2023], seed=1)
+        self.assertEqual(created['economicdata'], 120)
+        self.assertEqual(Locality.objects.count(), 60)
+        populations = Locality.objects.values_list('population', flat=True)
+        self.assertTrue(all(synthetic.POPULATION_RANGE[0] <= p <= synthetic.POPULATION_RANGE[1] for p in populations))
+        rebuild_scores()
+        self.assertEqual(RegionStats.objects.count(), len(set(Locality.objects.values_list('region', flat=True))))
+
+        # Запросы проходят через стек MIDDLEWARE, а не напрямую в представление
+        process_request = SessionMiddleware.process_request
+        with mock.patch.object(SessionMiddleware, 'process_request', autospec=True,
+                               side_effect=process_request) as session:
+            report = benchmark.run(iterations=1, only=['main:region', 'compare:10', 'export_csv'])
+        self.assertEqual(report['dataset']['cities'], 60)
+        self.assertEqual([item['status'] for item in report['scenarios']], [200, 200, 200])
+        self.assertEqual(session.call_count, 3 * 3)
+        self.assertFalse(User.objects.exists())
+
+        version = DataVersion.current()
+        make_cities(4)
+        self.assertEqual(synthetic.clear(), 60)
+        self.assertFalse(EconomicData.objects.filter(locality__oktmo_code__startswith='00').exists())
+        self.assertGreater(DataVersion.current(), version)
+        self.assertEqual(sorted(CityScore.objects.values_list('rank', flat=True)), [1, 2, 3, 4])
+        self.assertEqual(RegionStats.objects.count(), len(set(Locality.objects.values_list('region', flat=True))))
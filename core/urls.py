@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 from django.contrib.auth import views as auth_views
 
 
@@ -21,4 +21,16 @@ urlpatterns = [
     path('register/', views.register, name = 'register'),
 
     path('export/csv/', views.export_cities_csv, name = 'export_csv'),
+
+    path('export/<str:fmt>/', views.export_cities_columnar, name = 'export_columnar'),
+
+    path('api/ranking/', api.ranking, name = 'api_ranking'),
+
+    path('api/regions/<str:region>/', api.region_ranking, name = 'api_region'),
+
+    path('api/cities/<int:pk>/', api.city_detail, name = 'api_city'),
+
+    path('api/compare/', api.compare, name = 'api_compare'),
+
+    path('api/compare/figure/', api.compare_figure, name = 'api_compare_figure'),
 ]
\ No newline at end of file
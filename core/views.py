@@ -1,13 +1,21 @@
 from django.shortcuts import render,redirect
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
-from core.models import Locality
+from core.models import CityScore, Locality
 from .forms import CityFilterForm, ComparisonForm
+from . import charts, exports
+from .caching import cached, filter_params
+from .pagination import InvalidCursor, KeysetPaginator, SortField
 from django.contrib import messages
-import plotly.graph_objects as go
 from django.contrib.auth.decorators import login_required
 import csv
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.db.models import Avg, Count, F
+from django.urls import reverse
+
+
+# Размер пачки строк при потоковом экспорте
+EXPORT_CHUNK_SIZE = 2000
 
 
 def register(request):
@@ -22,135 +30,169 @@ def register(request):
     return render(request, 'core/register.html', {'form': form})
 
 def home_view(request):
-    cities = Locality.objects.filter(is_active=True).select_related('infrastructure')
-    total_index = 0
-    top_cities_list = []
-    
-    for city in cities:
-        index = city.calculate_inv_index()
-        total_index += index
-        top_cities_list.append((city, index))
-    
-    top_cities_list.sort(key=lambda x: x[1], reverse=True)
-    top_cities = [city for city, _ in top_cities_list[:5]]
-    
-    avg_index = total_index / len(cities)
-    context = {
-    'cities_count': len(cities),
-    'regions_count': cities.values('region').distinct().count(),
-    'avg_index': avg_index,
-    'top_cities_with_index': top_cities_list[:5]
+    return render(request, 'core/home.html', cached('home', None, _home_context))
+
+def _home_context():
+    scores = CityScore.objects.filter(locality__is_active=True)
+    stats = scores.aggregate(
+        cities_count = Count('pk'),
+        regions_count = Count('region', distinct=True),
+        avg_index = Avg('inv_index'),
+    )
+    top_cities = scores.select_related('locality').order_by('rank')[:5]
+
+    return {
+    'cities_count': stats['cities_count'],
+    'regions_count': stats['regions_count'],
+    'avg_index': stats['avg_index'] or 0,
+    'top_cities_with_index': [(score.locality, score.inv_index) for score in top_cities]
     }
-    return render(request, 'core/home.html', context)
+
+# Колонки таблицы /main/, по которым доступна сортировка
+MAIN_SORT_FIELDS = {
+    'city': SortField("Город", 'city', 'asc'),
+    'population': SortField("Население", 'population'),
+    'ndfl': SortField("НДФЛ(тыс ₽)", 'ndfl_total'),
+    'schools': SortField("Школы", 'infrastructure__schools', null_value=-1),
+    'gas_stations': SortField("АЗС", 'infrastructure__gas_stations', null_value=-1),
+    'bus_stops': SortField("Остановки", 'infrastructure__bus_stops', null_value=-1),
+    # Готовый индекс из CityScore: курсор (inv_index, locality_id) идёт по индексу таблицы
+    'index': SortField("Индекс", 'score__inv_index', tiebreak='score__locality_id'),
+}
 
 def main_view(request):
     form = CityFilterForm(request.GET or None)
-    cities_queryset = Locality.objects.filter(is_active=True).select_related('infrastructure')
-
-    if form.is_valid():
-        if form.cleaned_data['region']:
-            cities_queryset = cities_queryset.filter(region=form.cleaned_data['region'])
-        if form.cleaned_data['population_min']:
-            cities_queryset = cities_queryset.filter(population__gte=form.cleaned_data['population_min'])
-        if form.cleaned_data['population_max']:
-            cities_queryset = cities_queryset.filter(population__lte=form.cleaned_data['population_max'])
-
-    # Рассчитываем индекс и сортируем
-    cities_with_index = []
-    for city in cities_queryset:
-        index = city.calculate_inv_index()
-        city.cached_index = index
-        cities_with_index.append((city, index))
-
-    cities_with_index.sort(key=lambda x: x[1], reverse=True)
-    all_cities = [city for city, _ in cities_with_index]
-    top_20 = all_cities[:20]
+    cities_queryset = form.filter_queryset(
+        Locality.objects.filter(is_active=True, score__isnull=False)
+    ).with_latest_economics().annotate(
+        inv_index = F('score__inv_index'),
+    ).select_related('infrastructure')
+
+    sort = request.GET.get('sort', 'index')
+    try:
+        paginator = KeysetPaginator(
+            cities_queryset, MAIN_SORT_FIELDS,
+            sort = sort if sort in MAIN_SORT_FIELDS else 'index',
+            direction = request.GET.get('dir'),
+        )
+        after, before = request.GET.get('after'), request.GET.get('before')
+        page = cached('main', {
+            **filter_params(form),
+            'sort': paginator.sort, 'dir': paginator.direction,
+            'after': after, 'before': before,
+        }, lambda: paginator.page(after=after, before=before))
+    except InvalidCursor:
+        return redirect(f"{request.path}?{_without_cursor(request.GET).urlencode()}")
+
+    columns = []
+    for key, field in MAIN_SORT_FIELDS.items():
+        active = key == paginator.sort
+        if active:
+            next_direction = 'asc' if paginator.direction == 'desc' else 'desc'
+        else:
+            next_direction = field.default_direction
+        columns.append({
+            'key': key, 'label': field.label, 'active': active,
+            'direction': paginator.direction if active else None,
+            'next_direction': next_direction,
+        })
+
+    # Города, отмеченные для сравнения на других страницах, переносятся
+    # скрытыми полями формы вместе с фильтрами и сортировкой
+    selected = list(dict.fromkeys(int(pk) for pk in request.GET.getlist('cities') if pk.isdigit()))
+    page_ids = {city.pk for city in page['object_list']}
+    hidden_fields = [
+        (key, value) for key, values in request.GET.lists()
+        if key not in ('cities', 'after', 'before') for value in values
+    ] + [('cities', pk) for pk in selected if pk not in page_ids]
 
     return render(request, 'core/main.html', {
         'form': form,
-        'top_20': top_20,
-        'all_cities': all_cities,'show_full': request.GET.get('show') == 'all',
+        'cities': page['object_list'],
+        'columns': columns,
+        'next_cursor': page['next_cursor'],
+        'previous_cursor': page['previous_cursor'],
+        'selected': selected,
+        'selected_elsewhere': len(selected) - len(page_ids.intersection(selected)),
+        'hidden_fields': hidden_fields,
     })
 
+def _without_cursor(params):
+    params = params.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    return params
+
 def compare_cities(request):
-    if request.method == "POST":
-        form=ComparisonForm(request.POST, user=request.user)
+    # GET приходит из формы рейтинга: выбор собирается по нескольким страницам
+    data = request.POST if request.method == "POST" else request.GET
+    if 'cities' in data:
+        form=ComparisonForm(data, user=request.user)
         if form.is_valid():
-            cities = form.cleaned_data['cities']
-            categories = ['Экономика','Безработица','Инфраструктура']
-            fig=go.Figure()
-
-            for city in cities:
-                eco = city.economics.order_by('-year').first()
-                if not eco:
-                    continue
-
-                eco_score = min(eco.ndfl_per_capita / eco.ndfl_median(city.region), 1)    
-                demo_score = 1 - eco.unemployment_rate / 100
-                if hasattr(city, 'infrastructure'):
-                    infra_score = city.infrastructure.infra_score(city.region)  
-
-                fig.add_trace(go.Bar(
-                    name = city.city,
-                    x = categories,
-                    y = [eco_score,demo_score, infra_score],
-                    text = [f"{eco_score:.2f}",f"{demo_score:.2f}",f"{infra_score:.2f}"],
-                    textposition = 'auto'
-                ))
-            fig.update_layout(
-                title = "Сравнение компонентов инвестиционного индекса",
-                barmode = 'group',
-                yaxis = dict(range=[0, 1.5], title="Балл"),
-                xaxis = dict(title="Компоненты индекса")
-            )
-
-            chart_html = fig.to_html(
-                full_html = False,
-                include_plotlyjs = 'cdn',
-                config = {'displayModebar': False}
-            )
+            city_ids = [city.pk for city in form.cleaned_data['cities']]
 
             return render(request, 'core/compare.html',{
-                'cities': cities,
-                'chart_html': chart_html,
+                'rows': charts.compare_rows(city_ids),
+                # Готовая строка JSON из кэша, без разбора и повторного кодирования
+                'figure_json': charts.compare_figure_json(city_ids),
+                'plotly_config': charts.PLOTLY_CONFIG,
             })
         else:
             messages.error(request,"Error: " + "; ".join(form.errors['cities']))
+            if request.method == "GET":
+                return redirect(f"{reverse('main')}?{request.GET.urlencode()}")
             return redirect('main')
     
     return redirect('main')
 
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи"""
+    def write(self, value):
+        return value
+
+
 @login_required
 def export_cities_csv(request):
-    # Создаём HTTP-ответ с типом content-type для CSV
-    response = HttpResponse(content_type = 'text/csv; charset=utf-8')
-    response['Content-Disposition'] = 'attachment; filename="gorodindex_cities.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'Город', 'Регион', 'Население', 'ОКТМО',
-        'НДФЛ(тыс ₽)', 'Безработица (%)', 'Инвестиционный индекс'
-    ])
-    
-    cities = Locality.objects.filter(is_active=True).select_related(
-        'infrastructure'
-    ).prefetch_related('economics')
-    
-    for city in cities:
-        # Берём последние экономические данные
-        eco = city.economics.order_by('-year').first()
-        ndfl = eco.ndfl_total
-        unemployment = eco.unemployment_rate
-        index = city.calculate_inv_index()
-        
-        writer.writerow([
-            city.city,
-            city.region,
-            city.population,
-            city.oktmo_code,
-            f"{ndfl:.0f}",
-            unemployment,
-            f"{index:.2f}"
+    # Строки отдаются потоком: память не зависит от размера каталога
+    form = CityFilterForm(request.GET or None)
+    cities = form.filter_queryset(
+        Locality.objects.filter(is_active=True, score__isnull=False)
+    ).with_latest_economics().values_list(
+        'city', 'region', 'population', 'oktmo_code',
+        'ndfl_total', 'unemployment_rate', 'score__inv_index',
+    )
+    writer = csv.writer(Echo())
+
+    def rows():
+        yield writer.writerow([
+            'Город', 'Регион', 'Население', 'ОКТМО',
+            'НДФЛ(тыс ₽)', 'Безработица (%)', 'Инвестиционный индекс'
         ])
-    
-    return response
\ No newline at end of file
+        for city, region, population, oktmo_code, ndfl, unemployment, index in cities.iterator(
+            chunk_size = EXPORT_CHUNK_SIZE
+        ):
+            yield writer.writerow([
+                city,
+                region,
+                population,
+                oktmo_code,
+                f"{ndfl:.0f}",
+                unemployment,
+                f"{index:.2f}"
+            ])
+
+    response = StreamingHttpResponse(rows(), content_type = 'text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="gorodindex_cities.csv"'
+    return response
+
+
+@login_required
+def export_cities_columnar(request, fmt):
+    # Типизированная выгрузка для pandas/DuckDB: Parquet или Arrow IPC
+    if fmt not in exports.FORMATS:
+        raise Http404("Неизвестный формат выгрузки")
+    content_type, extension = exports.FORMATS[fmt]
+    form = CityFilterForm(request.GET or None)
+    response = HttpResponse(exports.export_bytes(fmt, form), content_type = content_type)
+    response['Content-Disposition'] = f'attachment; filename="gorodindex_cities.{extension}"'
+    return response